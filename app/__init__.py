@@ -55,7 +55,33 @@ def create_app(config_class=Config):
     def load_user(id):
         return User.query.get(int(id))
 
+    # Cliente OpenAI único por processo (conexões reaproveitadas entre requisições)
+    from app.utils.openai_client import init_openai_client
+
+    init_openai_client(app)
+
+    # Monta o índice de busca de alimentos em memória na inicialização
+    if (
+        app.config.get("FOOD_SEARCH_PRELOAD", True)
+        and app.config.get("FOOD_SEARCH_BACKEND", "memory") == "memory"
+    ):
+        preload_food_search(app)
+
     return app
 
+
+def preload_food_search(app):
+    """Constrói o índice de autocomplete; se falhar, ele é montado no primeiro uso."""
+    from app.utils.food_search import build_food_search_index
+
+    with app.app_context():
+        try:
+            index = build_food_search_index()
+            app.logger.info(f"Índice de busca de alimentos carregado ({len(index)} alimentos)")
+        except Exception as e:
+            # Tabela ainda não criada (ex.: antes das migrações)
+            db.session.rollback()
+            app.logger.warning(f"Índice de busca de alimentos não carregado: {e}")
+
 # Importa os modelos para que o Flask-Migrate possa detectá-los
 from app import models
@@ -1,12 +1,51 @@
-from flask import jsonify, request, send_file, current_app
+from flask import Response, jsonify, request, send_file, current_app, stream_with_context
 from flask_login import login_required, current_user
 from app import db
 from app.blueprints.api import bp
 from app.models import Diet, FoodData, UserFood
 from datetime import datetime
+import time
 import pandas as pd
 from io import BytesIO
-from app.constants import MEAL_TYPES
+from app.constants import MACRO_TYPES, MEAL_TYPES
+from app.decorators import admin_required
+from app.utils.chatbot_cache import (
+    cache_enabled,
+    chatbot_cache_stats,
+    get_cached_response,
+    response_cache_key,
+    store_cached_response,
+)
+from app.utils.chat_conversations import (
+    compact_conversation,
+    conversation_for_request,
+    conversation_stats,
+    record_turn,
+)
+from app.utils.chatbot_prompt import (
+    OUTPUT_MODES,
+    build_chatbot_messages,
+    completion_params,
+)
+from app.utils.chatbot_response import (
+    chatbot_stats,
+    record_chatbot_call,
+    reply_parser,
+    sse_event,
+)
+from app.utils.food_resolver import resolve_food, resolve_foods, resolver_stats
+from app.utils.food_retrieval import invalidate_user_food_retrieval
+from app.utils.food_search import (
+    get_food_search_index,
+    get_user_food_index,
+    get_user_food_usage,
+    invalidate_user_food_index,
+    rank_foods,
+    search_foods_db,
+    user_food_index_stats,
+)
+from app.utils.openai_client import get_openai_client
+from app.utils.prompt_budget import calibrate, prompt_stats
 
 
 @bp.route("/search_food")
@@ -17,58 +56,38 @@ def search_food():
     if len(query) < 2:
         return jsonify([])
 
-    # Search in FoodData (global foods)
-    foods_start = (
-        FoodData.query.filter(FoodData.code.ilike(f"{query}%")).limit(10).all()
+    limit = min(
+        request.args.get("limit", current_app.config["FOOD_SEARCH_LIMIT"], type=int), 50
     )
 
-    if len(foods_start) < 10:
-        start_ids = [food.id for food in foods_start]
-        query_obj = FoodData.query.filter(FoodData.code.ilike(f"%{query}%"))
-        if start_ids:
-            query_obj = query_obj.filter(~FoodData.id.in_(start_ids))
-        additional_foods = query_obj.limit(10 - len(foods_start)).all()
-        foods = foods_start + additional_foods
-    else:
-        foods = foods_start
-
-    # Search in UserFood (user's custom foods) - only if user is authenticated
-    user_foods = []
-    if current_user.is_authenticated:
-        user_foods_start = (
-            UserFood.query.filter(
-                UserFood.user_id == current_user.id, UserFood.code.ilike(f"{query}%")
-            )
-            .limit(10)
-            .all()
+    if current_app.config.get("FOOD_SEARCH_BACKEND", "memory") == "db":
+        # Consultas indexadas sobre search_code (sem acentos/caixa); alimentos
+        # do usuário primeiro, escondendo os globais de mesmo código
+        foods = []
+        if current_user.is_authenticated:
+            foods = search_foods_db(UserFood, query, limit, user_id=current_user.id)
+        codes = {food.code for food in foods}
+        foods += [
+            food
+            for food in search_foods_db(FoodData, query, limit)
+            if food.code not in codes
+        ]
+        return jsonify(
+            [{"food_code": food.code, "qtd": food.quantity} for food in foods[:limit]]
         )
 
-        if len(user_foods_start) < 10:
-            user_start_ids = [food.id for food in user_foods_start]
-            user_query_obj = UserFood.query.filter(
-                UserFood.user_id == current_user.id, UserFood.code.ilike(f"%{query}%")
-            )
-            if user_start_ids:
-                user_query_obj = user_query_obj.filter(~UserFood.id.in_(user_start_ids))
-            additional_user_foods = user_query_obj.limit(10 - len(user_foods_start)).all()
-            user_foods = user_foods_start + additional_user_foods
-        else:
-            user_foods = user_foods_start
+    # Ranked search over the in-memory indexes: user's custom foods overlay
+    # first (they shadow global foods with the same code), then FoodData
+    indexes = []
+    usage = None
+    if current_user.is_authenticated:
+        indexes.append(get_user_food_index(current_user.id))
+        usage = get_user_food_usage(current_user.id)
+    indexes.append(get_food_search_index())
 
-    # Combine results (limit to 10 total)
-    all_foods = foods + user_foods
+    foods = rank_foods(query, indexes, usage=usage, limit=limit)
 
-    # Deduplicate by food_code
-    seen_codes = set()
-    unique_foods = []
-    for food in all_foods[:10]:
-        if food.code not in seen_codes:
-            seen_codes.add(food.code)
-            unique_foods.append(food)
-
-    return jsonify(
-        [{"food_code": food.code, "qtd": food.quantity} for food in unique_foods]
-    )
+    return jsonify([{"food_code": food.code, "qtd": food.quantity} for food in foods])
 
 
 @bp.route("/food_nutrition", methods=["GET"])
@@ -81,45 +100,91 @@ def get_food_nutrition():
                 {"success": False, "error": "Código do alimento não fornecido"}
             ), 400
 
-        # First try to find in user's custom foods (only if authenticated)
-        user_food = None
-        if current_user.is_authenticated:
-            user_food = UserFood.query.filter_by(code=code, user_id=current_user.id).first()
-
-        if user_food:
-            quantity = float(request.args.get("quantity", user_food.quantity))
-            ratio = quantity / user_food.quantity
+        # User's custom foods take precedence over global foods
+        user_id = current_user.id if current_user.is_authenticated else None
+        food = resolve_food(code, user_id)
+        if food:
+            quantity = float(request.args.get("quantity", food.quantity))
             return jsonify(
                 {
                     "success": True,
-                    "food_code": user_food.code,
-                    "calories": user_food.calories * ratio,
-                    "proteins": user_food.proteins * ratio,
-                    "carbs": user_food.carbs * ratio,
-                    "fats": user_food.fats * ratio,
+                    "food_code": food.code,
+                    **food.nutrition(quantity),
                     "quantity": quantity,
                 }
             )
+        return jsonify({"success": False, "error": "Food not found"})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)})
 
-        # If not found in custom foods, try global foods
-        food = FoodData.query.filter_by(code=code).first()
-        if food:
-            quantity = float(request.args.get("quantity", food.quantity))
-            ratio = quantity / food.quantity
-            return jsonify(
+
+@bp.route("/food_nutrition/batch", methods=["POST"])
+def get_food_nutrition_batch():
+    """Valores nutricionais de vários alimentos em uma única chamada"""
+    try:
+        data = request.get_json()
+        items = data.get("items") if isinstance(data, dict) else data
+        if not items or not isinstance(items, list):
+            return jsonify({"success": False, "error": "No items provided"}), 400
+
+        # All codes are resolved together: at most one IN query for the
+        # user's custom foods and one for the global foods still missing
+        user_id = current_user.id if current_user.is_authenticated else None
+        def item_code(item):
+            code = item.get("code") if isinstance(item, dict) else None
+            return code if isinstance(code, str) else None
+
+        foods_by_code = resolve_foods((item_code(item) for item in items), user_id)
+
+        # Itens inválidos falham sozinhos, no próprio resultado
+        results = []
+        not_found = []
+        for index, item in enumerate(items):
+            code = item_code(item)
+            if code is None:
+                results.append(
+                    {"success": False, "index": index, "error": "Invalid item"}
+                )
+                continue
+
+            food = foods_by_code.get(code)
+            if not food:
+                not_found.append(code)
+                results.append(
+                    {
+                        "success": False,
+                        "index": index,
+                        "food_code": code,
+                        "error": "Food not found",
+                    }
+                )
+                continue
+
+            quantity = item.get("quantity")
+            try:
+                quantity = float(food.quantity if quantity is None else quantity)
+            except (TypeError, ValueError):
+                results.append(
+                    {
+                        "success": False,
+                        "index": index,
+                        "food_code": code,
+                        "error": "Invalid quantity",
+                    }
+                )
+                continue
+            results.append(
                 {
                     "success": True,
                     "food_code": food.code,
-                    "calories": food.calories * ratio,
-                    "proteins": food.proteins * ratio,
-                    "carbs": food.carbs * ratio,
-                    "fats": food.fats * ratio,
                     "quantity": quantity,
+                    **food.nutrition(quantity),
                 }
             )
-        return jsonify({"success": False, "error": "Food not found"})
+
+        return jsonify({"success": True, "foods": results, "not_found": not_found})
     except Exception as e:
-        return jsonify({"success": False, "error": str(e)})
+        return jsonify({"success": False, "error": str(e)}), 500
 
 
 @bp.route("/add_food", methods=["POST"])
@@ -136,47 +201,14 @@ def add_food():
         if not all([code, quantity is not None, meal_type]):
             return jsonify({"success": False, "error": "Missing required fields"}), 400
 
-        # First try to find in user's custom foods (only if authenticated)
-        user_food = None
-        if current_user.is_authenticated:
-            user_food = UserFood.query.filter_by(code=code, user_id=current_user.id).first()
-
-        if user_food:
-            # Calculate nutrition values based on quantity
-            ratio = quantity / user_food.quantity
-            nutrition = {
-                "calories": user_food.calories * ratio,
-                "proteins": user_food.proteins * ratio,
-                "carbs": user_food.carbs * ratio,
-                "fats": user_food.fats * ratio,
-            }
-
-            return jsonify(
-                {
-                    "success": True,
-                    "food": {
-                        "id": user_food.id,
-                        "food_code": user_food.code,
-                        "quantity": quantity,
-                        **nutrition,
-                    },
-                }
-            )
-
-        # If not found in custom foods, try global foods
-        food = FoodData.query.filter_by(code=code).first()
+        # User's custom foods take precedence over global foods
+        user_id = current_user.id if current_user.is_authenticated else None
+        food = resolve_food(code, user_id)
 
         if not food:
             return jsonify({"success": False, "error": "Food not found"}), 404
 
         # Calculate nutrition values based on quantity
-        nutrition = {
-            "calories": food.calories * (quantity / food.quantity),
-            "proteins": food.proteins * (quantity / food.quantity),
-            "carbs": food.carbs * (quantity / food.quantity),
-            "fats": food.fats * (quantity / food.quantity),
-        }
-
         return jsonify(
             {
                 "success": True,
@@ -184,7 +216,7 @@ def add_food():
                     "id": food.id,
                     "food_code": food.code,
                     "quantity": quantity,
-                    **nutrition,
+                    **food.nutrition(quantity),
                 },
             }
         )
@@ -401,8 +433,16 @@ def add_recommendation_to_diary():
             for meal_type, foods in existing_meals.items():
                 print(f"   - {meal_type}: {len(foods)} alimento(s) existente(s)")
 
-        # Importar modelos necessários para buscar valores nutricionais
-        from app.models import FoodData, UserFood
+        # Buscar valores nutricionais de todos os alimentos de uma vez
+        # (alimentos personalizados do usuário têm prioridade sobre os globais)
+        resolved_foods = resolve_foods(
+            (
+                food.get("food_code") or food.get("code")
+                for foods in meals_data.values()
+                for food in foods
+            ),
+            current_user.id,
+        )
 
         # Adicionar novos alimentos às refeições existentes
         foods_not_found = []  # Lista de alimentos não encontrados para debug
@@ -436,37 +476,15 @@ def add_recommendation_to_diary():
                 carbs = food.get("carbs", 0)
                 fats = food.get("fats", 0)
 
-                # Sempre buscar do banco de dados quando houver um código válido
-                food_found = False
-                if food_code_to_use:
-                    # Primeiro tentar buscar nos alimentos personalizados do usuário
-                    user_food = UserFood.query.filter_by(
-                        code=food_code_to_use, user_id=current_user.id
-                    ).first()
-
-                    if user_food:
-                        food_found = True
-                        # Calcular valores nutricionais baseado na quantidade
-                        if user_food.quantity > 0 and food_quantity > 0:
-                            ratio = food_quantity / user_food.quantity
-                            calories = user_food.calories * ratio
-                            proteins = user_food.proteins * ratio
-                            carbs = user_food.carbs * ratio
-                            fats = user_food.fats * ratio
-                    else:
-                        # Se não encontrou nos alimentos personalizados, buscar nos alimentos globais
-                        food_data = FoodData.query.filter_by(
-                            code=food_code_to_use
-                        ).first()
-                        if food_data:
-                            food_found = True
-                            # Calcular valores nutricionais baseado na quantidade
-                            if food_data.quantity > 0 and food_quantity > 0:
-                                ratio = food_quantity / food_data.quantity
-                                calories = food_data.calories * ratio
-                                proteins = food_data.proteins * ratio
-                                carbs = food_data.carbs * ratio
-                                fats = food_data.fats * ratio
+                # Sempre usar os valores do banco de dados quando houver um código válido
+                resolved = resolved_foods.get(food_code_to_use)
+                food_found = resolved is not None
+                if food_found and resolved.quantity > 0 and food_quantity > 0:
+                    nutrition = resolved.nutrition(food_quantity)
+                    calories = nutrition["calories"]
+                    proteins = nutrition["proteins"]
+                    carbs = nutrition["carbs"]
+                    fats = nutrition["fats"]
 
                 if not food_found:
                     foods_not_found.append(
@@ -735,6 +753,107 @@ def delete_diet(diet_id):
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+def _solve_portion_request(build_problem, foods, solver, rounding, infeasible_error):
+    """
+    Resolve no pool o problema montado por ``build_problem`` e arredonda as
+    porções se pedido. Comum a /calculate_portions e /calculate_day_portions.
+
+    Retorna ``((porções, arredondado), None)`` ou ``(None, resposta de erro)``:
+    400 para solver inválido ou problema inviável (``infeasible_error`` mais
+    os valores impossíveis), 429/504/503 para falhas do pool.
+    """
+    try:
+        from concurrent.futures import CancelledError
+        from concurrent.futures.process import BrokenProcessPool
+
+        from app.utils.portion_pool import (
+            PoolSaturatedError,
+            SolveTimeoutError,
+            solve_in_pool,
+        )
+        from app.utils.portion_solver import (
+            METHODS,
+            cached_solve,
+            portion_entries,
+            round_portions,
+        )
+
+        if solver not in METHODS:
+            return None, (
+                jsonify({"success": False, "error": f"Invalid solver: {solver}"}),
+                400,
+            )
+
+        problem = build_problem()
+        result = cached_solve(problem, solver, solve=solve_in_pool)
+
+        if not result.success:
+            error_msg = infeasible_error
+            # Check which targets can't be met (o LP do modo "lsq" já traz a lista exata)
+            impossible_targets = result.violations or problem.impossible_targets()
+            if impossible_targets:
+                error_msg += "\n\nValores impossíveis de atingir:\n" + "\n".join(
+                    impossible_targets
+                )
+            return None, (jsonify({"success": False, "error": error_msg}), 400)
+
+        x, rounded = result.x, False
+        if rounding:
+            x, rounded = round_portions(
+                problem,
+                result.x,
+                [food["step"] for food in foods],
+                current_app.config.get("PORTION_ROUNDING_BUDGET", 0.1),
+            )
+            if not rounded:
+                # Nenhum arredondamento respeita as faixas: mantém o contínuo
+                x = result.x
+
+        portions = portion_entries([food["code"] for food in foods], problem, x)
+        return (portions, rounded), None
+
+    except ImportError:
+        return None, (
+            jsonify(
+                {
+                    "success": False,
+                    "error": "Required optimization package not available",
+                }
+            ),
+            500,
+        )
+    except PoolSaturatedError:
+        return None, (
+            jsonify(
+                {
+                    "success": False,
+                    "error": "Muitos cálculos em andamento. Tente novamente em alguns segundos.",
+                }
+            ),
+            429,
+        )
+    except SolveTimeoutError:
+        return None, (
+            jsonify(
+                {
+                    "success": False,
+                    "error": "O cálculo demorou demais. Tente com menos alimentos ou restrições mais simples.",
+                }
+            ),
+            504,
+        )
+    except (BrokenProcessPool, CancelledError):
+        return None, (
+            jsonify(
+                {
+                    "success": False,
+                    "error": "O serviço de cálculo foi reiniciado. Tente novamente em alguns segundos.",
+                }
+            ),
+            503,
+        )
+
+
 @bp.route("/calculate_portions", methods=["POST"])
 @login_required
 def calculate_portions():
@@ -746,284 +865,296 @@ def calculate_portions():
         targets = data.get("targets")
         foods_data = data.get("foods")
         tolerance = data.get("tolerance", 0.1)  # Default to 10% if not provided
+        # "lsq" (LP + mínimos quadrados) ou "slsqp" (para comparação)
+        solver = data.get("solver") or current_app.config.get("PORTION_SOLVER", "lsq")
+        # Arredondar para múltiplos do passo de cada alimento (ex.: 1 ovo = 50g)
+        rounding = bool(data.get("rounding"))
+        default_step = current_app.config.get("PORTION_DEFAULT_STEP", 5)
 
         if not targets or not foods_data:
             return jsonify({"success": False, "error": "Missing required fields"}), 400
 
-        # Get food data for all selected foods
+        # Get food data for all selected foods (user's custom foods first)
+        resolved_foods = resolve_foods(
+            (food_item["code"] for food_item in foods_data), current_user.id
+        )
         foods = []
         for food_item in foods_data:
-            code = food_item["code"]
-
-            # First try to find in user's custom foods
-            user_food = UserFood.query.filter_by(
-                code=code, user_id=current_user.id
-            ).first()
-
-            if user_food:
-                foods.append(
-                    {
-                        "code": user_food.code,
-                        "calories_per_100g": 100
-                        * user_food.calories
-                        / user_food.quantity,
-                        "proteins_per_100g": 100
-                        * user_food.proteins
-                        / user_food.quantity,
-                        "carbs_per_100g": 100 * user_food.carbs / user_food.quantity,
-                        "fats_per_100g": 100 * user_food.fats / user_food.quantity,
-                        "min": food_item.get("min"),
-                        "max": food_item.get("max"),
-                    }
-                )
-                continue
-
-            # If not found in custom foods, try global foods
-            food = FoodData.query.filter_by(code=code).first()
+            food = resolved_foods.get(food_item["code"])
             if food:
                 foods.append(
                     {
                         "code": food.code,
-                        "calories_per_100g": 100 * food.calories / food.quantity,
-                        "proteins_per_100g": 100 * food.proteins / food.quantity,
-                        "carbs_per_100g": 100 * food.carbs / food.quantity,
-                        "fats_per_100g": 100 * food.fats / food.quantity,
+                        "per_100g": food.per_100g,
                         "min": food_item.get("min"),
                         "max": food_item.get("max"),
+                        "step": food_item.get("step", default_step),
                     }
                 )
 
         if not foods:
             return jsonify({"success": False, "error": "No valid foods found"}), 400
 
-        # Use scipy's optimize to find portions
-        try:
-            from scipy.optimize import minimize
-            import numpy as np
+        # Otimização vetorizada sobre a matriz de nutrientes (app/utils/portion_solver.py)
+        def build_problem():
+            from app.utils.portion_solver import PortionProblem
 
-            # Initial guess: equal distribution
-            n_foods = len(foods)
-            x0 = np.ones(n_foods) * 100  # Start with 100g each
+            return PortionProblem(
+                [food["per_100g"] for food in foods],
+                targets,
+                tolerance,
+                bounds=[(food["min"], food["max"]) for food in foods],
+            )
 
-            # Objective function: minimize the sum of squared differences from all targets
-            def objective(x):
-                total_error = 0
+        solution, error = _solve_portion_request(
+            build_problem,
+            foods,
+            solver,
+            rounding,
+            "Não foi possível encontrar uma solução com as restrições fornecidas.\n"
+            f"Tolerância atual: ±{tolerance * 100:.0f}%. Tente aumentar a tolerância ou ajustar os limites dos alimentos.",
+        )
+        if error:
+            return error
+        portions, rounded = solution
 
-                if targets["calories"] > 0:
-                    total_calories = sum(
-                        x[i] * foods[i]["calories_per_100g"] / 100
-                        for i in range(n_foods)
-                    )
-                    total_error += (
-                        (total_calories - targets["calories"]) / targets["calories"]
-                    ) ** 2
-
-                if targets["proteins"] > 0:
-                    total_proteins = sum(
-                        x[i] * foods[i]["proteins_per_100g"] / 100
-                        for i in range(n_foods)
-                    )
-                    total_error += (
-                        (total_proteins - targets["proteins"]) / targets["proteins"]
-                    ) ** 2
+        return jsonify({"success": True, "portions": portions, "rounded": rounded})
 
-                if targets["carbs"] > 0:
-                    total_carbs = sum(
-                        x[i] * foods[i]["carbs_per_100g"] / 100 for i in range(n_foods)
-                    )
-                    total_error += (
-                        (total_carbs - targets["carbs"]) / targets["carbs"]
-                    ) ** 2
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
 
-                if targets["fats"] > 0:
-                    total_fats = sum(
-                        x[i] * foods[i]["fats_per_100g"] / 100 for i in range(n_foods)
-                    )
-                    total_error += (
-                        (total_fats - targets["fats"]) / targets["fats"]
-                    ) ** 2
 
-                return total_error
+@bp.route("/calculate_day_portions", methods=["POST"])
+@login_required
+def calculate_day_portions():
+    """
+    Calcula as porções do dia inteiro de uma vez.
+
+    Recebe os alimentos agrupados por refeição (chaves de MEAL_TYPES) e,
+    opcionalmente, a fatia de calorias de cada refeição, ex.:
+    ``{"meals": {"almoco": [{"code": ..., "min": ..., "max": ...}]},
+    "shares": {"almoco": {"min": 0.3, "max": 0.4}}, "tolerance": 0.1}``.
+    Os alvos são as metas do usuário, a menos que ``targets`` seja enviado.
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({"success": False, "error": "No data provided"}), 400
 
-            # Constraints for each target with tolerance
-            constraints = []
+        meals_data = data.get("meals") or {}
+        shares = data.get("shares") or {}
+        tolerance = data.get("tolerance", 0.1)
+        solver = data.get("solver") or current_app.config.get("PORTION_SOLVER", "lsq")
+        # Arredondar para múltiplos do passo de cada alimento (ex.: 1 ovo = 50g)
+        rounding = bool(data.get("rounding"))
+        default_step = current_app.config.get("PORTION_DEFAULT_STEP", 5)
+        targets = data.get("targets") or {
+            "calories": current_user.calories_goal,
+            "proteins": current_user.proteins_goal,
+            "carbs": current_user.carbs_goal,
+            "fats": current_user.fats_goal,
+        }
 
-            if targets["calories"] > 0:
-                min_calories = targets["calories"] * (1 - tolerance)
-                max_calories = targets["calories"] * (1 + tolerance)
-                constraints.extend(
-                    [
-                        {
-                            "type": "ineq",
-                            "fun": lambda x: sum(
-                                x[i] * foods[i]["calories_per_100g"] / 100
-                                for i in range(n_foods)
-                            )
-                            - min_calories,
-                        },
-                        {
-                            "type": "ineq",
-                            "fun": lambda x: max_calories
-                            - sum(
-                                x[i] * foods[i]["calories_per_100g"] / 100
-                                for i in range(n_foods)
-                            ),
-                        },
-                    ]
-                )
+        if not isinstance(meals_data, dict) or not isinstance(shares, dict):
+            return jsonify(
+                {"success": False, "error": "meals and shares must be objects"}
+            ), 400
+        malformed_meals = [
+            meal
+            for meal, meal_foods in meals_data.items()
+            if not isinstance(meal_foods, list)
+            or not all(isinstance(food_item, dict) for food_item in meal_foods)
+        ]
+        if malformed_meals:
+            return jsonify(
+                {
+                    "success": False,
+                    "error": f"Each meal must be a list of foods: {', '.join(malformed_meals)}",
+                }
+            ), 400
 
-            if targets["proteins"] > 0:
-                min_proteins = targets["proteins"] * (1 - tolerance)
-                max_proteins = targets["proteins"] * (1 + tolerance)
-                constraints.extend(
-                    [
-                        {
-                            "type": "ineq",
-                            "fun": lambda x: sum(
-                                x[i] * foods[i]["proteins_per_100g"] / 100
-                                for i in range(n_foods)
-                            )
-                            - min_proteins,
-                        },
-                        {
-                            "type": "ineq",
-                            "fun": lambda x: max_proteins
-                            - sum(
-                                x[i] * foods[i]["proteins_per_100g"] / 100
-                                for i in range(n_foods)
-                            ),
-                        },
-                    ]
-                )
+        invalid_meals = [
+            meal for meal in {**meals_data, **shares} if meal not in MEAL_TYPES
+        ]
+        if invalid_meals:
+            return jsonify(
+                {
+                    "success": False,
+                    "error": f"Invalid meal types: {', '.join(invalid_meals)}",
+                }
+            ), 400
 
-            if targets["carbs"] > 0:
-                min_carbs = targets["carbs"] * (1 - tolerance)
-                max_carbs = targets["carbs"] * (1 + tolerance)
-                constraints.extend(
-                    [
-                        {
-                            "type": "ineq",
-                            "fun": lambda x: sum(
-                                x[i] * foods[i]["carbs_per_100g"] / 100
-                                for i in range(n_foods)
-                            )
-                            - min_carbs,
-                        },
-                        {
-                            "type": "ineq",
-                            "fun": lambda x: max_carbs
-                            - sum(
-                                x[i] * foods[i]["carbs_per_100g"] / 100
-                                for i in range(n_foods)
-                            ),
-                        },
-                    ]
-                )
+        if not any((targets.get(macro) or 0) > 0 for macro in MACRO_TYPES):
+            return jsonify(
+                {
+                    "success": False,
+                    "error": "Nenhuma meta definida. Configure suas metas no perfil ou envie targets.",
+                }
+            ), 400
 
-            if targets["fats"] > 0:
-                min_fats = targets["fats"] * (1 - tolerance)
-                max_fats = targets["fats"] * (1 + tolerance)
-                constraints.extend(
-                    [
-                        {
-                            "type": "ineq",
-                            "fun": lambda x: sum(
-                                x[i] * foods[i]["fats_per_100g"] / 100
-                                for i in range(n_foods)
-                            )
-                            - min_fats,
-                        },
+        # Uma variável por alimento de cada refeição (o mesmo alimento pode
+        # aparecer em refeições diferentes)
+        resolved_foods = resolve_foods(
+            (
+                food_item.get("code")
+                for meal_foods in meals_data.values()
+                for food_item in meal_foods
+            ),
+            current_user.id,
+        )
+        foods = []
+        for meal_type in MEAL_TYPES:
+            for food_item in meals_data.get(meal_type, []):
+                food = resolved_foods.get(food_item.get("code"))
+                if food:
+                    foods.append(
                         {
-                            "type": "ineq",
-                            "fun": lambda x: max_fats
-                            - sum(
-                                x[i] * foods[i]["fats_per_100g"] / 100
-                                for i in range(n_foods)
-                            ),
-                        },
-                    ]
-                )
+                            "meal_type": meal_type,
+                            "code": food.code,
+                            "per_100g": food.per_100g,
+                            "min": food_item.get("min"),
+                            "max": food_item.get("max"),
+                            "step": food_item.get("step", default_step),
+                        }
+                    )
 
-            # Bounds for each food
-            bounds = []
-            for food in foods:
-                min_val = food["min"] if food["min"] is not None else 0
-                max_val = food["max"] if food["max"] is not None else None
-                bounds.append((min_val, max_val))
+        if not foods:
+            return jsonify({"success": False, "error": "No valid foods found"}), 400
 
-            # Solve optimization problem
-            result = minimize(
-                objective, x0, method="SLSQP", constraints=constraints, bounds=bounds
+        # Fatias inválidas viram 400 aqui, com o nome da refeição, em vez de
+        # aparecerem só como inviabilidade de todos os macros no solver
+        meals_with_foods = {food["meal_type"] for food in foods}
+        min_total = 0
+        for meal_type, share in shares.items():
+            label = MEAL_TYPES[meal_type]
+            if meal_type not in meals_with_foods:
+                return jsonify(
+                    {
+                        "success": False,
+                        "error": f"{label}: fatia definida para uma refeição sem alimentos",
+                    }
+                ), 400
+            if not isinstance(share, dict):
+                return jsonify(
+                    {
+                        "success": False,
+                        "error": f"{label}: a fatia deve ter o formato {{\"min\": ..., \"max\": ...}}",
+                    }
+                ), 400
+            bounds = [share.get("min"), share.get("max")]
+            if any(
+                value is not None
+                and (
+                    isinstance(value, bool)
+                    or not isinstance(value, (int, float))
+                    or not 0 <= value <= 1
+                )
+                for value in bounds
+            ) or (None not in bounds and bounds[0] > bounds[1]):
+                return jsonify(
+                    {
+                        "success": False,
+                        "error": f"{label}: a fatia deve ter 0 <= min <= max <= 1",
+                    }
+                ), 400
+            min_total += share.get("min") or 0
+        if min_total > 1:
+            labels = ", ".join(
+                MEAL_TYPES[meal_type]
+                for meal_type, share in shares.items()
+                if share.get("min")
             )
+            return jsonify(
+                {
+                    "success": False,
+                    "error": f"As fatias mínimas de {labels} somam {min_total * 100:.0f}% das calorias (máximo 100%)",
+                }
+            ), 400
 
-            if not result.success:
-                error_msg = "Não foi possível encontrar uma solução com as restrições fornecidas.\n"
-                error_msg += f"Tolerância atual: ±{tolerance * 100:.0f}%. Tente aumentar a tolerância ou ajustar os limites dos alimentos."
-
-                # Check which targets can't be met
-                impossible_targets = []
-                for nutrient, target in targets.items():
-                    if target > 0:
-                        min_value = sum(
-                            (food["min"] if food["min"] is not None else 0)
-                            * food[f"{nutrient}_per_100g"]
-                            / 100
-                            for food in foods
-                        )
-                        max_value = sum(
-                            (food["max"] if food["max"] is not None else float("inf"))
-                            * food[f"{nutrient}_per_100g"]
-                            / 100
-                            for food in foods
-                        )
-
-                        target_min = target * (1 - tolerance)
-                        target_max = target * (1 + tolerance)
-
-                        if target_min < min_value:
-                            impossible_targets.append(
-                                f"{nutrient.title()}: o mínimo possível ({min_value:.1f}) é maior que o alvo mínimo ({target_min:.1f})"
-                            )
-                        elif max_value < float("inf") and target_max > max_value:
-                            impossible_targets.append(
-                                f"{nutrient.title()}: o máximo possível ({max_value:.1f}) é menor que o alvo máximo ({target_max:.1f})"
-                            )
-
-                if impossible_targets:
-                    error_msg += "\n\nValores impossíveis de atingir:\n" + "\n".join(
-                        impossible_targets
+        def build_problem():
+            from app.utils.portion_solver import PortionProblem, share_rows
+
+            per_100g = [food["per_100g"] for food in foods]
+            rows = []
+            for meal_type, share in shares.items():
+                rows.extend(
+                    share_rows(
+                        per_100g,
+                        [food["meal_type"] == meal_type for food in foods],
+                        min_share=share.get("min"),
+                        max_share=share.get("max"),
+                        label=MEAL_TYPES[meal_type],
                     )
+                )
+            return PortionProblem(
+                per_100g,
+                targets,
+                tolerance,
+                bounds=[(food["min"], food["max"]) for food in foods],
+                rows=rows,
+            )
 
-                return jsonify({"success": False, "error": error_msg}), 400
+        solution, error = _solve_portion_request(
+            build_problem,
+            foods,
+            solver,
+            rounding,
+            "Não foi possível montar o dia com as restrições fornecidas.\n"
+            f"Tolerância atual: ±{tolerance * 100:.0f}%. Tente aumentar a tolerância, ajustar os limites dos alimentos ou as fatias das refeições.",
+        )
+        if error:
+            return error
+        portions, rounded = solution
 
-            # Prepare portions data
-            portions = []
-            for i, food in enumerate(foods):
-                quantity = float(result.x[i])
-                portion = {
-                    "food_code": food["code"],
-                    "quantity": quantity,
-                    "calories": quantity * food["calories_per_100g"] / 100,
-                    "proteins": quantity * food["proteins_per_100g"] / 100,
-                    "carbs": quantity * food["carbs_per_100g"] / 100,
-                    "fats": quantity * food["fats_per_100g"] / 100,
-                }
-                portions.append(portion)
+        meals = {}
+        for food, portion in zip(foods, portions):
+            meals.setdefault(food["meal_type"], []).append(portion)
 
-            return jsonify({"success": True, "portions": portions})
+        totals = {
+            macro: sum(portion[macro] for portion in portions)
+            for macro in MACRO_TYPES
+        }
 
-        except ImportError:
-            return jsonify(
-                {
-                    "success": False,
-                    "error": "Required optimization package not available",
-                }
-            ), 500
+        return jsonify(
+            {
+                "success": True,
+                "meals": meals,
+                "totals": totals,
+                "rounded": rounded,
+                "targets": {macro: targets.get(macro) for macro in MACRO_TYPES},
+            }
+        )
 
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+@bp.route("/metrics")
+@login_required
+@admin_required
+def metrics():
+    """Contadores em memória deste processo (cada worker tem os seus)"""
+    try:
+        from app.utils.portion_pool import portion_pool_stats
+        from app.utils.portion_solver import portion_cache_stats
+
+        return jsonify(
+            {
+                "success": True,
+                "food_resolver": resolver_stats(),
+                "user_food_index": user_food_index_stats(),
+                "portion_cache": portion_cache_stats(),
+                "portion_pool": portion_pool_stats(),
+                "chatbot": chatbot_stats(),
+                "chatbot_prompt": prompt_stats(),
+                "chatbot_conversations": conversation_stats(),
+                "chatbot_cache": chatbot_cache_stats(),
+            }
+        )
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
 @bp.route("/export_diet", methods=["POST"])
 def export_diet():
     try:
@@ -1369,6 +1500,8 @@ def create_user_food():
 
         db.session.add(user_food)
         db.session.commit()
+        invalidate_user_food_index(current_user.id)
+        invalidate_user_food_retrieval(current_user.id)
 
         return jsonify(
             {
@@ -1466,6 +1599,8 @@ def update_user_food(food_id):
         food.fats = float(fats)
 
         db.session.commit()
+        invalidate_user_food_index(current_user.id)
+        invalidate_user_food_retrieval(current_user.id)
 
         return jsonify(
             {
@@ -1499,6 +1634,8 @@ def delete_user_food(food_id):
 
         db.session.delete(food)
         db.session.commit()
+        invalidate_user_food_index(current_user.id)
+        invalidate_user_food_retrieval(current_user.id)
 
         return jsonify({"success": True, "message": "Alimento deletado com sucesso!"})
     except Exception as e:
@@ -1509,954 +1646,272 @@ def delete_user_food(food_id):
 @bp.route("/chatbot", methods=["POST"])
 @login_required
 def chatbot():
-    from flask import current_app
-    from openai import OpenAI
-    from datetime import date, datetime, timedelta
-    import re
-
     data = request.get_json()
     user_message = data.get("message")
-    conversation_history = data.get("history", [])
     requested_date = data.get("date")  # Data específica se fornecida
+    # "structured": texto e refeições em campos separados (JSON schema)
+    # "text": recomendação em bloco ```json dentro do texto
+    output_mode = data.get("output_mode") or current_app.config.get(
+        "CHATBOT_OUTPUT_MODE", "structured"
+    )
 
     if not user_message:
         return jsonify({"error": "Mensagem não fornecida"}), 400
+    if output_mode not in OUTPUT_MODES:
+        return jsonify({"error": f"Invalid output_mode: {output_mode}"}), 400
 
-    # Importar modelos necessários
-    from app.models import FoodData, UserFood
-
-    # Extrair possíveis nomes de alimentos mencionados na mensagem
-    # Buscar palavras que podem ser nomes de alimentos (palavras com mais de 3 caracteres)
-    mentioned_foods = []
-    words = re.findall(r"\b\w{4,}\b", user_message.lower())
-
-    # Buscar alimentos mencionados na mensagem
-    for word in words[:10]:  # Limitar a 10 palavras para não sobrecarregar
-        # Buscar por nome (case insensitive)
-        food_by_name = (
-            FoodData.query.filter(FoodData.name.ilike(f"%{word}%")).limit(5).all()
-        )
-
-        for food in food_by_name:
-            if food.code not in [f["code"] for f in mentioned_foods]:
-                mentioned_foods.append(
-                    {
-                        "code": food.code,
-                        "name": food.name,
-                        "calories_per_100g": (food.calories / food.quantity * 100)
-                        if food.quantity > 0
-                        else 0,
-                        "proteins_per_100g": (food.proteins / food.quantity * 100)
-                        if food.quantity > 0
-                        else 0,
-                        "carbs_per_100g": (food.carbs / food.quantity * 100)
-                        if food.quantity > 0
-                        else 0,
-                        "fats_per_100g": (food.fats / food.quantity * 100)
-                        if food.quantity > 0
-                        else 0,
-                        "mentioned": True,  # Flag para indicar que foi mencionado
-                    }
-                )
-
-        # Buscar também nos alimentos personalizados do usuário
-        user_food_by_name = (
-            UserFood.query.filter(
-                UserFood.user_id == current_user.id, UserFood.name.ilike(f"%{word}%")
-            )
-            .limit(5)
-            .all()
-        )
-
-        for food in user_food_by_name:
-            if food.code not in [f["code"] for f in mentioned_foods]:
-                mentioned_foods.append(
-                    {
-                        "code": food.code,
-                        "name": food.name,
-                        "calories_per_100g": (food.calories / food.quantity * 100)
-                        if food.quantity > 0
-                        else 0,
-                        "proteins_per_100g": (food.proteins / food.quantity * 100)
-                        if food.quantity > 0
-                        else 0,
-                        "carbs_per_100g": (food.carbs / food.quantity * 100)
-                        if food.quantity > 0
-                        else 0,
-                        "fats_per_100g": (food.fats / food.quantity * 100)
-                        if food.quantity > 0
-                        else 0,
-                        "mentioned": True,
-                    }
-                )
-
-    # Obter API key do config (que pode vir de variável de ambiente ou valor padrão)
-    api_key = current_app.config.get("OPENAI_API_KEY")
-    if not api_key:
+    # Cliente criado em create_app; None se OPENAI_API_KEY não estiver configurada
+    client = get_openai_client()
+    if client is None:
         return jsonify(
             {
                 "error": "API key não configurada. Configure OPENAI_API_KEY no config.py ou como variável de ambiente."
             }
         ), 500
 
-    # Determinar a data a ser consultada
-    # Tenta extrair data da mensagem ou usa a data fornecida ou hoje
-    target_date = date.today()
-    if requested_date:
-        try:
-            target_date = datetime.strptime(requested_date, "%Y-%m-%d").date()
-        except ValueError:
-            pass
-    else:
-        # Tenta extrair data da mensagem (formato: "hoje", "ontem", "15/01/2024", etc)
-        user_msg_lower = user_message.lower()
-
-        # Verifica se menciona "hoje", "atual", "deste dia"
-        if re.search(r"hoje|atual|deste dia", user_msg_lower):
-            target_date = date.today()
-        # Verifica se menciona "ontem"
-        elif re.search(r"ontem", user_msg_lower):
-            target_date = date.today() - timedelta(days=1)
-        # Tenta extrair data no formato DD/MM/YYYY
-        else:
-            date_match = re.search(r"(\d{1,2})/(\d{1,2})/(\d{4})", user_message)
-            if date_match:
-                try:
-                    day = int(date_match.group(1))
-                    month = int(date_match.group(2))
-                    year = int(date_match.group(3))
-                    target_date = date(year, month, day)
-                except (ValueError, AttributeError):
-                    pass
-
-    # Buscar dieta do dia
-    from app.models import Diet, FoodData, UserFood
-    from app.constants import MEAL_TYPES
-
-    daily_diet = Diet.query.filter_by(user_id=current_user.id, date=target_date).first()
-
-    # Buscar alimentos disponíveis na base de dados
-    # Limitar a 500 alimentos mais comuns para não exceder tokens
-    all_foods = []
-
-    # Adicionar alimentos mencionados primeiro (prioridade)
-    mentioned_codes = {f["code"] for f in mentioned_foods}
-    all_foods.extend(mentioned_foods)
-
-    # Buscar alimentos globais (FoodData) - excluindo os já mencionados
-    global_foods = (
-        FoodData.query.filter(
-            ~FoodData.code.in_(mentioned_codes) if mentioned_codes else True
-        )
-        .limit(300)
-        .all()
+    # Conversa guardada no servidor: o cliente manda só a mensagem nova e o
+    # conversation_id (ver app/utils/chat_conversations.py)
+    conversation, conversation_history, summary = conversation_for_request(
+        current_user.id, data
     )
-    for food in global_foods:
-        all_foods.append(
-            {
-                "code": food.code,
-                "name": food.name,
-                "calories_per_100g": (food.calories / food.quantity * 100)
-                if food.quantity > 0
-                else 0,
-                "proteins_per_100g": (food.proteins / food.quantity * 100)
-                if food.quantity > 0
-                else 0,
-                "carbs_per_100g": (food.carbs / food.quantity * 100)
-                if food.quantity > 0
-                else 0,
-                "fats_per_100g": (food.fats / food.quantity * 100)
-                if food.quantity > 0
-                else 0,
-            }
-        )
 
-    # Buscar alimentos personalizados do usuário - excluindo os já mencionados
-    user_foods = (
-        UserFood.query.filter(
-            UserFood.user_id == current_user.id,
-            ~UserFood.code.in_(mentioned_codes) if mentioned_codes else True,
-        )
-        .limit(200)
-        .all()
-    )
-    for food in user_foods:
-        all_foods.append(
-            {
-                "code": food.code,
-                "name": food.name,
-                "calories_per_100g": (food.calories / food.quantity * 100)
-                if food.quantity > 0
-                else 0,
-                "proteins_per_100g": (food.proteins / food.quantity * 100)
-                if food.quantity > 0
-                else 0,
-                "carbs_per_100g": (food.carbs / food.quantity * 100)
-                if food.quantity > 0
-                else 0,
-                "fats_per_100g": (food.fats / food.quantity * 100)
-                if food.quantity > 0
-                else 0,
-            }
+    # Cache de respostas (opcional; ver app/utils/chatbot_cache.py): só para
+    # a primeira mensagem da conversa, que não depende de histórico
+    cache_key = None
+    if cache_enabled(data) and not conversation_history and not summary:
+        cache_key = response_cache_key(
+            current_user, user_message, requested_date, output_mode
         )
+        cached = get_cached_response(cache_key)
+        if cached is not None:
+            if conversation is not None:
+                record_turn(conversation, user_message, cached["response"])
+            return jsonify(
+                {
+                    "success": True,
+                    "response": cached["response"],
+                    "recommendation": cached["recommendation"],
+                    "conversation_id": (
+                        conversation.session_id if conversation else None
+                    ),
+                    "cached": True,
+                }
+            )
 
-    # Categorizar alimentos por tipo de refeição (lógica brasileira)
-    def categorize_food_for_meal(food_name):
-        """Categoriza alimento por tipo de refeição baseado em palavras-chave"""
-        name_lower = food_name.lower()
-
-        # Café da Manhã - alimentos típicos
-        cafe_keywords = [
-            "pão",
-            "torrada",
-            "bolacha",
-            "biscoito",
-            "cereal",
-            "aveia",
-            "granola",
-            "leite",
-            "iogurte",
-            "queijo",
-            "requeijão",
-            "manteiga",
-            "margarina",
-            "ovo",
-            "ovos",
-            "omelete",
-            "fruta",
-            "banana",
-            "maçã",
-            "laranja",
-            "suco",
-            "café",
-            "chá",
-            "mel",
-            "geleia",
-            "marmelada",
-            "creme",
-            "tapioca",
-            "crepioca",
-            "panqueca",
-            "waffle",
-        ]
-
-        # Almoço/Jantar - prato principal
-        almoco_keywords = [
-            "arroz",
-            "feijão",
-            "batata",
-            "batata doce",
-            "mandioca",
-            "aipim",
-            "macarrão",
-            "massa",
-            "lasanha",
-            "frango",
-            "frango grelhado",
-            "carne",
-            "bife",
-            "peixe",
-            "salmão",
-            "tilápia",
-            "sardinha",
-            "salada",
-            "alface",
-            "tomate",
-            "cenoura",
-            "brócolis",
-            "couve",
-            "ovo frito",
-            "ovo cozido",
-            "hambúrguer",
-            "pizza",
-            "strogonoff",
-            "parmegiana",
-            "moqueca",
-            "feijoada",
-            "churrasco",
-            "churrasquinho",
-        ]
+    messages = build_chatbot_messages(
+        user_message, conversation_history, requested_date, output_mode, summary
+    )
 
-        # Lanches - alimentos leves
-        lanche_keywords = [
-            "fruta",
-            "banana",
-            "maçã",
-            "laranja",
-            "pera",
-            "uva",
-            "mamão",
-            "iogurte",
-            "queijo",
-            "bolacha",
-            "biscoito",
-            "cereal",
-            "barra",
-            "castanha",
-            "amendoim",
-            "nozes",
-            "suco",
-            "vitamina",
-            "smoothie",
-        ]
+    try:
+        # Chamada à API
+        start = time.perf_counter()
+        response = client.chat.completions.create(
+            messages=messages, **completion_params(output_mode)
+        )
 
-        # Ceia - alimentos leves
-        ceia_keywords = [
-            "chá",
-            "leite",
-            "iogurte",
-            "fruta",
-            "banana",
-            "bolacha",
-            "biscoito",
-            "queijo",
-            "castanha",
-            "amendoim",
-        ]
+        # Separar o texto da recomendação (JSON)
+        parser = reply_parser(output_mode)
+        visible = parser.feed(response.choices[0].message.content or "") or ""
+        visible += parser.close() or ""
+        if response.usage:
+            calibrate(messages, response.usage.prompt_tokens)
+        record_chatbot_call(
+            output_mode,
+            time.perf_counter() - start,
+            response.usage.completion_tokens if response.usage else None,
+            parser.parse_failed,
+        )
+        if cache_key and not parser.parse_failed:
+            store_cached_response(
+                cache_key,
+                current_user.id,
+                {
+                    "response": parser.response,
+                    "visible": visible,
+                    "recommendation": parser.recommendation,
+                },
+            )
+        if conversation is not None:
+            record_turn(conversation, user_message, parser.response)
+            # A resposta já existe: falha ao resumir não vira erro 500
+            try:
+                compact_conversation(conversation, client)
+            except Exception:
+                import traceback
 
-        categories = {
-            "cafe_da_manha": any(kw in name_lower for kw in cafe_keywords),
-            "almoco": any(kw in name_lower for kw in almoco_keywords),
-            "janta": any(kw in name_lower for kw in almoco_keywords),
-            "lanche_manha": any(kw in name_lower for kw in lanche_keywords),
-            "lanche_tarde": any(kw in name_lower for kw in lanche_keywords),
-            "ceia": any(kw in name_lower for kw in ceia_keywords),
-        }
+                db.session.rollback()
+                print(f"Erro ao resumir conversa: {traceback.format_exc()}")
 
-        return categories
-
-    # Criar lista de alimentos categorizados (limitado para não exceder tokens)
-    foods_by_category = {
-        "cafe_da_manha": [],
-        "almoco": [],
-        "janta": [],
-        "lanche_manha": [],
-        "lanche_tarde": [],
-        "ceia": [],
-        "geral": [],  # Alimentos que podem ser usados em qualquer refeição
-    }
-
-    # Categorizar até 200 alimentos mais relevantes
-    for food in all_foods[:200]:
-        categories = categorize_food_for_meal(food["name"])
-        categorized = False
-
-        for meal_type, is_suitable in categories.items():
-            if is_suitable:
-                foods_by_category[meal_type].append(food)
-                categorized = True
-
-        if not categorized:
-            foods_by_category["geral"].append(food)
-
-    # Criar resumo de alimentos disponíveis por categoria
-    foods_summary = "ALIMENTOS DISPONÍVEIS NA BASE DE DADOS (use APENAS estes alimentos nas recomendações):\n\n"
-
-    # Primeiro, mostrar alimentos mencionados pelo usuário (se houver)
-    if mentioned_foods:
-        foods_summary += "⚠️ ALIMENTOS MENCIONADOS PELO USUÁRIO (PRIORIDADE - use estes se mencionados):\n"
-        for food in mentioned_foods:
-            foods_summary += f"  - {food['name']} (Código: {food['code']}, {food['calories_per_100g']:.0f} kcal/100g, {food['proteins_per_100g']:.1f}g prot, {food['carbs_per_100g']:.1f}g carb, {food['fats_per_100g']:.1f}g gord)\n"
-        foods_summary += "\n"
-
-    for meal_type, meal_name in MEAL_TYPES.items():
-        foods_list = foods_by_category.get(meal_type, [])
-        if foods_list:
-            foods_summary += f"{meal_name} ({len(foods_list)} alimentos):\n"
-            # Mostrar apenas primeiros 15 alimentos de cada categoria para não exceder tokens
-            for food in foods_list[:15]:
-                foods_summary += f"  - {food['name']} (Código: {food['code']}, {food['calories_per_100g']:.0f} kcal/100g, {food['proteins_per_100g']:.1f}g prot, {food['carbs_per_100g']:.1f}g carb, {food['fats_per_100g']:.1f}g gord)\n"
-            if len(foods_list) > 15:
-                foods_summary += f"  ... e mais {len(foods_list) - 15} alimentos\n"
-            foods_summary += "\n"
-
-    if foods_by_category["geral"]:
-        foods_summary += (
-            f"Alimentos gerais ({len(foods_by_category['geral'])} alimentos):\n"
+        return jsonify(
+            {
+                "success": True,
+                "response": parser.response,
+                "recommendation": parser.recommendation,
+                "conversation_id": conversation.session_id if conversation else None,
+            }
         )
-        for food in foods_by_category["geral"][:10]:
-            foods_summary += f"  - {food['name']} (Código: {food['code']})\n"
-        foods_summary += "\n"
-
-    foods_summary += "IMPORTANTE: Se o usuário mencionar um alimento específico, SEMPRE verifique se ele está na lista acima (especialmente na seção 'ALIMENTOS MENCIONADOS'). Se estiver, use-o e confirme que está disponível. Se não estiver na lista mas o usuário insistir, informe que você pode recomendar alimentos similares que estão disponíveis na base de dados."
 
-    # Calcular totais do que já foi consumido
-    daily_totals = {"calories": 0, "proteins": 0, "carbs": 0, "fats": 0}
-    meals_summary = []
-    meals_detail = {}
+    except Exception as e:
+        import traceback
 
-    if daily_diet and daily_diet.meals_data:
-        for meal_type, foods in daily_diet.meals_data.items():
-            meal_name = MEAL_TYPES.get(meal_type, meal_type)
-            meal_totals = {"calories": 0, "proteins": 0, "carbs": 0, "fats": 0}
-            meal_foods = []
+        print(f"Erro ao chamar OpenAI: {traceback.format_exc()}")
+        return jsonify(
+            {"success": False, "error": f"Erro ao processar mensagem: {str(e)}"}
+        ), 500
 
-            for food in foods:
-                calories = float(food.get("calories", 0))
-                proteins = float(food.get("proteins", 0))
-                carbs = float(food.get("carbs", 0))
-                fats = float(food.get("fats", 0))
-
-                daily_totals["calories"] += calories
-                daily_totals["proteins"] += proteins
-                daily_totals["carbs"] += carbs
-                daily_totals["fats"] += fats
-
-                meal_totals["calories"] += calories
-                meal_totals["proteins"] += proteins
-                meal_totals["carbs"] += carbs
-                meal_totals["fats"] += fats
-
-                food_code = food.get("food_code", "Desconhecido")
-                quantity = food.get("quantity", 0)
-                meal_foods.append(f"{food_code} ({quantity}g)")
-
-            if meal_totals["calories"] > 0:
-                meals_summary.append(
-                    f"{meal_name}: {meal_totals['calories']:.0f} kcal, "
-                    f"{meal_totals['proteins']:.1f}g proteínas, "
-                    f"{meal_totals['carbs']:.1f}g carboidratos, "
-                    f"{meal_totals['fats']:.1f}g gorduras"
-                )
-                meals_detail[meal_name] = {"foods": meal_foods, "totals": meal_totals}
-
-    # Use dados do usuário
-    user = current_user
-    user_profile = {
-        "nome": user.nome,
-        "idade": user.idade,
-        "peso": user.peso,
-        "altura": user.altura,
-        "sexo": user.get_sexo_display(),
-        "objetivo": user.get_objetivo_display(),
-        "atividade": user.get_fator_atividade_display(),
-        "calories_goal": user.calories_goal or 0,
-        "proteins_goal": user.proteins_goal or 0,
-        "carbs_goal": user.carbs_goal or 0,
-        "fats_goal": user.fats_goal or 0,
-    }
-
-    # Calcular IMC
-    imc = user.peso / (user.altura**2) if user.altura > 0 else 0
-
-    # Calcular percentuais consumidos
-    calories_percent = (
-        (daily_totals["calories"] / user_profile["calories_goal"] * 100)
-        if user_profile["calories_goal"] > 0
-        else 0
-    )
-    proteins_percent = (
-        (daily_totals["proteins"] / user_profile["proteins_goal"] * 100)
-        if user_profile["proteins_goal"] > 0
-        else 0
-    )
-    carbs_percent = (
-        (daily_totals["carbs"] / user_profile["carbs_goal"] * 100)
-        if user_profile["carbs_goal"] > 0
-        else 0
-    )
-    fats_percent = (
-        (daily_totals["fats"] / user_profile["fats_goal"] * 100)
-        if user_profile["fats_goal"] > 0
-        else 0
-    )
 
-    # Formatar data para exibição
-    date_str = target_date.strftime("%d/%m/%Y")
-    if target_date == date.today():
-        date_str = "hoje"
-
-    # Construir resumo do consumo do dia
-    consumption_summary = ""
-    if daily_totals["calories"] > 0:
-        consumption_summary = f"""
-CONSUMO DO DIA ({date_str}):
-- Total consumido:
-  * Calorias: {daily_totals["calories"]:.0f} kcal ({calories_percent:.1f}% da meta de {user_profile["calories_goal"]:.0f} kcal)
-  * Proteínas: {daily_totals["proteins"]:.1f} g ({proteins_percent:.1f}% da meta de {user_profile["proteins_goal"]:.0f} g)
-  * Carboidratos: {daily_totals["carbs"]:.1f} g ({carbs_percent:.1f}% da meta de {user_profile["carbs_goal"]:.0f} g)
-  * Gorduras: {daily_totals["fats"]:.1f} g ({fats_percent:.1f}% da meta de {user_profile["fats_goal"]:.0f} g)
-
-- Restante para atingir as metas:
-  * Calorias: {max(0, user_profile["calories_goal"] - daily_totals["calories"]):.0f} kcal
-  * Proteínas: {max(0, user_profile["proteins_goal"] - daily_totals["proteins"]):.1f} g
-  * Carboidratos: {max(0, user_profile["carbs_goal"] - daily_totals["carbs"]):.1f} g
-  * Gorduras: {max(0, user_profile["fats_goal"] - daily_totals["fats"]):.1f} g
-
-- Refeições consumidas:
-"""
-        for meal in meals_summary:
-            consumption_summary += f"  * {meal}\n"
-    else:
-        consumption_summary = f"\nCONSUMO DO DIA ({date_str}):\nNenhum alimento registrado ainda para este dia."
-
-    # Sistema de prompt para o assistente nutricional
-    # Quebrar em partes para evitar f-string aninhada demais
-    altura_cm = user_profile["altura"] * 100
-
-    system_prompt_parts = [
-        'Você é um assistente nutricional especializado chamado "Nutri AI". Seu papel é fornecer orientações nutricionais personalizadas, recomendar dietas e responder perguntas sobre nutrição.\n\n',
-        "INFORMAÇÕES DO USUÁRIO:\n",
-        f"- Nome: {user_profile['nome']}\n",
-        f"- Idade: {user_profile['idade']} anos\n",
-        f"- Peso: {user_profile['peso']} kg\n",
-        f"- Altura: {user_profile['altura']} m ({altura_cm:.0f} cm)\n",
-        f"- IMC: {imc:.1f}\n",
-        f"- Sexo: {user_profile['sexo']}\n",
-        f"- Objetivo: {user_profile['objetivo']}\n",
-        f"- Nível de atividade: {user_profile['atividade']}\n",
-        "- Metas nutricionais diárias:\n",
-        f"  * Calorias: {user_profile['calories_goal']:.0f} kcal\n",
-        f"  * Proteínas: {user_profile['proteins_goal']:.0f} g\n",
-        f"  * Carboidratos: {user_profile['carbs_goal']:.0f} g\n",
-        f"  * Gorduras: {user_profile['fats_goal']:.0f} g\n",
-        consumption_summary,
-        "\n",
-        foods_summary,
-        "\n",
-    ]
-
-    system_prompt = (
-        "".join(system_prompt_parts)
-        + """
-
-REGRAS CRÍTICAS SOBRE ALIMENTOS E REFEIÇÕES BRASILEIRAS:
-
-1. USE APENAS ALIMENTOS DA BASE DE DADOS:
-   - Você DEVE usar APENAS os alimentos listados acima
-   - Se o usuário mencionar um alimento específico, verifique PRIMEIRO se ele está na lista (especialmente na seção "ALIMENTOS MENCIONADOS")
-   - Se o alimento mencionado estiver na lista, SEMPRE use-o e confirme que ele está disponível
-   - Se o alimento mencionado NÃO estiver na lista, informe educadamente que não está disponível na base de dados e sugira alternativas similares que existam
-   - Sempre mencione o CÓDIGO do alimento ao recomendar (ex: "Arroz branco (código: ARR001)")
-   - NUNCA diga que um alimento não está disponível se ele aparecer na lista acima
-
-2. LÓGICA DE REFEIÇÕES BRASILEIRAS (MUITO IMPORTANTE):
-   - CAFÉ DA MANHÃ: Use apenas alimentos típicos de café da manhã brasileiro:
-     * Pães, torradas, bolachas, cereais, aveia, granola
-     * Leite, iogurte, queijos, requeijão, manteiga
-     * Ovos (omelete, mexidos, cozidos)
-     * Frutas, sucos, café, chá
-     * Tapioca, crepioca, panqueca
-     * NUNCA recomende: feijão, arroz, macarrão, carnes principais, pratos quentes pesados
-   
-   - ALMOÇO: Use alimentos típicos de almoço brasileiro:
-     * Arroz, feijão, batata, batata doce, mandioca
-     * Carnes (frango, carne bovina, peixe)
-     * Saladas e legumes
-     * Macarrão, lasanha (ocasionalmente)
-     * NUNCA recomende: alimentos típicos de café da manhã como pão com manteiga, cereais
-   
-   - JANTAR: Similar ao almoço, mas pode ser mais leve:
-     * Pode incluir os mesmos alimentos do almoço
-     * Pode ser mais leve (sopas, saladas maiores)
-     * NUNCA recomende: alimentos típicos de café da manhã
-   
-   - LANCHE DA MANHÃ/TARDE: Alimentos leves e práticos:
-     * Frutas, iogurte, queijo
-     * Bolachas, biscoitos, barras de cereal
-     * Castanhas, nozes, amendoim
-     * Sucos, vitaminas
-     * NUNCA recomende: pratos principais como arroz e feijão
-   
-   - CEIA: Alimentos muito leves:
-     * Chá, leite morno
-     * Frutas leves, iogurte
-     * Bolachas leves
-     * NUNCA recomende: pratos pesados ou alimentos típicos de almoço
-
-3. EXEMPLOS DO QUE NÃO FAZER (ERRADO):
-   - ❌ Recomendar feijão no café da manhã
-   - ❌ Recomendar pão com manteiga no almoço
-   - ❌ Recomendar arroz e feijão no lanche
-   - ❌ Recomendar alimentos que não estão na base de dados
-
-4. EXEMPLOS DO QUE FAZER (CORRETO):
-   - ✅ Café da manhã: Pão integral, queijo, ovo, fruta
-   - ✅ Almoço: Arroz, feijão, frango grelhado, salada
-   - ✅ Lanche: Banana, iogurte, castanhas
-   - ✅ Jantar: Peixe grelhado, batata doce, legumes
-   - ✅ Ceia: Chá, fruta leve
-
-FORMATO DE RESPOSTA PARA RECOMENDAÇÕES (OBRIGATÓRIO):
-IMPORTANTE: Quando o usuário pedir uma recomendação de dieta, alimentos, ou qualquer sugestão nutricional concreta, você DEVE SEMPRE incluir no final da sua resposta um bloco JSON estruturado com as seguintes informações. SEM EXCEÇÕES.
-
-```json
-{
-  "recommendation": true,
-  "meals": [
-    {
-      "meal_type": "cafe_da_manha",
-      "foods": [
-        {
-          "code": "CODIGO_DO_ALIMENTO",
-          "name": "Nome do Alimento",
-          "quantity": 100,
-          "calories": 200,
-          "proteins": 10,
-          "carbs": 30,
-          "fats": 5
-        }
-      ]
-    }
-  ]
-}
-```
-
-TIPOS DE REFEIÇÃO VÁLIDOS:
-- "cafe_da_manha" - Café da Manhã
-- "lanche_manha" - Lanche da Manhã
-- "almoco" - Almoço
-- "lanche_tarde" - Lanche da Tarde
-- "janta" - Jantar
-- "ceia" - Ceia
-
-REGRAS CRÍTICAS SOBRE O JSON DE RECOMENDAÇÃO:
-- Use APENAS os códigos de alimentos que estão na lista acima
-- Calcule as quantidades baseadas nos valores por 100g fornecidos
-- SEMPRE inclua o JSON quando o usuário pedir uma recomendação de dieta, alimentos, ou sugestões nutricionais
-- O JSON é OBRIGATÓRIO quando você fornecer uma recomendação concreta de alimentos
-- O JSON deve estar no final da resposta, após o texto explicativo
-- O JSON deve estar dentro de um bloco de código markdown: ```json ... ```
-- Após fornecer a recomendação no texto, SEMPRE inclua o JSON e então pergunte: "Gostaria que eu adicione esta recomendação ao seu diário de hoje?"
-- Exemplo de estrutura de resposta:
-  1. Texto explicativo da recomendação
-  2. Bloco JSON com os alimentos
-  3. Pergunta se deseja adicionar ao diário
-
-DIRETRIZES GERAIS:
-1. Sempre forneça respostas em português brasileiro
-2. Seja profissional, mas amigável e encorajador
-3. Use as informações do perfil do usuário para personalizar suas recomendações
-4. Quando recomendar dietas, considere as metas nutricionais do usuário E o que já foi consumido no dia
-5. Se o usuário já consumiu alimentos, considere o que falta para atingir as metas ao fazer recomendações
-6. Seja específico com quantidades e porções quando possível
-7. Sempre mencione o CÓDIGO do alimento ao recomendar
-8. Se não tiver certeza sobre algo, seja honesto e recomende consultar um nutricionista
-9. Mantenha as respostas concisas mas informativas
-10. Use emojis moderadamente para tornar a conversa mais amigável
-11. SEMPRE considere o consumo atual do dia ao fazer recomendações nutricionais
-12. RESPEITE A LÓGICA BRASILEIRA DE REFEIÇÕES - não recomende alimentos inadequados para cada horário"""
+@bp.route("/chatbot/stream", methods=["POST"])
+@login_required
+def chatbot_stream():
+    """
+    Mesma conversa de /chatbot, com a resposta enviada em Server-Sent Events.
+
+    Eventos: ``token`` ({"text"}) com o texto visível conforme o modelo gera
+    (o JSON da recomendação não é repassado), ``recommendation`` com o JSON
+    estruturado (ou null) e ``done`` ({"success", "response", "conversation_id"})
+    com a resposta completa e o id da conversa a enviar na próxima mensagem
+    (mais ``"cached": true`` quando veio do cache de respostas). Falhas depois
+    do início viram um evento ``error``.
+    """
+    data = request.get_json()
+    user_message = data.get("message")
+    requested_date = data.get("date")
+    output_mode = data.get("output_mode") or current_app.config.get(
+        "CHATBOT_OUTPUT_MODE", "structured"
     )
 
-    # Preparar histórico de conversa
-    messages = [{"role": "system", "content": system_prompt}]
-
-    # Adicionar histórico de conversa (últimas 10 mensagens para não exceder tokens)
-    for msg in conversation_history[-10:]:
-        messages.append(
-            {"role": msg.get("role", "user"), "content": msg.get("content", "")}
-        )
+    if not user_message:
+        return jsonify({"error": "Mensagem não fornecida"}), 400
+    if output_mode not in OUTPUT_MODES:
+        return jsonify({"error": f"Invalid output_mode: {output_mode}"}), 400
 
-    # Adicionar mensagem atual
-    # Se o usuário estiver pedindo uma recomendação de dieta, adicionar instrução extra
-    user_message_lower = user_message.lower()
-    if any(
-        keyword in user_message_lower
-        for keyword in [
-            "recomende",
-            "recomendação",
-            "dieta",
-            "dietas",
-            "sugira",
-            "sugestão",
-            "me dê",
-            "me dê uma",
-            "quero",
-            "preciso",
-            "pode me ajudar com",
-        ]
-    ):
-        # Adicionar uma mensagem do sistema antes da mensagem do usuário para reforçar
-        messages.append(
+    client = get_openai_client()
+    if client is None:
+        return jsonify(
             {
-                "role": "system",
-                "content": "IMPORTANTE: O usuário está pedindo uma recomendação. Você DEVE incluir um bloco JSON com os alimentos recomendados no formato especificado. O JSON é OBRIGATÓRIO.",
+                "error": "API key não configurada. Configure OPENAI_API_KEY no config.py ou como variável de ambiente."
             }
-        )
-
-    messages.append({"role": "user", "content": user_message})
+        ), 500
 
-    try:
-        # Inicializar cliente OpenAI
-        # Garantir que apenas api_key seja passado (sem proxies ou outras configurações)
-        # Limpar qualquer configuração de proxy que possa estar sendo passada implicitamente
-        import os
-        # Remover temporariamente variáveis de ambiente de proxy se existirem
-        proxy_vars = ['HTTP_PROXY', 'HTTPS_PROXY', 'http_proxy', 'https_proxy', 'ALL_PROXY', 'all_proxy']
-        saved_proxies = {}
-        for var in proxy_vars:
-            if var in os.environ:
-                saved_proxies[var] = os.environ.pop(var)
-        
-        try:
-            # Inicializar cliente apenas com api_key
-            client = OpenAI(api_key=api_key)
-        finally:
-            # Restaurar variáveis de ambiente de proxy se existirem
-            for var, value in saved_proxies.items():
-                os.environ[var] = value
+    # Conversa guardada no servidor: o cliente manda só a mensagem nova e o
+    # conversation_id (ver app/utils/chat_conversations.py)
+    conversation, conversation_history, summary = conversation_for_request(
+        current_user.id, data
+    )
 
-        # Chamada à API
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",  # Modelo mais econômico e rápido
-            messages=messages,
-            temperature=0.7,
-            max_tokens=2000,  # Aumentado para evitar que JSON seja cortado
+    # Cache de respostas: mesma regra de /chatbot
+    cache_key = None
+    cached = None
+    if cache_enabled(data) and not conversation_history and not summary:
+        cache_key = response_cache_key(
+            current_user, user_message, requested_date, output_mode
+        )
+        cached = get_cached_response(cache_key)
+    if cached is None:
+        messages = build_chatbot_messages(
+            user_message, conversation_history, requested_date, output_mode, summary
         )
 
-        assistant_message = response.choices[0].message.content
+    def replay_cached():
+        if conversation is not None:
+            record_turn(conversation, user_message, cached["response"])
+        if cached["visible"]:
+            yield sse_event("token", {"text": cached["visible"]})
+        yield sse_event("recommendation", cached["recommendation"])
+        yield sse_event(
+            "done",
+            {
+                "success": True,
+                "response": cached["response"],
+                "conversation_id": conversation.session_id if conversation else None,
+                "cached": True,
+            },
+        )
 
-        # Tentar extrair JSON de recomendação da resposta
-        recommendation_data = None
+    def generate():
+        parser = reply_parser(output_mode)
+        visible = []
+        output_tokens = None
+        prompt_tokens = None
         try:
-            import json
-
-            # Procurar por bloco JSON na resposta (entre ```json e ```)
-            # Usar DOTALL para capturar múltiplas linhas
-            # Modificar para capturar JSON mesmo que esteja incompleto (sem fechar })
-            json_match = re.search(
-                r"```json\s*(\{[\s\S]*?)(?:\}\s*```|```)", assistant_message
+            start = time.perf_counter()
+            stream = client.chat.completions.create(
+                messages=messages,
+                stream=True,
+                # O último chunk traz o uso de tokens (sem choices)
+                stream_options={"include_usage": True},
+                **completion_params(output_mode),
             )
-            if json_match:
-                json_str = json_match.group(1)
-                json_str = json_str.strip()
-
-                # Se não terminar com }, tentar fechar automaticamente
-                if not json_str.rstrip().endswith("}"):
-                    # Contar chaves abertas vs fechadas
-                    open_count = json_str.count("{") - json_str.count("}")
-                    if open_count > 0:
-                        # Fechar chaves abertas
-                        json_str += "}" * open_count
-                        # Fechar arrays abertos
-                        open_arrays = json_str.count("[") - json_str.count("]")
-                        if open_arrays > 0:
-                            json_str += "]" * open_arrays
-
-                try:
-                    recommendation_data = json.loads(json_str)
-                except json.JSONDecodeError:
-                    # Se ainda falhar, tentar método de correção abaixo
-                    pass
-            else:
-                # Tentar encontrar JSON sem o bloco de código (caso o modelo não use o formato)
-                # Primeiro, tentar encontrar um JSON completo balanceado
-                json_match = re.search(
-                    r'\{[\s\S]*?"recommendation"[\s\S]*?\}',
-                    assistant_message,
-                    re.DOTALL,
+            for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    output_tokens = chunk.usage.completion_tokens
+                    prompt_tokens = chunk.usage.prompt_tokens
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                text = parser.feed(chunk.choices[0].delta.content)
+                if text:
+                    visible.append(text)
+                    yield sse_event("token", {"text": text})
+
+            text = parser.close()
+            calibrate(messages, prompt_tokens)
+            record_chatbot_call(
+                output_mode,
+                time.perf_counter() - start,
+                output_tokens,
+                parser.parse_failed,
+            )
+            if text:
+                visible.append(text)
+                yield sse_event("token", {"text": text})
+            if cache_key and not parser.parse_failed:
+                store_cached_response(
+                    cache_key,
+                    current_user.id,
+                    {
+                        "response": parser.response,
+                        "visible": "".join(visible),
+                        "recommendation": parser.recommendation,
+                    },
                 )
-                if json_match:
-                    json_str = json_match.group(0)
-                    # Tentar balancear chaves manualmente para garantir JSON válido
-                    brace_count = 0
-                    start_pos = json_str.find("{")
-                    if start_pos != -1:
-                        end_pos = start_pos
-                        for i, char in enumerate(json_str[start_pos:], start_pos):
-                            if char == "{":
-                                brace_count += 1
-                            elif char == "}":
-                                brace_count -= 1
-                                if brace_count == 0:
-                                    end_pos = i + 1
-                                    break
-                        if brace_count == 0:
-                            json_str = json_str[start_pos:end_pos]
-                        else:
-                            # Se não conseguiu balancear, usar o match original
-                            json_str = json_str.strip()
-
-                    # Limpar possíveis caracteres problemáticos
-                    json_str = json_str.strip()
-                    # Remover texto antes da primeira chave e depois da última
-                    json_str = re.sub(r"^[^{]*", "", json_str)
-                    json_str = re.sub(r"[^}]*$", "", json_str)
-
-                    try:
-                        recommendation_data = json.loads(json_str)
-                    except json.JSONDecodeError as json_err:
-                        # Se ainda falhar, tentar corrigir o JSON automaticamente
-                        print(f"Tentativa de parse falhou: {json_err}")
-                        print(
-                            f"JSON problemático (primeiros 500 chars): {json_str[:500]}"
-                        )
-
-                        # Tentar corrigir problemas comuns no JSON
-                        try:
-                            # Remover vírgulas finais antes de } e ]
-                            json_str_fixed = re.sub(r",\s*}", "}", json_str)
-                            json_str_fixed = re.sub(r",\s*]", "]", json_str_fixed)
-
-                            # Adicionar vírgulas faltando entre objetos em arrays
-                            # Padrão: } seguido de { sem vírgula (mas não dentro de strings)
-                            json_str_fixed = re.sub(r"}\s*{", "},{", json_str_fixed)
-
-                            # Adicionar vírgulas faltando entre propriedades dentro de objetos
-                            # Padrão: número ou string seguido de " sem vírgula
-                            # Exemplo: "fats": 8.7\n        } -> precisa de vírgula se houver próximo objeto
-
-                            # Tentar parsear novamente
-                            recommendation_data = json.loads(json_str_fixed)
-                            print("✅ JSON corrigido e parseado com sucesso!")
-                        except (json.JSONDecodeError, ValueError) as fix_err:
-                            print(f"Tentativa de correção falhou: {fix_err}")
-                            # Se ainda falhar, tentar método mais agressivo
-                            try:
-                                # Tentar encontrar e extrair apenas a estrutura de meals
-                                # Capturar tudo após "meals": [ até encontrar ] ou fim da string
-                                meals_match = re.search(
-                                    r'"meals"\s*:\s*\[([\s\S]*)',
-                                    json_str_fixed,
-                                    re.DOTALL,
-                                )
-                                if meals_match:
-                                    # Reconstruir JSON mínimo válido
-                                    meals_content = meals_match.group(1)
-
-                                    # Tentar corrigir vírgulas faltando entre objetos
-                                    meals_content = re.sub(
-                                        r"}\s*{", "},{", meals_content
-                                    )
-
-                                    # Tentar fechar estruturas abertas
-                                    meals_content = meals_content.rstrip()
-
-                                    # Fechar objetos abertos primeiro
-                                    open_braces = meals_content.count(
-                                        "{"
-                                    ) - meals_content.count("}")
-                                    if open_braces > 0:
-                                        # Fechar objetos abertos
-                                        meals_content += "}" * open_braces
-
-                                    # Fechar arrays abertos
-                                    open_arrays = meals_content.count(
-                                        "["
-                                    ) - meals_content.count("]")
-                                    if open_arrays > 0:
-                                        meals_content += "]" * open_arrays
-
-                                    # Se não terminar com ], adicionar
-                                    if not meals_content.rstrip().endswith("]"):
-                                        meals_content += "]"
-
-                                    minimal_json = f'{{"recommendation": true, "meals": [{meals_content}]}}'
-                                    recommendation_data = json.loads(minimal_json)
-                                    print(
-                                        "✅ JSON reconstruído e parseado com sucesso!"
-                                    )
-                            except (json.JSONDecodeError, ValueError) as recon_err:
-                                print(f"Tentativa de reconstrução falhou: {recon_err}")
-                                # Se ainda falhar, tentar método alternativo
-                                pass
-
-                        # Tentar encontrar o JSON completo procurando do início
-                        # Encontrar todas as ocorrências de { que podem ser o início do JSON
-                        start_positions = [
-                            i for i, char in enumerate(assistant_message) if char == "{"
-                        ]
-                        for start_pos in start_positions:
-                            brace_count = 0
-                            end_pos = start_pos
-                            in_string = False
-                            escape_next = False
-
-                            for i, char in enumerate(
-                                assistant_message[start_pos:], start_pos
-                            ):
-                                if escape_next:
-                                    escape_next = False
-                                    continue
-
-                                if char == "\\":
-                                    escape_next = True
-                                    continue
-
-                                if char == '"' and not escape_next:
-                                    in_string = not in_string
-                                    continue
-
-                                if not in_string:
-                                    if char == "{":
-                                        brace_count += 1
-                                    elif char == "}":
-                                        brace_count -= 1
-                                        if brace_count == 0:
-                                            end_pos = i + 1
-                                            break
-
-                            if brace_count == 0:
-                                test_json = assistant_message[start_pos:end_pos]
-                                if '"recommendation"' in test_json:
-                                    try:
-                                        # Tentar parsear diretamente
-                                        recommendation_data = json.loads(test_json)
-                                        print(
-                                            "JSON encontrado e parseado com sucesso usando método alternativo"
-                                        )
-                                        break
-                                    except json.JSONDecodeError as json_err:
-                                        # Tentar corrigir o JSON antes de parsear
-                                        try:
-                                            # Remover vírgulas finais
-                                            test_json_fixed = re.sub(
-                                                r",\s*}", "}", test_json
-                                            )
-                                            test_json_fixed = re.sub(
-                                                r",\s*]", "]", test_json_fixed
-                                            )
-                                            # Remover vírgulas duplicadas
-                                            test_json_fixed = re.sub(
-                                                r",\s*,", ",", test_json_fixed
-                                            )
-
-                                            recommendation_data = json.loads(
-                                                test_json_fixed
-                                            )
-                                            print(
-                                                "JSON corrigido e parseado com sucesso usando método alternativo"
-                                            )
-                                            break
-                                        except (json.JSONDecodeError, ValueError):
-                                            continue
-                                    except (ValueError, TypeError):
-                                        continue
-                        pass
+            if conversation is not None:
+                record_turn(conversation, user_message, parser.response)
+            yield sse_event("recommendation", parser.recommendation)
+            yield sse_event(
+                "done",
+                {
+                    "success": True,
+                    "response": parser.response,
+                    "conversation_id": (
+                        conversation.session_id if conversation else None
+                    ),
+                },
+            )
+
         except Exception as e:
-            # Se não conseguir parsear, continua sem recomendação
-            print(f"Erro ao parsear JSON de recomendação: {e}")
-            # Log do conteúdo que causou erro para debug
-            if len(assistant_message) > 500:
-                print(f"Últimos 500 caracteres da resposta: {assistant_message[-500:]}")
-            else:
-                print(f"Resposta completa: {assistant_message}")
-            pass
+            import traceback
 
-        # Log para debug
-        if recommendation_data:
-            print("✅ JSON de recomendação parseado com sucesso!")
-            print(f"   Refeições: {len(recommendation_data.get('meals', []))}")
-            for meal in recommendation_data.get("meals", []):
-                print(
-                    f"   - {meal.get('meal_type')}: {len(meal.get('foods', []))} alimento(s)"
-                )
-        else:
-            print("⚠️ Nenhum JSON de recomendação encontrado na resposta")
-            print(f"   Últimos 200 caracteres da resposta: {assistant_message[-200:]}")
+            print(f"Erro ao chamar OpenAI: {traceback.format_exc()}")
+            yield sse_event(
+                "error",
+                {"success": False, "error": f"Erro ao processar mensagem: {str(e)}"},
+            )
+            return
 
-        return jsonify(
-            {
-                "success": True,
-                "response": assistant_message,
-                "recommendation": recommendation_data,
-            }
-        )
+        # Resumo das mensagens antigas depois do "done": o cliente já tem a
+        # resposta e não espera por esta chamada extra ao modelo
+        if conversation is not None:
+            try:
+                compact_conversation(conversation, client)
+            except Exception:
+                import traceback
 
-    except Exception as e:
-        import traceback
+                db.session.rollback()
+                print(f"Erro ao resumir conversa: {traceback.format_exc()}")
 
-        print(f"Erro ao chamar OpenAI: {traceback.format_exc()}")
-        return jsonify(
-            {"success": False, "error": f"Erro ao processar mensagem: {str(e)}"}
-        ), 500
+    return Response(
+        stream_with_context(generate() if cached is None else replay_cached()),
+        mimetype="text/event-stream",
+        # Sem cache nem buffer em proxies: cada evento segue assim que é gerado
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -3,10 +3,11 @@ from flask import render_template, redirect, url_for, jsonify, request
 from flask_login import login_required, current_user
 from app import db
 from app.blueprints.main import bp
-from app.models import Diet, FoodData, UserFood
+from app.models import Diet
 from app.constants import MEAL_TYPES, MACRO_TYPES
 from app.models.meal_template import MealTemplate
 from app.decorators import admin_required
+from app.utils.food_resolver import resolve_foods
 
 
 @bp.route("/")
@@ -136,6 +137,18 @@ def meals():
             user_id=None
         ).order_by(MealTemplate.meal_type, MealTemplate.name).all()
     
+    # Resolver todos os alimentos dos templates de uma vez
+    # (alimentos personalizados do usuário têm prioridade sobre os globais)
+    user_id = current_user.id if current_user.is_authenticated else None
+    resolved_foods = resolve_foods(
+        (
+            food_item.get("food_code")
+            for template in templates
+            for food_item in (template.meals_data or [])
+        ),
+        user_id,
+    )
+
     # Calcular valores nutricionais para cada template
     templates_with_nutrition = []
     for template in templates:
@@ -149,26 +162,14 @@ def meals():
                 food_code = food_item.get("food_code")
                 quantity = food_item.get("quantity", 0)
                 
-                if food_code and quantity:
-                    # Buscar dados nutricionais do alimento
-                    food_data = None
-                    if current_user.is_authenticated:
-                        # First try user's custom foods
-                        food_data = UserFood.query.filter_by(
-                            code=food_code, user_id=current_user.id
-                        ).first()
-                    
-                    # If not found, try global foods
-                    if not food_data:
-                        food_data = FoodData.query.filter_by(code=food_code).first()
-                    
-                    if food_data:
-                        # Calcular valores proporcionais baseados na quantidade
-                        ratio = quantity / food_data.quantity
-                        total_calories += food_data.calories * ratio
-                        total_proteins += food_data.proteins * ratio
-                        total_carbs += food_data.carbs * ratio
-                        total_fats += food_data.fats * ratio
+                food_data = resolved_foods.get(food_code) if food_code else None
+                if food_data and quantity:
+                    # Calcular valores proporcionais baseados na quantidade
+                    nutrition = food_data.nutrition(float(quantity))
+                    total_calories += nutrition["calories"]
+                    total_proteins += nutrition["proteins"]
+                    total_carbs += nutrition["carbs"]
+                    total_fats += nutrition["fats"]
         
         templates_with_nutrition.append({
             "template": template,
@@ -2,5 +2,7 @@ from .user import User
 from .diet import Diet
 from .food_data import FoodData
 from .user_food import UserFood
+from .chat_conversation import ChatConversation
+from .chatbot_response_cache import ChatbotResponseCache
 
-__all__ = ["User", "Diet", "FoodData", "UserFood"]
+__all__ = ["User", "Diet", "FoodData", "UserFood", "ChatConversation", "ChatbotResponseCache"]
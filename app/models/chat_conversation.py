@@ -0,0 +1,27 @@
+from datetime import datetime
+
+from app import db
+
+
+class ChatConversation(db.Model):
+    """Conversa do chatbot (Nutri AI) guardada no servidor"""
+
+    __tablename__ = "chat_conversations"
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    session_id = db.Column(db.String(32), nullable=False)  # conversation_id enviado pelo cliente
+    summary = db.Column(db.Text, nullable=True)  # Resumo das mensagens antigas
+    summarized_messages = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    messages = db.Column(db.JSON, nullable=True)  # Mensagens recentes [{"role", "content"}]
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+
+    # Relationship
+    user = db.relationship("User", backref="chat_conversations")
+
+    # Um conversation_id é único por usuário
+    __table_args__ = (db.UniqueConstraint("user_id", "session_id", name="unique_user_chat_session"),)
+
+    def __repr__(self):
+        return f"<ChatConversation {self.session_id} ({len(self.messages or [])} mensagens)>"
@@ -0,0 +1,18 @@
+from datetime import datetime
+
+from app import db
+
+
+class ChatbotResponseCache(db.Model):
+    """Respostas do chatbot compartilhadas entre os workers (ver app/utils/chatbot_cache.py)"""
+
+    __tablename__ = "chatbot_response_cache"
+
+    key = db.Column(db.String(64), primary_key=True)  # sha256 da pergunta e do contexto
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, index=True)
+    payload = db.Column(db.JSON, nullable=False)  # {"response", "visible", "recommendation"}
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<ChatbotResponseCache {self.key[:12]} (user {self.user_id})>"
@@ -1,4 +1,7 @@
+from sqlalchemy import event
+
 from app import db
+from app.models.food_fields import update_derived_food_fields
 
 
 class FoodData(db.Model):
@@ -15,5 +18,38 @@ class FoodData(db.Model):
     carbs = db.Column(db.Float, nullable=False)
     fats = db.Column(db.Float, nullable=False)
 
+    # Macros per 100g - kept in sync by the listener below
+    calories_100g = db.Column(db.Float, nullable=False, default=0.0, server_default="0")
+    proteins_100g = db.Column(db.Float, nullable=False, default=0.0, server_default="0")
+    carbs_100g = db.Column(db.Float, nullable=False, default=0.0, server_default="0")
+    fats_100g = db.Column(db.Float, nullable=False, default=0.0, server_default="0")
+
+    # Meal types suggested for the food (comma-separated) - kept in sync by the listener below
+    meal_categories = db.Column(db.String(120), nullable=True)
+
+    # Normalized search keys (unaccented, lowercase) - kept in sync by the listener below
+    search_code = db.Column(db.String(255), nullable=True)
+    search_name = db.Column(db.String(255), nullable=True)
+
+    __table_args__ = (
+        # varchar_pattern_ops lets PostgreSQL use the index for LIKE 'prefix%'
+        db.Index(
+            "ix_food_data_search_code",
+            "search_code",
+            postgresql_ops={"search_code": "varchar_pattern_ops"},
+        ),
+        db.Index(
+            "ix_food_data_search_name",
+            "search_name",
+            postgresql_ops={"search_name": "varchar_pattern_ops"},
+        ),
+    )
+
     def __repr__(self):
         return f"<FoodData {self.code} - {self.name}>"
+
+
+@event.listens_for(FoodData, "before_insert")
+@event.listens_for(FoodData, "before_update")
+def _update_derived_fields(mapper, connection, target):
+    update_derived_food_fields(target)
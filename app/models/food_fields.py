@@ -0,0 +1,23 @@
+"""
+Campos derivados comuns a FoodData e UserFood.
+
+Chaves de busca normalizadas, macros por 100g e categorias de refeição são
+recalculados sempre que um alimento é inserido ou alterado, pelos listeners
+registrados em cada modelo.
+"""
+from app.constants import MACRO_TYPES
+from app.utils.meal_categories import encode_meal_types, meal_types_for
+from app.utils.text import normalize_search_text
+
+
+def update_derived_food_fields(target):
+    """Atualiza chaves de busca, macros por 100g e categorias a partir dos campos base"""
+    target.search_code = normalize_search_text(target.code)
+    target.search_name = normalize_search_text(target.name)
+    target.meal_categories = encode_meal_types(meal_types_for(target.name))
+
+    # Alimentos com quantidade 0 ficam com macros zerados em vez de dividir por zero
+    quantity = target.quantity or 0
+    for macro in MACRO_TYPES:
+        value = getattr(target, macro) or 0
+        setattr(target, f"{macro}_100g", 100 * value / quantity if quantity > 0 else 0.0)
@@ -1,4 +1,7 @@
+from sqlalchemy import event
+
 from app import db
+from app.models.food_fields import update_derived_food_fields
 from datetime import datetime
 
 
@@ -19,12 +22,44 @@ class UserFood(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    # Macros per 100g - kept in sync by the listener below
+    calories_100g = db.Column(db.Float, nullable=False, default=0.0, server_default="0")
+    proteins_100g = db.Column(db.Float, nullable=False, default=0.0, server_default="0")
+    carbs_100g = db.Column(db.Float, nullable=False, default=0.0, server_default="0")
+    fats_100g = db.Column(db.Float, nullable=False, default=0.0, server_default="0")
+
+    # Meal types suggested for the food (comma-separated) - kept in sync by the listener below
+    meal_categories = db.Column(db.String(120), nullable=True)
+
+    # Normalized search keys (unaccented, lowercase) - kept in sync by the listener below
+    search_code = db.Column(db.String(255), nullable=True)
+    search_name = db.Column(db.String(255), nullable=True)
+
     # Relationship
     user = db.relationship("User", backref="custom_foods")
 
     # Unique constraint: user_id + code combination must be unique
-    __table_args__ = (db.UniqueConstraint("user_id", "code", name="unique_user_food_code"),)
+    __table_args__ = (
+        db.UniqueConstraint("user_id", "code", name="unique_user_food_code"),
+        db.Index(
+            "ix_user_foods_user_search_code",
+            "user_id",
+            "search_code",
+            postgresql_ops={"search_code": "varchar_pattern_ops"},
+        ),
+        db.Index(
+            "ix_user_foods_user_search_name",
+            "user_id",
+            "search_name",
+            postgresql_ops={"search_name": "varchar_pattern_ops"},
+        ),
+    )
 
     def __repr__(self):
         return f"<UserFood {self.code} - {self.name} (User: {self.user_id})>"
 
+
+@event.listens_for(UserFood, "before_insert")
+@event.listens_for(UserFood, "before_update")
+def _update_derived_fields(mapper, connection, target):
+    update_derived_food_fields(target)
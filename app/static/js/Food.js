@@ -46,55 +46,36 @@ class Food {
       // Clear existing foods for this meal type
       tbody.innerHTML = "";
 
-      // Add each food from the template
-      for (const food of data.template.meals_data) {
-        // Fetch nutritional information for the food
-        try {
-          const nutritionResponse = await fetch(
-            `/api/food_nutrition?code=${encodeURIComponent(food.food_code)}`
-          );
-          
-          // Verifica se a resposta é JSON
-          const contentType = nutritionResponse.headers.get("content-type");
-          if (!contentType || !contentType.includes("application/json")) {
-            console.error(
-              `Resposta inválida ao buscar informações nutricionais para ${food.food_code}`
-            );
-            continue;
-          }
-          
-          const nutritionData = await nutritionResponse.json();
-
-          if (!nutritionData.success) {
-            console.error(
-              `Erro ao buscar informações nutricionais para ${food.food_code}`
-            );
-            continue;
-          }
-
-          // Calculate nutritional values based on quantity
-          const quantity = parseFloat(food.quantity);
-          const foodWithNutrition = {
-            ...food,
-            calories:
-              (nutritionData.calories * quantity) / nutritionData.quantity,
-            proteins:
-              (nutritionData.proteins * quantity) / nutritionData.quantity,
-            carbs: (nutritionData.carbs * quantity) / nutritionData.quantity,
-            fats: (nutritionData.fats * quantity) / nutritionData.quantity,
-          };
+      // Fetch nutritional information for all template foods at once
+      const templateFoods = data.template.meals_data || [];
+      const nutritionList = await fetchFoodNutritionBatch(
+        templateFoods.map((food) => ({
+          code: food.food_code,
+          quantity: parseFloat(food.quantity),
+        }))
+      );
 
-          const row = Food.setupFoodRow(foodWithNutrition, mealType, true);
-          tbody.appendChild(row);
-        } catch (error) {
+      // Add each food from the template
+      templateFoods.forEach((food, index) => {
+        const nutritionData = nutritionList[index];
+        if (!nutritionData || !nutritionData.success) {
           console.error(
-            `Erro ao processar alimento ${food.food_code}:`,
-            error
+            `Erro ao buscar informações nutricionais para ${food.food_code}`
           );
-          // Continua com o próximo alimento mesmo se houver erro
-          continue;
+          return;
         }
-      }
+
+        const foodWithNutrition = {
+          ...food,
+          calories: nutritionData.calories,
+          proteins: nutritionData.proteins,
+          carbs: nutritionData.carbs,
+          fats: nutritionData.fats,
+        };
+
+        const row = Food.setupFoodRow(foodWithNutrition, mealType, true);
+        tbody.appendChild(row);
+      });
 
       // Update totals
       Food.updateTotalsFor(mealType);
@@ -29,6 +29,18 @@ async function makeDietApiCall(url, options = {}) {
   }
 }
 
+// Busca os valores nutricionais de vários alimentos em uma única requisição.
+// items: [{ code, quantity }] -> lista na mesma ordem, cada item com
+// { success, food_code, quantity, calories, proteins, carbs, fats }
+async function fetchFoodNutritionBatch(items) {
+  const data = await makeDietApiCall("/api/food_nutrition/batch", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ items }),
+  });
+  return data.foods;
+}
+
 function handleApiError(error, customMessage) {
   console.error("[API Error]", error);
   alert(`${customMessage}: ${error.message}`);
@@ -248,6 +248,8 @@ async function calculatePortions() {
 
   const tolerance =
     parseFloat(document.getElementById("tolerance").value) / 100;
+  const roundingInput = document.getElementById("roundPortions");
+  const rounding = roundingInput ? roundingInput.checked : false;
 
   if (Object.values(targets).every((v) => v === 0)) {
     showAlert(
@@ -287,6 +289,7 @@ async function calculatePortions() {
       body: JSON.stringify({
         targets,
         tolerance,
+        rounding,
         foods: Array.from(selectedFoods.values()).map((f) => ({
           code: f.code,
           min: f.min,
@@ -312,7 +315,14 @@ async function calculatePortions() {
 
     if (data.success) {
       displayResults(data.portions);
-      showAlert("Cálculo realizado com sucesso!", "success");
+      if (rounding && !data.rounded) {
+        showAlert(
+          "Cálculo realizado, mas não foi possível arredondar as porções sem sair da tolerância.",
+          "warning"
+        );
+      } else {
+        showAlert("Cálculo realizado com sucesso!", "success");
+      }
     } else {
       showAlert(data.error || "Erro ao calcular porções.", "danger");
     }
@@ -2,6 +2,7 @@
 class ChatBot {
   constructor() {
     this.messages = [];
+    this.conversationId = null; // Conversa guardada no servidor
     this.isLoading = false;
     this.init();
   }
@@ -53,42 +54,75 @@ class ChatBot {
     this.setLoading(true);
 
     try {
-      // Prepare conversation history for context
-      const history = this.messages.map((msg) => ({
-        role: msg.role,
-        content: msg.content,
-      }));
-
-      // Send to API
-      const response = await fetch("/api/chatbot", {
+      // Send to API (resposta em Server-Sent Events). O histórico fica no
+      // servidor: basta a mensagem nova e o id da conversa
+      const response = await fetch("/api/chatbot/stream", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
         },
         body: JSON.stringify({
           message: message,
-          history: history,
+          conversation_id: this.conversationId,
         }),
       });
 
-      const data = await response.json();
-
-      if (data.success) {
-        // Add assistant response to UI
-        // Log para debug
-        console.log("Resposta do chatbot:", data);
-        console.log("Recomendação extraída:", data.recommendation);
-
-        // Adicionar mensagem com recomendação
-        this.addMessage("assistant", data.response, data.recommendation);
-      } else {
-        // Show error message
+      const contentType = response.headers.get("Content-Type") || "";
+      if (!contentType.startsWith("text/event-stream")) {
+        // Erros de validação voltam como JSON antes do streaming começar
+        const data = await response.json();
         this.addMessage(
           "assistant",
           `Desculpe, ocorreu um erro: ${
             data.error || "Erro desconhecido"
           }. Por favor, tente novamente.`
         );
+        return;
+      }
+
+      let streamingMessage = null;
+      let streamedText = "";
+      let recommendation = null;
+      let finished = false;
+
+      await this.readEventStream(response, (event, data) => {
+        if (event === "token") {
+          if (!streamingMessage) {
+            // Primeiro token: trocar o indicador de carregamento pela mensagem
+            this.setLoading(false, true);
+            streamingMessage = this.createStreamingMessage();
+          }
+          streamedText += data.text;
+          this.updateStreamingMessage(streamingMessage, streamedText);
+        } else if (event === "recommendation") {
+          recommendation = data;
+          console.log("Recomendação extraída:", recommendation);
+        } else if (event === "done") {
+          finished = true;
+          if (data.conversation_id) {
+            this.conversationId = data.conversation_id;
+          }
+          if (streamingMessage) {
+            streamingMessage.remove();
+          }
+          // Mensagem final com a resposta completa no lugar da parcial do streaming
+          this.addMessage("assistant", data.response, recommendation);
+        } else if (event === "error") {
+          finished = true;
+          if (streamingMessage) {
+            streamingMessage.remove();
+          }
+          this.addMessage(
+            "assistant",
+            `Desculpe, ocorreu um erro: ${
+              data.error || "Erro desconhecido"
+            }. Por favor, tente novamente.`
+          );
+        }
+      });
+
+      if (!finished) {
+        throw new Error("Conexão encerrada antes do fim da resposta");
       }
     } catch (error) {
       console.error("Erro ao enviar mensagem:", error);
@@ -102,6 +136,60 @@ class ChatBot {
     }
   }
 
+  async readEventStream(response, onEvent) {
+    // Lê o corpo da resposta e chama onEvent(evento, dados) para cada evento SSE
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let separator;
+      while ((separator = buffer.indexOf("\n\n")) !== -1) {
+        const rawEvent = buffer.slice(0, separator);
+        buffer = buffer.slice(separator + 2);
+
+        let event = "message";
+        let data = "";
+        rawEvent.split("\n").forEach((line) => {
+          if (line.startsWith("event:")) {
+            event = line.slice(6).trim();
+          } else if (line.startsWith("data:")) {
+            data += line.slice(5).trim();
+          }
+        });
+        onEvent(event, data ? JSON.parse(data) : null);
+      }
+    }
+  }
+
+  createStreamingMessage() {
+    const chatMessages = document.getElementById("chatMessages");
+    const messageDiv = document.createElement("div");
+    messageDiv.className = "message assistant";
+    messageDiv.innerHTML = `
+      <div class="message-avatar">
+        <i class="fas fa-robot"></i>
+      </div>
+      <div class="message-content">
+        <div class="message-text"></div>
+        <div class="message-time">${this.getCurrentTime()}</div>
+      </div>
+    `;
+    chatMessages.appendChild(messageDiv);
+    return messageDiv;
+  }
+
+  updateStreamingMessage(messageDiv, content) {
+    const chatMessages = document.getElementById("chatMessages");
+    messageDiv.querySelector(".message-text").innerHTML =
+      this.formatMessage(content);
+    chatMessages.scrollTop = chatMessages.scrollHeight;
+  }
+
   addMessage(role, content, recommendation = null) {
     const chatMessages = document.getElementById("chatMessages");
     const messageDiv = document.createElement("div");
@@ -418,13 +506,16 @@ class ChatBot {
     });
   }
 
-  setLoading(loading) {
-    this.isLoading = loading;
+  setLoading(loading, keepInputDisabled = false) {
+    // keepInputDisabled: esconde só o indicador (resposta ainda chegando)
+    this.isLoading = loading || keepInputDisabled;
     const loadingDiv = document.getElementById("chatLoading");
     const sendButton = document.getElementById("sendButton");
     const messageInput = document.getElementById("messageInput");
 
-    if (loading) {
+    if (keepInputDisabled) {
+      loadingDiv.style.display = "none";
+    } else if (loading) {
       loadingDiv.style.display = "block";
       sendButton.disabled = true;
       messageInput.disabled = true;
@@ -0,0 +1,103 @@
+"""
+Cache LRU com expiração (TTL), seguro para as threads do gunicorn.
+
+Usado pelos caches em memória do app (uso de alimentos por usuário, índices
+por usuário, etc.). Cada instância mantém contadores de acertos e falhas.
+``config_cache`` cria o cache no primeiro uso com tamanho e TTL da configuração.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Dicionário limitado a ``maxsize`` itens, cada um válido por ``ttl`` segundos"""
+
+    def __init__(self, maxsize=128, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                value, expires_at = item
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_create(self, key, factory):
+        """Retorna o valor em cache ou cria (fora do lock) e guarda."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = factory()
+            self.set(key, value)
+        return value
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return item[0] if item else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+def config_cache(size_setting, ttl_setting, maxsize=128, ttl=300):
+    """
+    Função que retorna um TTLCache único, criado na primeira chamada com
+    ``maxsize``/``ttl`` lidos de ``current_app.config`` (os argumentos são os
+    valores padrão).
+    """
+    holder = {"cache": None}
+    lock = threading.Lock()
+
+    def get_cache():
+        cache = holder["cache"]
+        if cache is None:
+            with lock:
+                cache = holder["cache"]
+                if cache is None:
+                    cache = TTLCache(
+                        maxsize=current_app.config.get(size_setting, maxsize),
+                        ttl=current_app.config.get(ttl_setting, ttl),
+                    )
+                    holder["cache"] = cache
+        return cache
+
+    return get_cache
@@ -0,0 +1,171 @@
+"""
+Conversas do chatbot guardadas no servidor (ChatConversation).
+
+O cliente envia só a mensagem nova e o ``conversation_id``. As mensagens
+recentes ficam em ``messages``; quando passam de
+CHATBOT_CONVERSATION_MAX_MESSAGES, as mais antigas são resumidas pelo modelo
+e acumuladas em ``summary``, restando as CHATBOT_CONVERSATION_KEEP_MESSAGES
+mais novas. Assim o corpo das requisições e o histórico do prompt ficam
+limitados mesmo em conversas longas, sem perder o contexto antigo.
+
+Se o resumo pelo modelo falhar, as mensagens antigas entram no resumo
+cortadas (FALLBACK_CHARS por mensagem).
+"""
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app import db
+from app.models import ChatConversation
+from app.utils.chatbot_prompt import COMPLETION_PARAMS
+
+SUMMARY_PROMPT = """Você resume conversas entre um usuário e o Nutri AI, um assistente nutricional.
+Atualize o resumo atual com as novas mensagens, mantendo:
+- objetivos, preferências, restrições e alergias do usuário
+- alimentos citados (com os códigos) e quantidades
+- recomendações feitas e se o usuário as aceitou
+- perguntas ainda em aberto
+Escreva em português, em tópicos curtos, sem repetir informação."""
+
+FALLBACK_CHARS = 200  # Por mensagem, no resumo local
+MAX_SUMMARY_CHARS = 4000
+ROLE_NAMES = {"user": "Usuário", "assistant": "Nutri AI"}
+
+
+def conversation_for_request(user_id, data):
+    """
+    (conversa, histórico, resumo) para uma requisição do chatbot.
+
+    Sem ``conversation_id`` uma conversa nova é criada (só é salva com a
+    primeira resposta). Clientes antigos que ainda enviam ``history`` sem
+    ``conversation_id`` continuam sem estado no servidor: conversa None.
+    """
+    conversation_id = data.get("conversation_id")
+    if not conversation_id and "history" in data:
+        return None, data.get("history") or [], None
+
+    conversation = None
+    if conversation_id:
+        conversation = ChatConversation.query.filter_by(
+            user_id=user_id, session_id=str(conversation_id)
+        ).first()
+    if conversation is None:
+        conversation = ChatConversation(
+            user_id=user_id,
+            session_id=uuid.uuid4().hex,
+            messages=[],
+            summarized_messages=0,
+        )
+    return conversation, conversation.messages or [], conversation.summary
+
+
+def record_turn(conversation, user_message, reply):
+    """Guarda a mensagem do usuário e a resposta do assistente"""
+    # Lista nova: a coluna JSON só é marcada como alterada por atribuição
+    conversation.messages = list(conversation.messages or []) + [
+        {"role": "user", "content": user_message},
+        {"role": "assistant", "content": reply},
+    ]
+    if conversation.id is None:
+        db.session.add(conversation)
+        _delete_expired(conversation.user_id)
+    db.session.commit()
+
+
+def _delete_expired(user_id):
+    days = current_app.config.get("CHATBOT_CONVERSATION_RETENTION_DAYS", 30)
+    ChatConversation.query.filter(
+        ChatConversation.user_id == user_id,
+        ChatConversation.updated_at < datetime.utcnow() - timedelta(days=days),
+    ).delete(synchronize_session=False)
+
+
+def compact_conversation(conversation, client):
+    """
+    Resume as mensagens antigas quando passam do limite.
+
+    Devolve True se a conversa foi compactada. Falhas do modelo caem no
+    resumo local; a conversa nunca fica sem compactar por causa delas.
+    """
+    config = current_app.config
+    messages = conversation.messages or []
+    if len(messages) <= config.get("CHATBOT_CONVERSATION_MAX_MESSAGES", 12):
+        return False
+
+    # Número par: a conversa recente sempre começa por uma mensagem do usuário
+    keep = config.get("CHATBOT_CONVERSATION_KEEP_MESSAGES", 6) // 2 * 2
+    split = len(messages) - keep
+    old, recent = messages[:split], messages[split:]
+    conversation.summary = _summarize(client, conversation.summary, old)
+    conversation.summarized_messages = (conversation.summarized_messages or 0) + len(
+        old
+    )
+    conversation.messages = list(recent)
+    db.session.commit()
+    return True
+
+
+def _transcript(messages):
+    return "\n".join(
+        f"{ROLE_NAMES.get(message.get('role'), message.get('role'))}: {message.get('content', '')}"
+        for message in messages
+    )
+
+
+def _summarize(client, summary, messages):
+    if client is not None:
+        try:
+            response = client.chat.completions.create(
+                model=COMPLETION_PARAMS["model"],
+                temperature=0.3,
+                max_tokens=current_app.config.get("CHATBOT_SUMMARY_TOKENS", 300),
+                messages=[
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {
+                        "role": "user",
+                        "content": f"RESUMO ATUAL:\n{summary or '(vazio)'}\n\n"
+                        f"NOVAS MENSAGENS:\n{_transcript(messages)}",
+                    },
+                ],
+            )
+            text = (response.choices[0].message.content or "").strip()
+            if text:
+                _record_compaction(fallback=False)
+                return text
+        except Exception as e:
+            current_app.logger.warning(f"Resumo da conversa pelo modelo falhou: {e}")
+
+    _record_compaction(fallback=True)
+    return _local_summary(summary, messages)
+
+
+def _local_summary(summary, messages):
+    """Resumo sem o modelo: mensagens cortadas, limitado a MAX_SUMMARY_CHARS"""
+    lines = summary.splitlines() if summary else []
+    for message in messages:
+        content = " ".join((message.get("content") or "").split())
+        if len(content) > FALLBACK_CHARS:
+            content = content[:FALLBACK_CHARS].rstrip() + "…"
+        role = ROLE_NAMES.get(message.get("role"), message.get("role"))
+        lines.append(f"- {role}: {content}")
+    # As linhas mais antigas saem primeiro
+    while len(lines) > 1 and sum(len(line) + 1 for line in lines) > MAX_SUMMARY_CHARS:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+_stats_lock = threading.Lock()
+_stats = {"compactions": 0, "summary_fallbacks": 0}
+
+
+def _record_compaction(fallback):
+    with _stats_lock:
+        _stats["compactions"] += 1
+        _stats["summary_fallbacks"] += int(fallback)
+
+
+def conversation_stats():
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,171 @@
+"""
+Cache opcional de respostas do chatbot (CHATBOT_RESPONSE_CACHE).
+
+Perguntas repetidas com o mesmo contexto ("quanto falta para minha meta
+hoje?" sem nada novo no diário) são respondidas sem chamar o modelo. A chave
+é um sha256 de:
+
+- mensagem normalizada (sem acentos, caixa e pontuação);
+- usuário, dia consultado e ``updated_at`` da dieta desse dia;
+- metas e dados do perfil usados no prompt, alimentos personalizados;
+- assinatura do catálogo de alimentos, modelo e formato da resposta.
+
+Só a primeira mensagem de uma conversa passa pelo cache: depois dela a
+resposta depende do histórico. Os itens ficam num LRU com TTL por processo
+e, com CHATBOT_RESPONSE_CACHE_DB, também na tabela chatbot_response_cache,
+compartilhada pelos workers do gunicorn. Erros do banco nunca interrompem a
+conversa: viram falhas de cache.
+"""
+import hashlib
+import json
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func
+
+from app import db
+from app.utils.cache import config_cache
+from app.utils.chatbot_prompt import COMPLETION_PARAMS, resolve_target_date
+from app.utils.food_catalog import catalog_fingerprint
+from app.utils.food_search import tokenize
+from app.utils.text import normalize_search_text
+
+_stats_lock = threading.Lock()
+_stats = {"lookups": 0, "memory_hits": 0, "db_hits": 0, "stores": 0, "db_errors": 0}
+
+
+_get_memory_cache = config_cache(
+    "CHATBOT_RESPONSE_CACHE_SIZE", "CHATBOT_RESPONSE_CACHE_TTL", maxsize=1024, ttl=3600
+)
+
+
+def _db_enabled():
+    return current_app.config.get("CHATBOT_RESPONSE_CACHE_DB", False)
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def cache_enabled(data):
+    """Cache ligado na configuração e não recusado pela requisição ("cache": false)"""
+    return bool(current_app.config.get("CHATBOT_RESPONSE_CACHE", False)) and (
+        data.get("cache", True) is not False
+    )
+
+
+def response_cache_key(user, user_message, requested_date, output_mode):
+    """Chave da resposta para a mensagem no contexto atual do usuário"""
+    from app.models import Diet, UserFood
+
+    target_date = resolve_target_date(user_message, requested_date)
+    diary_updated_at = (
+        db.session.query(Diet.updated_at)
+        .filter(Diet.user_id == user.id, Diet.date == target_date)
+        .scalar()
+    )
+    user_foods = (
+        db.session.query(func.count(UserFood.id), func.max(UserFood.updated_at))
+        .filter(UserFood.user_id == user.id)
+        .one()
+    )
+    parts = {
+        "message": " ".join(tokenize(normalize_search_text(user_message))),
+        "user": user.id,
+        "date": target_date,
+        "diary": diary_updated_at,
+        "profile": [
+            user.calories_goal,
+            user.proteins_goal,
+            user.carbs_goal,
+            user.fats_goal,
+            user.peso,
+            user.altura,
+            user.idade,
+            user.sexo,
+            user.objetivo,
+            user.fator_atividade,
+        ],
+        "user_foods": list(user_foods),
+        "catalog": catalog_fingerprint(
+            current_app.config.get("FOOD_CATALOG_CHECK_INTERVAL", 30)
+        ),
+        "model": COMPLETION_PARAMS["model"],
+        "output_mode": output_mode,
+    }
+    encoded = json.dumps(parts, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def get_cached_response(key):
+    """{"response", "visible", "recommendation"} guardado para a chave, ou None"""
+    _count("lookups")
+    cache = _get_memory_cache()
+    payload = cache.get(key)
+    if payload is not None:
+        _count("memory_hits")
+        return payload
+    if not _db_enabled():
+        return None
+
+    from app.models import ChatbotResponseCache
+
+    try:
+        row = db.session.get(ChatbotResponseCache, key)
+    except Exception as e:
+        db.session.rollback()
+        _count("db_errors")
+        current_app.logger.warning(f"Cache de respostas do chatbot indisponível: {e}")
+        return None
+    remaining = (row.expires_at - datetime.utcnow()).total_seconds() if row else 0
+    if remaining <= 0:
+        return None
+    cache.set(key, row.payload, ttl=min(remaining, cache.ttl))
+    _count("db_hits")
+    return row.payload
+
+
+def store_cached_response(key, user_id, payload):
+    """Guarda a resposta na memória e, se configurado, no banco"""
+    _count("stores")
+    cache = _get_memory_cache()
+    cache.set(key, payload)
+    if not _db_enabled():
+        return
+
+    from app.models import ChatbotResponseCache
+
+    now = datetime.utcnow()
+    try:
+        # Linhas vencidas saem a cada gravação (índice em expires_at)
+        ChatbotResponseCache.query.filter(
+            ChatbotResponseCache.expires_at < now
+        ).delete(synchronize_session=False)
+        db.session.merge(
+            ChatbotResponseCache(
+                key=key,
+                user_id=user_id,
+                payload=payload,
+                created_at=now,
+                expires_at=now + timedelta(seconds=cache.ttl),
+            )
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        _count("db_errors")
+        current_app.logger.warning(f"Cache de respostas do chatbot indisponível: {e}")
+
+
+def chatbot_cache_stats():
+    """Acertos do cache de respostas para /api/metrics"""
+    with _stats_lock:
+        stats = dict(_stats)
+    hits = stats["memory_hits"] + stats["db_hits"]
+    stats["hit_rate"] = round(hits / stats["lookups"], 3) if stats["lookups"] else 0.0
+    stats["enabled"] = bool(current_app.config.get("CHATBOT_RESPONSE_CACHE", False))
+    stats["db"] = bool(_db_enabled())
+    stats["memory"] = _get_memory_cache().stats()
+    return stats
@@ -0,0 +1,142 @@
+"""
+Seção "alimentos disponíveis" do prompt do chatbot.
+
+As linhas vêm em ordem de prioridade, e o orçamento de tokens do prompt
+(app/utils/prompt_budget.py) descarta as do fim quando falta espaço:
+
+1. alimentos relevantes para a mensagem e o diário (app/utils/food_retrieval.py);
+2. alimentos mais registrados pelo usuário;
+3. opções típicas de cada refeição (as refeições citadas na mensagem primeiro).
+
+As opções por refeição são iguais para todos os usuários: são buscadas uma
+vez por processo e descartadas quando o catálogo muda (importação de
+alimentos). As categorias de refeição já vêm calculadas na coluna
+``meal_categories`` (ver app/utils/meal_categories.py).
+"""
+import re
+
+from app.constants import MEAL_TYPES
+from app.utils.food_catalog import CatalogCache
+from app.utils.meal_categories import decode_meal_types, meal_types_for
+from app.utils.text import normalize_search_text
+
+FOODS_PER_CATEGORY = 15
+
+# Como cada refeição aparece escrita nas mensagens (texto normalizado)
+MEAL_MENTIONS = {
+    "cafe_da_manha": r"\bcafe da manha\b|\bcafe\b",
+    "lanche_manha": r"\blanche da manha\b",
+    "almoco": r"\balmoco\b",
+    "lanche_tarde": r"\blanche da tarde\b|\blanche\b",
+    "janta": r"\bjanta(r)?\b",
+    "ceia": r"\bceia\b",
+}
+
+SUMMARY_HEADER = "ALIMENTOS DISPONÍVEIS NA BASE DE DADOS (use APENAS estes alimentos nas recomendações):\n\n"
+SUMMARY_FOOTER = "\nIMPORTANTE: Se o usuário mencionar um alimento específico, SEMPRE verifique se ele está na lista acima (especialmente na seção 'ALIMENTOS MENCIONADOS'). Se estiver, use-o e confirme que está disponível. Se não estiver na lista mas o usuário insistir, informe que você pode recomendar alimentos similares que estão disponíveis na base de dados."
+
+
+def food_prompt_entry(food):
+    """Dados de um FoodData/UserFood usados no prompt"""
+    return {
+        "code": food.code,
+        "name": food.name,
+        "calories_per_100g": food.calories_100g,
+        "proteins_per_100g": food.proteins_100g,
+        "carbs_per_100g": food.carbs_100g,
+        "fats_per_100g": food.fats_100g,
+        # Linhas ainda sem a coluna preenchida são categorizadas na hora
+        "meal_categories": (
+            decode_meal_types(food.meal_categories)
+            if food.meal_categories is not None
+            else meal_types_for(food.name)
+        ),
+    }
+
+
+def format_food_line(food):
+    return (
+        f"  - {food['name']} (Código: {food['code']}, "
+        f"{food['calories_per_100g']:.0f} kcal/100g, "
+        f"{food['proteins_per_100g']:.1f}g prot, "
+        f"{food['carbs_per_100g']:.1f}g carb, "
+        f"{food['fats_per_100g']:.1f}g gord)\n"
+    )
+
+
+def mentioned_meal_types(message):
+    """Tipos de refeição citados na mensagem, na ordem de MEAL_TYPES"""
+    text = normalize_search_text(message)
+    return [
+        meal_type
+        for meal_type, pattern in MEAL_MENTIONS.items()
+        if re.search(pattern, text)
+    ]
+
+
+def _build_meal_staples():
+    """
+    Uma consulta por tipo de refeição sobre a coluna meal_categories.
+
+    No PostgreSQL o LIKE '%tipo%' usa o índice de trigramas; no SQLite é uma
+    varredura em ordem de id que para nos primeiros FOODS_PER_CATEGORY
+    alimentos encontrados. Roda uma vez por versão do catálogo (CatalogCache),
+    fora do caminho de cada prompt.
+    """
+    from app.models import FoodData
+
+    staples = {}
+    for meal_type in MEAL_TYPES:
+        foods = (
+            FoodData.query.filter(
+                FoodData.meal_categories.contains(meal_type, autoescape=True)
+            )
+            .order_by(FoodData.id)
+            .limit(FOODS_PER_CATEGORY)
+            .all()
+        )
+        staples[meal_type] = [food_prompt_entry(food) for food in foods]
+    return staples
+
+
+_staples = CatalogCache(_build_meal_staples)
+
+
+def get_meal_staples():
+    """Opções de FoodData por tipo de refeição, refeitas só quando o catálogo muda"""
+    return _staples.get()
+
+
+def food_context_items(relevant_foods, frequent_foods, meal_types=()):
+    """
+    Linhas da seção de alimentos disponíveis, da mais para a menos importante.
+
+    Cada alimento aparece uma única vez; o título de cada subseção vai junto
+    com a primeira linha dela, então cortar linhas do fim nunca deixa um
+    título sozinho. O cabeçalho e o rodapé da seção são SUMMARY_HEADER e
+    SUMMARY_FOOTER.
+    """
+    staples = get_meal_staples()
+    ordered_meals = list(meal_types) + [m for m in MEAL_TYPES if m not in meal_types]
+    sections = [
+        (
+            "⚠️ ALIMENTOS MENCIONADOS OU RELACIONADOS À PERGUNTA (PRIORIDADE - use estes se mencionados):\n",
+            relevant_foods,
+        ),
+        ("ALIMENTOS MAIS USADOS PELO USUÁRIO:\n", frequent_foods),
+    ] + [
+        (f"Opções para {MEAL_TYPES[meal_type]}:\n", staples.get(meal_type, []))
+        for meal_type in ordered_meals
+    ]
+
+    items = []
+    shown = set()
+    for title, foods in sections:
+        prefix = ("\n" if items else "") + title
+        for food in foods:
+            if food["code"] in shown:
+                continue
+            shown.add(food["code"])
+            items.append(prefix + format_food_line(food))
+            prefix = ""
+    return items
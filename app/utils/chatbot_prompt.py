@@ -0,0 +1,548 @@
+"""
+Montagem das mensagens enviadas ao modelo pelo chatbot (Nutri AI).
+
+Usado pelas rotas /api/chatbot e /api/chatbot/stream: perfil e metas do
+usuário, consumo do dia, alimentos disponíveis e regras de resposta.
+"""
+import re
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from flask_login import current_user
+
+from app.constants import MACRO_TYPES, MEAL_TYPES
+from app.utils.chatbot_catalog import (
+    SUMMARY_FOOTER,
+    SUMMARY_HEADER,
+    food_context_items,
+    mentioned_meal_types,
+)
+from app.utils.food_retrieval import lookup_foods, retrieve_foods
+from app.utils.food_search import get_user_food_usage
+from app.utils.prompt_budget import REQUIRED, PromptBudget
+
+# Prioridade das seções no orçamento de tokens (maior = cortada primeiro)
+PROFILE_PRIORITY = 1
+DIARY_PRIORITY = 2
+FOODS_PRIORITY = 3
+SUMMARY_PRIORITY = 4
+HISTORY_PRIORITY = 5
+
+# Como a recomendação volta do modelo (ver build_chatbot_messages)
+OUTPUT_MODES = ("structured", "text")
+
+# Parâmetros da chamada ao modelo
+COMPLETION_PARAMS = {
+    "model": "gpt-4o-mini",  # Modelo mais econômico e rápido
+    "temperature": 0.7,
+    "max_tokens": 2000,  # Aumentado para evitar que JSON seja cortado
+}
+
+_FOOD_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "code": {"type": "string"},
+        "name": {"type": "string"},
+        "quantity": {"type": "number", "description": "Quantidade em gramas"},
+        **{macro: {"type": "number"} for macro in MACRO_TYPES},
+    },
+    "required": ["code", "name", "quantity", *MACRO_TYPES],
+    "additionalProperties": False,
+}
+
+# Formato "structured": o modelo responde um JSON validado contra este schema
+# ("reply" vem primeiro, o que permite repassar o texto durante o streaming)
+RECOMMENDATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "reply": {"type": "string"},
+        "meals": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "meal_type": {"type": "string", "enum": list(MEAL_TYPES)},
+                    "foods": {"type": "array", "items": _FOOD_SCHEMA},
+                },
+                "required": ["meal_type", "foods"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["reply", "meals"],
+    "additionalProperties": False,
+}
+
+# Regras de escolha de alimentos por refeição (comuns aos dois formatos de resposta)
+MEAL_RULES_PROMPT = """REGRAS CRÍTICAS SOBRE ALIMENTOS E REFEIÇÕES BRASILEIRAS:
+
+1. USE APENAS ALIMENTOS DA BASE DE DADOS:
+   - Você DEVE usar APENAS os alimentos listados acima
+   - Se o usuário mencionar um alimento específico, verifique PRIMEIRO se ele está na lista (especialmente na seção "ALIMENTOS MENCIONADOS")
+   - Se o alimento mencionado estiver na lista, SEMPRE use-o e confirme que ele está disponível
+   - Se o alimento mencionado NÃO estiver na lista, informe educadamente que não está disponível na base de dados e sugira alternativas similares que existam
+   - Sempre mencione o CÓDIGO do alimento ao recomendar (ex: "Arroz branco (código: ARR001)")
+   - NUNCA diga que um alimento não está disponível se ele aparecer na lista acima
+
+2. LÓGICA DE REFEIÇÕES BRASILEIRAS (MUITO IMPORTANTE):
+   - CAFÉ DA MANHÃ: Use apenas alimentos típicos de café da manhã brasileiro:
+     * Pães, torradas, bolachas, cereais, aveia, granola
+     * Leite, iogurte, queijos, requeijão, manteiga
+     * Ovos (omelete, mexidos, cozidos)
+     * Frutas, sucos, café, chá
+     * Tapioca, crepioca, panqueca
+     * NUNCA recomende: feijão, arroz, macarrão, carnes principais, pratos quentes pesados
+   
+   - ALMOÇO: Use alimentos típicos de almoço brasileiro:
+     * Arroz, feijão, batata, batata doce, mandioca
+     * Carnes (frango, carne bovina, peixe)
+     * Saladas e legumes
+     * Macarrão, lasanha (ocasionalmente)
+     * NUNCA recomende: alimentos típicos de café da manhã como pão com manteiga, cereais
+   
+   - JANTAR: Similar ao almoço, mas pode ser mais leve:
+     * Pode incluir os mesmos alimentos do almoço
+     * Pode ser mais leve (sopas, saladas maiores)
+     * NUNCA recomende: alimentos típicos de café da manhã
+   
+   - LANCHE DA MANHÃ/TARDE: Alimentos leves e práticos:
+     * Frutas, iogurte, queijo
+     * Bolachas, biscoitos, barras de cereal
+     * Castanhas, nozes, amendoim
+     * Sucos, vitaminas
+     * NUNCA recomende: pratos principais como arroz e feijão
+   
+   - CEIA: Alimentos muito leves:
+     * Chá, leite morno
+     * Frutas leves, iogurte
+     * Bolachas leves
+     * NUNCA recomende: pratos pesados ou alimentos típicos de almoço
+
+3. EXEMPLOS DO QUE NÃO FAZER (ERRADO):
+   - ❌ Recomendar feijão no café da manhã
+   - ❌ Recomendar pão com manteiga no almoço
+   - ❌ Recomendar arroz e feijão no lanche
+   - ❌ Recomendar alimentos que não estão na base de dados
+
+4. EXEMPLOS DO QUE FAZER (CORRETO):
+   - ✅ Café da manhã: Pão integral, queijo, ovo, fruta
+   - ✅ Almoço: Arroz, feijão, frango grelhado, salada
+   - ✅ Lanche: Banana, iogurte, castanhas
+   - ✅ Jantar: Peixe grelhado, batata doce, legumes
+   - ✅ Ceia: Chá, fruta leve
+
+"""
+
+# Formato "text": recomendação em um bloco ```json no meio do texto
+JSON_BLOCK_FORMAT_PROMPT = """FORMATO DE RESPOSTA PARA RECOMENDAÇÕES (OBRIGATÓRIO):
+IMPORTANTE: Quando o usuário pedir uma recomendação de dieta, alimentos, ou qualquer sugestão nutricional concreta, você DEVE SEMPRE incluir no final da sua resposta um bloco JSON estruturado com as seguintes informações. SEM EXCEÇÕES.
+
+```json
+{
+  "recommendation": true,
+  "meals": [
+    {
+      "meal_type": "cafe_da_manha",
+      "foods": [
+        {
+          "code": "CODIGO_DO_ALIMENTO",
+          "name": "Nome do Alimento",
+          "quantity": 100,
+          "calories": 200,
+          "proteins": 10,
+          "carbs": 30,
+          "fats": 5
+        }
+      ]
+    }
+  ]
+}
+```
+
+TIPOS DE REFEIÇÃO VÁLIDOS:
+- "cafe_da_manha" - Café da Manhã
+- "lanche_manha" - Lanche da Manhã
+- "almoco" - Almoço
+- "lanche_tarde" - Lanche da Tarde
+- "janta" - Jantar
+- "ceia" - Ceia
+
+REGRAS CRÍTICAS SOBRE O JSON DE RECOMENDAÇÃO:
+- Use APENAS os códigos de alimentos que estão na lista acima
+- Calcule as quantidades baseadas nos valores por 100g fornecidos
+- SEMPRE inclua o JSON quando o usuário pedir uma recomendação de dieta, alimentos, ou sugestões nutricionais
+- O JSON é OBRIGATÓRIO quando você fornecer uma recomendação concreta de alimentos
+- O JSON deve estar no final da resposta, após o texto explicativo
+- O JSON deve estar dentro de um bloco de código markdown: ```json ... ```
+- Após fornecer a recomendação no texto, SEMPRE inclua o JSON e então pergunte: "Gostaria que eu adicione esta recomendação ao seu diário de hoje?"
+- Exemplo de estrutura de resposta:
+  1. Texto explicativo da recomendação
+  2. Bloco JSON com os alimentos
+  3. Pergunta se deseja adicionar ao diário
+
+"""
+
+# Formato "structured": texto e refeições em campos separados (RECOMMENDATION_SCHEMA)
+STRUCTURED_FORMAT_PROMPT = """FORMATO DE RESPOSTA (JSON ESTRUTURADO):
+Sua resposta é um objeto JSON com dois campos:
+- "reply": o texto para o usuário (sem blocos de código e sem JSON)
+- "meals": as refeições recomendadas, com os alimentos e as quantidades em gramas
+
+REGRAS SOBRE "meals":
+- Preencha "meals" SEMPRE que fornecer uma recomendação concreta de alimentos; caso contrário, deixe a lista vazia
+- Use APENAS os códigos de alimentos que estão na lista acima
+- Calcule as quantidades e os macros baseados nos valores por 100g fornecidos
+- Quando preencher "meals", termine o "reply" perguntando: "Gostaria que eu adicione esta recomendação ao seu diário de hoje?"
+
+"""
+
+GUIDELINES_PROMPT = """DIRETRIZES GERAIS:
+1. Sempre forneça respostas em português brasileiro
+2. Seja profissional, mas amigável e encorajador
+3. Use as informações do perfil do usuário para personalizar suas recomendações
+4. Quando recomendar dietas, considere as metas nutricionais do usuário E o que já foi consumido no dia
+5. Se o usuário já consumiu alimentos, considere o que falta para atingir as metas ao fazer recomendações
+6. Seja específico com quantidades e porções quando possível
+7. Sempre mencione o CÓDIGO do alimento ao recomendar
+8. Se não tiver certeza sobre algo, seja honesto e recomende consultar um nutricionista
+9. Mantenha as respostas concisas mas informativas
+10. Use emojis moderadamente para tornar a conversa mais amigável
+11. SEMPRE considere o consumo atual do dia ao fazer recomendações nutricionais
+12. RESPEITE A LÓGICA BRASILEIRA DE REFEIÇÕES - não recomende alimentos inadequados para cada horário"""
+
+# Reforço enviado antes da mensagem quando o usuário pede uma recomendação
+RECOMMENDATION_REMINDERS = {
+    "text": "IMPORTANTE: O usuário está pedindo uma recomendação. Você DEVE incluir um bloco JSON com os alimentos recomendados no formato especificado. O JSON é OBRIGATÓRIO.",
+    "structured": 'IMPORTANTE: O usuário está pedindo uma recomendação. Preencha "meals" com os alimentos recomendados.',
+}
+
+
+def completion_params(output_mode):
+    """Argumentos de chat.completions.create para o modo de resposta"""
+    if output_mode != "structured":
+        return COMPLETION_PARAMS
+    return {
+        **COMPLETION_PARAMS,
+        "response_format": {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "nutri_ai_reply",
+                "strict": True,
+                "schema": RECOMMENDATION_SCHEMA,
+            },
+        },
+    }
+
+
+def resolve_target_date(user_message, requested_date=None):
+    """
+    Dia do diário usado na conversa: a data pedida (YYYY-MM-DD), a citada na
+    mensagem ("hoje", "ontem", "15/01/2024") ou hoje.
+    """
+    target_date = date.today()
+    if requested_date:
+        try:
+            target_date = datetime.strptime(requested_date, "%Y-%m-%d").date()
+        except ValueError:
+            pass
+    else:
+        # Tenta extrair data da mensagem (formato: "hoje", "ontem", "15/01/2024", etc)
+        user_msg_lower = user_message.lower()
+
+        # Verifica se menciona "hoje", "atual", "deste dia"
+        if re.search(r"hoje|atual|deste dia", user_msg_lower):
+            target_date = date.today()
+        # Verifica se menciona "ontem"
+        elif re.search(r"ontem", user_msg_lower):
+            target_date = date.today() - timedelta(days=1)
+        # Tenta extrair data no formato DD/MM/YYYY
+        else:
+            date_match = re.search(r"(\d{1,2})/(\d{1,2})/(\d{4})", user_message)
+            if date_match:
+                try:
+                    day = int(date_match.group(1))
+                    month = int(date_match.group(2))
+                    year = int(date_match.group(3))
+                    target_date = date(year, month, day)
+                except (ValueError, AttributeError):
+                    pass
+    return target_date
+
+
+def build_chatbot_messages(
+    user_message,
+    conversation_history,
+    requested_date=None,
+    output_mode="text",
+    summary=None,
+):
+    """
+    Mensagens (system + histórico + usuário) para a conversa do usuário atual.
+
+    ``output_mode`` escolhe como a recomendação volta: "text" (bloco ```json
+    dentro do texto) ou "structured" (campos "reply" e "meals" separados).
+    ``summary`` é o resumo das mensagens antigas de uma conversa guardada no
+    servidor (app/utils/chat_conversations.py).
+    """
+    target_date = resolve_target_date(user_message, requested_date)
+
+    # Buscar dieta do dia
+    from app.models import Diet
+
+    daily_diet = Diet.query.filter_by(user_id=current_user.id, date=target_date).first()
+
+    # Alimentos disponíveis: só os relevantes para a mensagem e para o que já
+    # está no diário (BM25 em app/utils/food_retrieval.py), depois os mais
+    # usados pelo usuário e opções por refeição; o orçamento corta o excesso
+    config = current_app.config
+    diary_codes = [
+        food.get("food_code")
+        for foods in ((daily_diet.meals_data or {}).values() if daily_diet else [])
+        for food in foods or []
+        if isinstance(food, dict) and food.get("food_code")
+    ]
+    diary_names = [food["name"] for food in lookup_foods(diary_codes, current_user.id)]
+    relevant_foods = retrieve_foods(
+        user_message,
+        current_user.id,
+        diary_names,
+        limit=config.get("CHATBOT_RETRIEVED_FOODS", 25),
+    )
+    frequent_codes = [
+        code
+        for code, _ in get_user_food_usage(current_user.id).most_common(
+            config.get("CHATBOT_FREQUENT_FOODS", 10)
+        )
+    ]
+    food_items = food_context_items(
+        relevant_foods,
+        lookup_foods(frequent_codes, current_user.id),
+        meal_types=mentioned_meal_types(user_message),
+    )
+
+    # Calcular totais do que já foi consumido
+    daily_totals = {"calories": 0, "proteins": 0, "carbs": 0, "fats": 0}
+    meals_summary = []
+    meals_detail = {}
+
+    if daily_diet and daily_diet.meals_data:
+        for meal_type, foods in daily_diet.meals_data.items():
+            meal_name = MEAL_TYPES.get(meal_type, meal_type)
+            meal_totals = {"calories": 0, "proteins": 0, "carbs": 0, "fats": 0}
+            meal_foods = []
+
+            for food in foods:
+                calories = float(food.get("calories", 0))
+                proteins = float(food.get("proteins", 0))
+                carbs = float(food.get("carbs", 0))
+                fats = float(food.get("fats", 0))
+
+                daily_totals["calories"] += calories
+                daily_totals["proteins"] += proteins
+                daily_totals["carbs"] += carbs
+                daily_totals["fats"] += fats
+
+                meal_totals["calories"] += calories
+                meal_totals["proteins"] += proteins
+                meal_totals["carbs"] += carbs
+                meal_totals["fats"] += fats
+
+                food_code = food.get("food_code", "Desconhecido")
+                quantity = food.get("quantity", 0)
+                meal_foods.append(f"{food_code} ({quantity}g)")
+
+            if meal_totals["calories"] > 0:
+                meals_summary.append(
+                    f"{meal_name}: {meal_totals['calories']:.0f} kcal, "
+                    f"{meal_totals['proteins']:.1f}g proteínas, "
+                    f"{meal_totals['carbs']:.1f}g carboidratos, "
+                    f"{meal_totals['fats']:.1f}g gorduras"
+                )
+                meals_detail[meal_name] = {"foods": meal_foods, "totals": meal_totals}
+
+    # Use dados do usuário
+    user = current_user
+    user_profile = {
+        "nome": user.nome,
+        "idade": user.idade,
+        "peso": user.peso,
+        "altura": user.altura,
+        "sexo": user.get_sexo_display(),
+        "objetivo": user.get_objetivo_display(),
+        "atividade": user.get_fator_atividade_display(),
+        "calories_goal": user.calories_goal or 0,
+        "proteins_goal": user.proteins_goal or 0,
+        "carbs_goal": user.carbs_goal or 0,
+        "fats_goal": user.fats_goal or 0,
+    }
+
+    # Calcular IMC
+    imc = user.peso / (user.altura**2) if user.altura > 0 else 0
+
+    # Calcular percentuais consumidos
+    calories_percent = (
+        (daily_totals["calories"] / user_profile["calories_goal"] * 100)
+        if user_profile["calories_goal"] > 0
+        else 0
+    )
+    proteins_percent = (
+        (daily_totals["proteins"] / user_profile["proteins_goal"] * 100)
+        if user_profile["proteins_goal"] > 0
+        else 0
+    )
+    carbs_percent = (
+        (daily_totals["carbs"] / user_profile["carbs_goal"] * 100)
+        if user_profile["carbs_goal"] > 0
+        else 0
+    )
+    fats_percent = (
+        (daily_totals["fats"] / user_profile["fats_goal"] * 100)
+        if user_profile["fats_goal"] > 0
+        else 0
+    )
+
+    # Formatar data para exibição
+    date_str = target_date.strftime("%d/%m/%Y")
+    if target_date == date.today():
+        date_str = "hoje"
+
+    # Construir resumo do consumo do dia
+    consumption_summary = ""
+    meal_lines = []  # Uma linha por refeição; podem sair se faltar espaço
+    if daily_totals["calories"] > 0:
+        consumption_summary = f"""
+CONSUMO DO DIA ({date_str}):
+- Total consumido:
+  * Calorias: {daily_totals["calories"]:.0f} kcal ({calories_percent:.1f}% da meta de {user_profile["calories_goal"]:.0f} kcal)
+  * Proteínas: {daily_totals["proteins"]:.1f} g ({proteins_percent:.1f}% da meta de {user_profile["proteins_goal"]:.0f} g)
+  * Carboidratos: {daily_totals["carbs"]:.1f} g ({carbs_percent:.1f}% da meta de {user_profile["carbs_goal"]:.0f} g)
+  * Gorduras: {daily_totals["fats"]:.1f} g ({fats_percent:.1f}% da meta de {user_profile["fats_goal"]:.0f} g)
+
+- Restante para atingir as metas:
+  * Calorias: {max(0, user_profile["calories_goal"] - daily_totals["calories"]):.0f} kcal
+  * Proteínas: {max(0, user_profile["proteins_goal"] - daily_totals["proteins"]):.1f} g
+  * Carboidratos: {max(0, user_profile["carbs_goal"] - daily_totals["carbs"]):.1f} g
+  * Gorduras: {max(0, user_profile["fats_goal"] - daily_totals["fats"]):.1f} g
+
+- Refeições consumidas:
+"""
+        meal_lines = [f"  * {meal}\n" for meal in meals_summary]
+    else:
+        consumption_summary = f"\nCONSUMO DO DIA ({date_str}):\nNenhum alimento registrado ainda para este dia."
+
+    # Sistema de prompt para o assistente nutricional
+    # Quebrar em partes para evitar f-string aninhada demais
+    altura_cm = user_profile["altura"] * 100
+
+    profile_parts = [
+        'Você é um assistente nutricional especializado chamado "Nutri AI". Seu papel é fornecer orientações nutricionais personalizadas, recomendar dietas e responder perguntas sobre nutrição.\n\n',
+        "INFORMAÇÕES DO USUÁRIO:\n",
+        f"- Nome: {user_profile['nome']}\n",
+        f"- Idade: {user_profile['idade']} anos\n",
+        f"- Peso: {user_profile['peso']} kg\n",
+        f"- Altura: {user_profile['altura']} m ({altura_cm:.0f} cm)\n",
+        f"- IMC: {imc:.1f}\n",
+        f"- Sexo: {user_profile['sexo']}\n",
+        f"- Objetivo: {user_profile['objetivo']}\n",
+        f"- Nível de atividade: {user_profile['atividade']}\n",
+        "- Metas nutricionais diárias:\n",
+        f"  * Calorias: {user_profile['calories_goal']:.0f} kcal\n",
+        f"  * Proteínas: {user_profile['proteins_goal']:.0f} g\n",
+        f"  * Carboidratos: {user_profile['carbs_goal']:.0f} g\n",
+        f"  * Gorduras: {user_profile['fats_goal']:.0f} g\n",
+    ]
+
+    if output_mode == "structured":
+        format_prompt = STRUCTURED_FORMAT_PROMPT
+    else:
+        format_prompt = JSON_BLOCK_FORMAT_PROMPT
+
+    # Histórico de conversa: entra do mais recente para o mais antigo até o
+    # limite do orçamento (em vez de um número fixo de mensagens)
+    history = [
+        {"role": msg.get("role", "user"), "content": msg.get("content", "")}
+        for msg in conversation_history
+    ]
+
+    # Se o usuário estiver pedindo uma recomendação de dieta, adicionar instrução extra
+    user_message_lower = user_message.lower()
+    current_messages = []
+    if any(
+        keyword in user_message_lower
+        for keyword in [
+            "recomende",
+            "recomendação",
+            "dieta",
+            "dietas",
+            "sugira",
+            "sugestão",
+            "me dê",
+            "me dê uma",
+            "quero",
+            "preciso",
+            "pode me ajudar com",
+        ]
+    ):
+        # Adicionar uma mensagem do sistema antes da mensagem do usuário para reforçar
+        current_messages.append(
+            {
+                "role": "system",
+                "content": RECOMMENDATION_REMINDERS[output_mode],
+            }
+        )
+    current_messages.append({"role": "user", "content": user_message})
+
+    # Orçamento de tokens (app/utils/prompt_budget.py): as seções de menor
+    # prioridade perdem itens primeiro quando o total passa do limite
+    budget = PromptBudget(config.get("CHATBOT_PROMPT_TOKENS", 6000))
+    budget.add("rules", [MEAL_RULES_PROMPT, format_prompt, GUIDELINES_PROMPT], REQUIRED)
+    budget.add("message", current_messages, REQUIRED)
+    budget.add("profile", profile_parts, PROFILE_PRIORITY, keep=len(profile_parts))
+    budget.add("diary", [consumption_summary] + meal_lines, DIARY_PRIORITY, keep=1)
+    budget.add(
+        "foods",
+        food_items,
+        FOODS_PRIORITY,
+        header=SUMMARY_HEADER,
+        footer=SUMMARY_FOOTER,
+        max_tokens=config.get("CHATBOT_FOOD_CONTEXT_TOKENS", 1500),
+    )
+    if summary:
+        budget.add(
+            "summary",
+            [
+                {
+                    "role": "system",
+                    "content": f"RESUMO DA CONVERSA ATÉ AQUI (mensagens anteriores):\n{summary}",
+                }
+            ],
+            SUMMARY_PRIORITY,
+        )
+    budget.add(
+        "history",
+        history,
+        HISTORY_PRIORITY,
+        trim_from="start",
+        max_tokens=config.get("CHATBOT_HISTORY_TOKENS", 2000),
+    )
+    budget.fit()
+    budget.log()
+
+    system_prompt = "".join(
+        [
+            budget["profile"].text(),
+            budget["diary"].text(),
+            "\n",
+            budget["foods"].text(),
+            "\n\n\n",
+            budget["rules"].text(),
+        ]
+    )
+
+    messages = [{"role": "system", "content": system_prompt}]
+    if summary:
+        messages.extend(budget["summary"].items)
+    messages.extend(budget["history"].items)
+    messages.extend(current_messages)
+
+    return messages
@@ -0,0 +1,263 @@
+"""
+Leitura da resposta do chatbot: extração do JSON de recomendação e
+separação incremental do texto visível quando a resposta chega em partes
+(Server-Sent Events em /api/chatbot/stream).
+
+Dois formatos de resposta (ver app/utils/chatbot_prompt.py):
+
+- "text": a recomendação vem em um bloco ```json no meio do texto;
+- "structured": o modelo devolve {"reply": ..., "meals": [...]} seguindo um
+  JSON schema, e o texto e as refeições já chegam separados.
+"""
+import json
+import threading
+
+from app.utils.recommendation_extractor import (
+    RecommendationExtractor,
+    validate_recommendation,
+)
+
+
+def _log_recommendation(recommendation_data, assistant_message):
+    # Log para debug
+    if recommendation_data:
+        print("✅ JSON de recomendação parseado com sucesso!")
+        print(f"   Refeições: {len(recommendation_data.get('meals', []))}")
+        for meal in recommendation_data.get("meals", []):
+            print(
+                f"   - {meal.get('meal_type')}: {len(meal.get('foods', []))} alimento(s)"
+            )
+    else:
+        print("⚠️ Nenhum JSON de recomendação encontrado na resposta")
+        print(f"   Últimos 200 caracteres da resposta: {assistant_message[-200:]}")
+
+
+JSON_FENCE_OPEN = "```json"
+JSON_FENCE_CLOSE = "```"
+
+
+def _partial_fence(text, fence):
+    """Tamanho do maior prefixo de ``fence`` no final de ``text``"""
+    for size in range(min(len(fence) - 1, len(text)), 0, -1):
+        if text.endswith(fence[:size]):
+            return size
+    return 0
+
+
+class RecommendationStreamParser:
+    """
+    Separa, à medida que os tokens chegam, o texto visível do bloco ```json.
+
+    ``feed`` devolve só o texto que pode ser mostrado (o bloco JSON nunca vai
+    para a tela). Todo o texto passa também pelo extrator de recomendação, que
+    lê cada parte uma única vez; ``close`` devolve o que restou e deixa o
+    resultado em ``recommendation``.
+    """
+
+    def __init__(self):
+        self.recommendation = None
+        self.parse_failed = False
+        self._extractor = RecommendationExtractor()
+        self._parts = []  # Resposta completa, com o bloco JSON
+        self._pending = ""  # Texto retido: pode ser o começo de uma cerca
+        self._in_block = False
+
+    @property
+    def response(self):
+        return "".join(self._parts)
+
+    def feed(self, delta):
+        self._parts.append(delta)
+        self._extractor.feed(delta)
+        buffer = self._pending + delta
+        visible = []
+        while buffer:
+            fence = JSON_FENCE_CLOSE if self._in_block else JSON_FENCE_OPEN
+            index = buffer.find(fence)
+            if index == -1:
+                keep = _partial_fence(buffer, fence)
+                if not self._in_block:
+                    visible.append(buffer[: len(buffer) - keep])
+                buffer = buffer[len(buffer) - keep :]
+                break
+            if not self._in_block:
+                visible.append(buffer[:index])
+            buffer = buffer[index + len(fence) :]
+            self._in_block = not self._in_block
+        self._pending = buffer
+        return "".join(visible)
+
+    def close(self):
+        """Texto visível restante; preenche ``recommendation`` com o resultado final"""
+        visible = "" if self._in_block else self._pending
+        self._pending = ""
+        self.recommendation = self._extractor.finish()
+        # Falha = o modelo tentou mandar uma recomendação que não foi aproveitada
+        self.parse_failed = (
+            self.recommendation is None and '"recommendation"' in self.response
+        )
+        _log_recommendation(self.recommendation, self.response)
+        return visible
+
+
+def _string_end(raw, start):
+    """
+    (posição, fechou) até onde ``raw`` pode ser decodificado sem cortar um
+    escape ao meio; ``fechou`` indica que a aspa final da string foi achada.
+    """
+    i = start
+    while i < len(raw):
+        char = raw[i]
+        if char == '"':
+            return i, True
+        if char != "\\":
+            i += 1
+            continue
+        if i + 1 >= len(raw):
+            return i, False
+        if raw[i + 1] != "u":
+            i += 2
+            continue
+        if i + 6 > len(raw):
+            return i, False
+        # Par substituto (ex.: emojis como \ud83d\ude00) é decodificado junto
+        if 0xD800 <= int(raw[i + 2 : i + 6], 16) <= 0xDBFF:
+            if i + 12 > len(raw):
+                return i, False
+            i += 12
+        else:
+            i += 6
+    return i, False
+
+
+class StructuredReplyStream:
+    """
+    Equivalente de ``RecommendationStreamParser`` para o formato "structured".
+
+    O modelo gera {"reply": "...", "meals": [...]}; ``feed`` decodifica a
+    string de "reply" conforme ela chega e devolve o texto novo. As refeições
+    são lidas em ``close``, com o JSON completo.
+    """
+
+    def __init__(self):
+        self.recommendation = None
+        self.parse_failed = False
+        self._parts = []
+        self._raw = ""  # Conteúdo de "reply" ainda com escapes JSON
+        self._decoded = 0  # Quanto de _raw já foi decodificado
+        self._reply = []
+        self._state = "before"  # before -> reply -> after
+
+    @property
+    def response(self):
+        return "".join(self._reply)
+
+    def feed(self, delta):
+        self._parts.append(delta)
+        if self._state == "after":
+            return ""
+        if self._state == "before":
+            content = "".join(self._parts)
+            marker = content.find('"reply"')
+            if marker == -1:
+                return ""
+            colon = content.find(":", marker + len('"reply"'))
+            quote = content.find('"', colon + 1) if colon != -1 else -1
+            if quote == -1:
+                return ""
+            self._state = "reply"
+            delta = content[quote + 1 :]
+
+        self._raw += delta
+        try:
+            end, closed = _string_end(self._raw, self._decoded)
+            text = json.loads('"' + self._raw[self._decoded : end] + '"')
+        except ValueError:
+            # Escape malformado vindo do modelo (ex.: \uZZZZ): o JSON não vai
+            # fechar; o resto do stream é ignorado e close() registra a falha
+            self.parse_failed = True
+            self._state = "after"
+            return ""
+        self._decoded = end
+        if closed:
+            self._state = "after"
+        self._reply.append(text)
+        return text
+
+    def close(self):
+        """Texto restante (se "reply" não veio primeiro) e a recomendação final"""
+        content = "".join(self._parts)
+        try:
+            data = json.loads(content)
+        except json.JSONDecodeError:
+            self.parse_failed = True
+            return ""
+        if not isinstance(data, dict):
+            self.parse_failed = True
+            return ""
+        visible = ""
+        if self._state == "before" and isinstance(data.get("reply"), str):
+            visible = data["reply"]
+            self._reply.append(visible)
+        if data.get("meals"):
+            self.recommendation = validate_recommendation(
+                {"recommendation": True, "meals": data["meals"]}
+            )
+        _log_recommendation(self.recommendation, self.response)
+        return visible
+
+
+def reply_parser(output_mode):
+    """Leitor incremental da resposta para o modo ("structured" ou "text")"""
+    if output_mode == "structured":
+        return StructuredReplyStream()
+    return RecommendationStreamParser()
+
+
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def record_chatbot_call(output_mode, latency, output_tokens=None, parse_failed=False):
+    """Contabiliza uma resposta do modelo para /api/metrics"""
+    with _stats_lock:
+        stats = _stats.setdefault(
+            output_mode,
+            {
+                "requests": 0,
+                "parse_failures": 0,
+                "latency_total": 0.0,
+                "output_tokens": 0,
+                "responses_with_usage": 0,
+            },
+        )
+        stats["requests"] += 1
+        stats["parse_failures"] += int(bool(parse_failed))
+        stats["latency_total"] += latency
+        if output_tokens is not None:
+            stats["output_tokens"] += output_tokens
+            stats["responses_with_usage"] += 1
+
+
+def chatbot_stats():
+    with _stats_lock:
+        return {
+            output_mode: {
+                "requests": stats["requests"],
+                "parse_failure_rate": stats["parse_failures"] / stats["requests"],
+                "mean_latency_ms": round(
+                    stats["latency_total"] * 1000 / stats["requests"], 1
+                ),
+                "mean_output_tokens": (
+                    round(stats["output_tokens"] / stats["responses_with_usage"], 1)
+                    if stats["responses_with_usage"]
+                    else None
+                ),
+            }
+            for output_mode, stats in _stats.items()
+        }
+
+
+def sse_event(event, data):
+    """Mensagem no formato Server-Sent Events com ``data`` em JSON"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
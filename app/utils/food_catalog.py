@@ -0,0 +1,160 @@
+"""
+Controle de versão do catálogo global de alimentos (tabela food_data).
+
+Estruturas em memória montadas a partir de FoodData (índice de busca, caches)
+se registram com ``on_catalog_change`` e são descartadas quando o catálogo
+muda. A mudança é detectada de duas formas:
+
+- chamada explícita a ``notify_catalog_changed`` (ex.: script de importação);
+- verificação periódica da assinatura da tabela (contagem, ids e somas do
+  conteúdo), que cobre importações feitas por outro processo enquanto os
+  workers do gunicorn continuam rodando.
+
+``CatalogCache`` junta as duas coisas para um valor montado a partir do
+catálogo (índice, lista de alimentos): é refeito no primeiro acesso depois
+de uma mudança.
+"""
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import func
+
+from app import db
+
+_listeners = []
+_lock = threading.Lock()
+_state = {"version": 0, "signature": None, "checked_at": None}
+
+
+def on_catalog_change(callback):
+    """Registra uma função chamada sempre que o catálogo global mudar."""
+    _listeners.append(callback)
+    return callback
+
+
+def catalog_signature():
+    """
+    Assinatura barata da tabela food_data, calculada numa única agregação.
+
+    Contagem e maior id não bastam: uma reimportação com ``clear_existing``
+    no SQLite reaproveita os ids. As somas de ids, macros e tamanhos de
+    código/nome mudam com o conteúdo, inclusive em edições de uma linha.
+    """
+    from app.models import FoodData
+
+    row = db.session.query(
+        func.count(FoodData.id),
+        func.max(FoodData.id),
+        func.sum(FoodData.id),
+        func.sum(
+            FoodData.quantity
+            + FoodData.calories
+            + FoodData.proteins
+            + FoodData.carbs
+            + FoodData.fats
+        ),
+        func.sum(func.length(FoodData.code) + func.length(FoodData.name)),
+    ).one()
+    # Somas de float arredondadas: a ordem da soma pode variar entre consultas
+    return tuple(
+        round(value, 3) if isinstance(value, float) else value for value in row
+    )
+
+
+def catalog_version():
+    """Versão atual do catálogo em memória (incrementa a cada mudança)"""
+    return _state["version"]
+
+
+def notify_catalog_changed():
+    """Invalida tudo que foi construído a partir do catálogo global."""
+    with _lock:
+        _state["version"] += 1
+        _state["signature"] = None
+        _state["checked_at"] = None
+    for callback in list(_listeners):
+        callback()
+
+
+def check_catalog(interval=30):
+    """
+    Confere se a tabela food_data mudou desde a última verificação.
+
+    A consulta de assinatura roda no máximo uma vez a cada ``interval``
+    segundos por processo. Retorna a versão atual do catálogo.
+    """
+    now = time.monotonic()
+    checked_at = _state["checked_at"]
+    if checked_at is not None and now - checked_at < interval:
+        return _state["version"]
+
+    changed = False
+    with _lock:
+        checked_at = _state["checked_at"]
+        if checked_at is None or now - checked_at >= interval:
+            signature = catalog_signature()
+            previous = _state["signature"]
+            if previous is not None and signature != previous:
+                _state["version"] += 1
+                changed = True
+            _state["signature"] = signature
+            _state["checked_at"] = now
+
+    if changed:
+        for callback in list(_listeners):
+            callback()
+    return _state["version"]
+
+
+def catalog_fingerprint(interval=30):
+    """
+    Assinatura atual do catálogo, igual em todos os processos.
+
+    ``catalog_version`` é um contador local de cada worker; chaves de cache
+    compartilhadas (ex.: no banco) usam a assinatura.
+    """
+    check_catalog(interval)
+    return _state["signature"]
+
+
+class CatalogCache:
+    """
+    Valor montado por ``build()`` a partir do catálogo global, refeito no
+    primeiro ``get()`` depois que o catálogo muda (uma thread monta, as outras
+    esperam pelo mesmo resultado).
+    """
+
+    def __init__(self, build):
+        self._build = build
+        self._value = None
+        self._version = None
+        self._lock = threading.Lock()
+        on_catalog_change(self.invalidate)
+
+    def invalidate(self):
+        self._value = None
+
+    def _stale(self, value):
+        return value is None or self._version != catalog_version()
+
+    def _rebuild(self):
+        version = catalog_version()
+        value = self._build()
+        self._value, self._version = value, version
+        return value
+
+    def rebuild(self):
+        """Monta de novo agora, mesmo sem mudança no catálogo"""
+        with self._lock:
+            return self._rebuild()
+
+    def get(self):
+        check_catalog(current_app.config.get("FOOD_CATALOG_CHECK_INTERVAL", 30))
+        value = self._value
+        if self._stale(value):
+            with self._lock:
+                value = self._value
+                if self._stale(value):
+                    value = self._rebuild()
+        return value
@@ -0,0 +1,129 @@
+"""
+Resolução de códigos de alimentos para valores nutricionais.
+
+Todo lugar que precisa dos macros de um alimento segue a mesma regra: procura
+primeiro nos alimentos personalizados do usuário (UserFood) e, se não achar,
+no catálogo global (FoodData). Este módulo centraliza essa regra e resolve
+vários códigos de uma vez:
+
+- memoização por requisição (``flask.g``), para rotas que consultam o mesmo
+  código mais de uma vez;
+- LRU em processo das linhas de FoodData, descartado quando o catálogo muda;
+- no máximo uma consulta IN para UserFood e uma para FoodData por chamada.
+"""
+from collections import namedtuple
+
+from flask import current_app, g, has_app_context
+
+from app.utils.cache import config_cache
+from app.utils.food_catalog import check_catalog, on_catalog_change
+
+MACROS = ("calories", "proteins", "carbs", "fats")
+
+_MISSING = object()
+
+
+class ResolvedFood(
+    namedtuple("ResolvedFood", ["id", "code", "name", "quantity", "per_100g", "source"])
+):
+    """Alimento resolvido com o vetor de macros por 100g (calorias, proteínas, carboidratos, gorduras)"""
+
+    __slots__ = ()
+
+    def nutrition(self, quantity):
+        """Macros para a quantidade informada (em gramas)"""
+        factor = quantity / 100
+        return {macro: value * factor for macro, value in zip(MACROS, self.per_100g)}
+
+
+def _per_100g(food):
+    # Valores pré-calculados no modelo (zerados quando quantity é 0)
+    return tuple(getattr(food, f"{macro}_100g") or 0.0 for macro in MACROS)
+
+
+def _to_resolved(food, source):
+    return ResolvedFood(
+        food.id, food.code, food.name, food.quantity, _per_100g(food), source
+    )
+
+
+_get_global_cache = config_cache(
+    "FOOD_RESOLVER_CACHE_SIZE", "FOOD_RESOLVER_CACHE_TTL", maxsize=4096, ttl=3600
+)
+
+
+@on_catalog_change
+def invalidate_global_foods():
+    """Descarta as linhas de FoodData em cache (chamado quando o catálogo muda)."""
+    _get_global_cache().clear()
+
+
+def _request_memo():
+    memo = getattr(g, "_food_resolver_memo", None)
+    if memo is None:
+        memo = g._food_resolver_memo = {}
+    return memo
+
+
+def resolve_foods(codes, user_id=None):
+    """
+    Resolve vários códigos de uma vez.
+
+    Retorna um dicionário ``code -> ResolvedFood`` apenas com os códigos
+    encontrados. Alimentos do usuário têm prioridade sobre os globais.
+    """
+    from app.models import FoodData, UserFood
+
+    codes = {code for code in codes if code}
+    memo = _request_memo() if has_app_context() else {}
+
+    resolved = {}
+    pending = set()
+    for code in codes:
+        food = memo.get((user_id, code), _MISSING)
+        if food is _MISSING:
+            pending.add(code)
+        elif food is not None:
+            resolved[code] = food
+
+    if pending and user_id is not None:
+        for food in UserFood.query.filter(
+            UserFood.user_id == user_id, UserFood.code.in_(pending)
+        ):
+            resolved[food.code] = memo[(user_id, food.code)] = _to_resolved(
+                food, "user"
+            )
+        pending -= resolved.keys()
+
+    if pending:
+        check_catalog(current_app.config.get("FOOD_CATALOG_CHECK_INTERVAL", 30))
+        cache = _get_global_cache()
+        missing = set()
+        for code in pending:
+            food = cache.get(code, _MISSING)
+            if food is _MISSING:
+                missing.add(code)
+            elif food is not None:
+                resolved[code] = food
+
+        if missing:
+            for food in FoodData.query.filter(FoodData.code.in_(missing)):
+                resolved[food.code] = _to_resolved(food, "global")
+                cache.set(food.code, resolved[food.code])
+            # Guarda também os códigos inexistentes para não consultar de novo
+            for code in missing - resolved.keys():
+                cache.set(code, None)
+
+        for code in pending:
+            memo[(user_id, code)] = resolved.get(code)
+
+    return resolved
+
+
+def resolve_food(code, user_id=None):
+    """Resolve um único código; retorna None se não existir."""
+    return resolve_foods([code], user_id).get(code)
+
+
+def resolver_stats():
+    return _get_global_cache().stats()
@@ -0,0 +1,228 @@
+"""
+Recuperação lexical (BM25) de alimentos para o prompt do chatbot.
+
+Em vez de listar centenas de alimentos em toda mensagem, o prompt recebe só
+os mais relevantes para a pergunta e para o diário do dia. Os índices são
+montados no próprio processo a partir dos nomes e códigos:
+
+- global (FoodData): um por processo, refeito quando o catálogo muda;
+- por usuário (UserFood): LRU com TTL, descartado quando o usuário altera
+  os alimentos personalizados (``invalidate_user_food_retrieval``).
+
+Termos da mensagem pesam mais que os dos alimentos já registrados no diário;
+palavras a partir de 4 letras também casam o início de palavras do índice
+("frang" -> "frango"), com peso menor.
+"""
+import heapq
+import math
+from bisect import bisect_left
+from collections import Counter
+
+from app.utils.cache import config_cache
+from app.utils.chatbot_catalog import food_prompt_entry
+from app.utils.food_catalog import CatalogCache
+from app.utils.food_search import tokenize
+from app.utils.text import normalize_search_text
+
+# Parâmetros do BM25
+K1 = 1.2
+B = 0.75
+
+PREFIX_WEIGHT = 0.7  # Termo da consulta que casa só o início de uma palavra
+MAX_PREFIX_EXPANSIONS = 20
+MIN_PREFIX_LENGTH = 4
+DIARY_WEIGHT = 0.4  # Termos dos alimentos do diário em relação aos da mensagem
+USER_FOOD_BOOST = 1.2  # Alimentos personalizados vencem empates com os globais
+
+# Palavras da conversa que não ajudam a achar alimentos (já normalizadas);
+# refeições ficam de fora porque as opções por refeição vêm de outra seção
+STOPWORDS = set("""
+    a o as os um uma uns umas de da do das dos e em na no nas nos ao com sem
+    para pra por que me eu meu minha se ou mais menos muito qual quais quanto
+    quantos como onde hoje ontem dia agora oi ola tudo bem bom boa obrigado
+    obrigada comer comi quero queria posso pode preciso ajuda sobre algo
+    alguma algum tipo recomende recomendacao sugira sugestao dieta refeicao
+    manha tarde noite almoco janta jantar ceia lanche g kg ml kcal caloria
+    proteina
+    """.split())
+
+
+def _stem(token):
+    """Plural simples do português: "ovos" -> "ovo", "paes" -> "pao", "limoes" -> "limao" """
+    if len(token) > 4 and token.endswith(("oes", "aes")):
+        return token[:-3] + "ao"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def index_terms(text):
+    """Termos de um texto para o índice/consulta (normalizados, sem stopwords)"""
+    return [
+        _stem(token)
+        for token in tokenize(normalize_search_text(text))
+        if token not in STOPWORDS and len(token) > 1 and not token.isdigit()
+    ]
+
+
+class BM25Index:
+    """Índice BM25 sobre nome + código de uma lista de entradas do prompt"""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.by_code = {entry["code"]: entry for entry in entries}
+        documents = [
+            index_terms(f"{entry['name']} {entry['code']}") for entry in entries
+        ]
+        self.lengths = [len(terms) for terms in documents]
+        self.average_length = (sum(self.lengths) / len(documents)) if documents else 0
+
+        self.postings = {}
+        for i, terms in enumerate(documents):
+            for term, frequency in Counter(terms).items():
+                self.postings.setdefault(term, []).append((i, frequency))
+        total = len(documents)
+        self.idf = {
+            term: math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+        self.vocabulary = sorted(self.postings)
+        self.max_idf = max(self.idf.values(), default=0.0)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _expand(self, term):
+        """Termos do índice que casam ``term``: exato e, se longo, por prefixo"""
+        matches = []
+        if term in self.postings:
+            matches.append((term, 1.0))
+        if len(term) >= MIN_PREFIX_LENGTH:
+            start = bisect_left(self.vocabulary, term)
+            for candidate in self.vocabulary[start : start + MAX_PREFIX_EXPANSIONS + 1]:
+                if not candidate.startswith(term):
+                    break
+                if candidate != term:
+                    matches.append((candidate, PREFIX_WEIGHT))
+        return matches
+
+    def search(self, weighted_terms, limit, reference=None):
+        """
+        [(entrada, nota)] das ``limit`` entradas mais relevantes.
+
+        ``reference`` é outro índice cujo IDF é usado no lugar do próprio:
+        com poucos alimentos personalizados o IDF do usuário não diz nada, e
+        as notas ficam comparáveis com as do índice global.
+        """
+        stats = reference or self
+        scores = {}
+        for term, weight in weighted_terms.items():
+            # Cada termo da consulta conta uma vez por documento (o melhor casamento)
+            term_scores = {}
+            for matched, factor in self._expand(term):
+                idf = stats.idf.get(matched, stats.max_idf)
+                for i, frequency in self.postings[matched]:
+                    length_norm = 1 - B + B * self.lengths[i] / self.average_length
+                    score = (
+                        factor
+                        * idf
+                        * frequency
+                        * (K1 + 1)
+                        / (frequency + K1 * length_norm)
+                    )
+                    if score > term_scores.get(i, 0):
+                        term_scores[i] = score
+            for i, score in term_scores.items():
+                scores[i] = scores.get(i, 0) + weight * score
+
+        top = heapq.nlargest(
+            limit, scores.items(), key=lambda item: (item[1], -item[0])
+        )
+        return [(self.entries[i], score) for i, score in top]
+
+
+def query_terms(message, diary_names=()):
+    """Pesos dos termos da consulta: mensagem com peso 1, diário com DIARY_WEIGHT"""
+    weights = {}
+    for name in diary_names:
+        for term in index_terms(name):
+            weights[term] = DIARY_WEIGHT
+    for term in index_terms(message):
+        weights[term] = 1.0
+    return weights
+
+
+def _build_global_index():
+    from app.models import FoodData
+
+    foods = FoodData.query.order_by(FoodData.id).all()
+    return BM25Index([food_prompt_entry(food) for food in foods])
+
+
+_global = CatalogCache(_build_global_index)
+
+
+def get_food_retrieval_index():
+    """Índice BM25 de FoodData, reconstruído só quando o catálogo muda"""
+    return _global.get()
+
+
+_get_user_cache = config_cache(
+    "USER_FOOD_INDEX_CACHE_SIZE", "USER_FOOD_INDEX_TTL", maxsize=256, ttl=300
+)
+
+
+def get_user_food_retrieval_index(user_id):
+    """Índice BM25 dos alimentos personalizados do usuário"""
+    from app.models import UserFood
+
+    def load():
+        foods = (
+            UserFood.query.filter(UserFood.user_id == user_id)
+            .order_by(UserFood.id)
+            .all()
+        )
+        return BM25Index([food_prompt_entry(food) for food in foods])
+
+    return _get_user_cache().get_or_create(user_id, load)
+
+
+def invalidate_user_food_retrieval(user_id):
+    """Descarta o índice do usuário depois de uma alteração em UserFood."""
+    _get_user_cache().pop(user_id)
+
+
+def retrieve_foods(message, user_id, diary_names=(), limit=25):
+    """
+    Alimentos mais relevantes para a mensagem e o diário, já como entradas do
+    prompt. Alimentos personalizados escondem os globais de mesmo código.
+    """
+    terms = query_terms(message, diary_names)
+    if not terms:
+        return []
+
+    user_index = get_user_food_retrieval_index(user_id)
+    global_index = get_food_retrieval_index()
+    results = [
+        (entry, score * USER_FOOD_BOOST)
+        for entry, score in user_index.search(terms, limit, reference=global_index)
+    ]
+    results += [
+        (entry, score)
+        for entry, score in global_index.search(terms, limit)
+        if entry["code"] not in user_index.by_code
+    ]
+    results.sort(key=lambda item: item[1], reverse=True)
+    return [entry for entry, _ in results[:limit]]
+
+
+def lookup_foods(codes, user_id):
+    """Entradas do prompt para códigos conhecidos (personalizados primeiro)"""
+    user_index = get_user_food_retrieval_index(user_id)
+    global_index = get_food_retrieval_index()
+    entries = []
+    for code in codes:
+        entry = user_index.by_code.get(code) or global_index.by_code.get(code)
+        if entry is not None:
+            entries.append(entry)
+    return entries
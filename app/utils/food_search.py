@@ -0,0 +1,412 @@
+"""
+Índice em memória e busca ranqueada para o autocomplete de alimentos
+(/api/search_food).
+
+A tabela food_data é pequena e só muda na importação, então o processo monta
+uma única vez:
+
+- o vocabulário ordenado de palavras dos códigos, para achar prefixos com bisect;
+- um índice de remoções (variações com uma letra a menos) para tolerar erros
+  de digitação de distância 1 ("frnago" -> "frango");
+- um índice de n-gramas (postings) para achar ocorrências no meio do código.
+
+Cada resultado recebe uma nota que combina o tipo de casamento de cada
+palavra (exata, prefixo, aproximada, substring), a cobertura das palavras da
+consulta em qualquer ordem ("integral arroz") e a frequência com que o
+usuário já usou o alimento. As chaves e as consultas usam a forma normalizada
+do texto (sem acentos, minúsculas), então "acai" encontra "Açaí".
+
+Com FOOD_SEARCH_BACKEND = "db" a rota usa ``search_foods_db`` no lugar do
+índice em memória: consultas sobre as colunas search_code/search_name, com
+trigramas (pg_trgm) e similaridade no PostgreSQL e ILIKE no SQLite.
+"""
+import heapq
+import math
+import re
+from bisect import bisect_left
+from collections import Counter, namedtuple
+
+from sqlalchemy import and_, case, func, or_
+
+from app import db
+from app.utils.cache import config_cache
+from app.utils.food_catalog import CatalogCache
+from app.utils.text import normalize_search_text
+
+NGRAM_SIZES = (2, 3)
+MIN_FUZZY_LENGTH = 4  # Palavras mais curtas que isso só casam exato/prefixo
+
+# Pesos da nota de cada palavra da consulta
+SCORE_EXACT = 1.0
+SCORE_PREFIX = 0.85
+SCORE_FUZZY = 0.6
+SCORE_FUZZY_PREFIX = 0.5
+SCORE_SUBSTRING = 0.4
+
+# Bônus aplicados à nota final
+BONUS_EXACT_KEY = 1.0  # Consulta igual ao código inteiro
+BONUS_KEY_PREFIX = 0.5  # Código começa com a consulta inteira
+BONUS_FIRST_TOKEN = 0.1  # Primeira palavra do código casa a primeira da consulta
+USAGE_WEIGHT = 0.1  # Multiplica log(1 + vezes que o usuário usou o alimento)
+MAX_USAGE_BONUS = 0.3
+LENGTH_PENALTY = 0.002  # Por caractere, favorece nomes curtos/genéricos
+
+FoodEntry = namedtuple("FoodEntry", ["id", "code", "quantity"])
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def _ngrams(text, size):
+    return {text[i : i + size] for i in range(len(text) - size + 1)}
+
+
+def tokenize(key):
+    """Palavras de um texto já normalizado"""
+    return _TOKEN_RE.findall(key)
+
+
+def _deletes(term):
+    return {term[:i] + term[i + 1 :] for i in range(len(term))}
+
+
+def edit_distance(a, b, max_distance=1):
+    """
+    Distância de edição com transposição de letras vizinhas (Damerau/OSA).
+
+    Para cedo e retorna ``max_distance + 1`` quando a distância passa do limite.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(
+                previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost
+            )
+            if (
+                previous2 is not None
+                and i > 1
+                and j > 1
+                and a[i - 1] == b[j - 2]
+                and a[i - 2] == b[j - 1]
+            ):
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class FoodSearchIndex:
+    """Índice imutável de palavras, prefixos, variações e n-gramas dos códigos"""
+
+    def __init__(self, foods):
+        self.entries = [FoodEntry(food.id, food.code, food.quantity) for food in foods]
+        self.keys = [normalize_search_text(entry.code) for entry in self.entries]
+        self.entry_tokens = [tokenize(key) for key in self.keys]
+
+        # Palavra -> posições das entradas que a contêm
+        self.token_postings = {}
+        for i, tokens in enumerate(self.entry_tokens):
+            for token in set(tokens):
+                self.token_postings.setdefault(token, []).append(i)
+        self.vocabulary = sorted(self.token_postings)
+
+        # Variações (termo e termo com uma letra removida) -> termos, onde termos
+        # são as palavras e seus prefixos a partir de MIN_FUZZY_LENGTH letras
+        self.fuzzy_terms = {}
+        for token in self.vocabulary:
+            if len(token) < MIN_FUZZY_LENGTH - 1:
+                continue
+            for length in range(min(MIN_FUZZY_LENGTH, len(token)), len(token) + 1):
+                term = token[:length]
+                for variant in _deletes(term) | {term}:
+                    self.fuzzy_terms.setdefault(variant, set()).add(term)
+
+        # N-grama -> posições (em ordem crescente) das entradas que o contêm
+        self.postings = {}
+        for i, key in enumerate(self.keys):
+            for size in NGRAM_SIZES:
+                for gram in _ngrams(key, size):
+                    self.postings.setdefault(gram, []).append(i)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def tokens_with_prefix(self, prefix):
+        """Palavras do vocabulário que começam com ``prefix``"""
+        tokens = []
+        pos = bisect_left(self.vocabulary, prefix)
+        while pos < len(self.vocabulary) and self.vocabulary[pos].startswith(prefix):
+            tokens.append(self.vocabulary[pos])
+            pos += 1
+        return tokens
+
+    def substring_matches(self, key, limit=None, exclude=()):
+        """Posições das entradas cujo código contém ``key`` em qualquer ponto"""
+        size = 3 if len(key) >= 3 else 2
+        grams = _ngrams(key, size)
+        lists = [self.postings.get(gram) for gram in grams]
+        if not lists or any(postings is None for postings in lists):
+            return []
+
+        # Começa pela lista mais curta e filtra pelas demais
+        lists.sort(key=len)
+        candidates = lists[0]
+        others = [set(postings) for postings in lists[1:]]
+
+        matches = []
+        for i in candidates:
+            if i in exclude:
+                continue
+            if all(i in other for other in others) and key in self.keys[i]:
+                matches.append(i)
+                if limit is not None and len(matches) >= limit:
+                    break
+        return matches
+
+    def token_scores(self, query_token):
+        """Nota de cada palavra do vocabulário que casa com uma palavra da consulta"""
+        scores = {}
+        for token in self.tokens_with_prefix(query_token):
+            scores[token] = SCORE_EXACT if token == query_token else SCORE_PREFIX
+
+        if len(query_token) >= MIN_FUZZY_LENGTH:
+            terms = set()
+            for variant in _deletes(query_token) | {query_token}:
+                terms |= self.fuzzy_terms.get(variant, set())
+            for term in terms:
+                if edit_distance(query_token, term) > 1:
+                    continue
+                for token in self.tokens_with_prefix(term):
+                    score = SCORE_FUZZY if token == term else SCORE_FUZZY_PREFIX
+                    if score > scores.get(token, 0):
+                        scores[token] = score
+        return scores
+
+    def score_entries(self, key, query_tokens, usage=None, exclude_codes=()):
+        """Lista de (nota, posição) das entradas que casam com a consulta."""
+        per_token = []
+        for query_token in query_tokens:
+            best = {}
+            for token, score in self.token_scores(query_token).items():
+                for i in self.token_postings[token]:
+                    if score > best.get(i, 0):
+                        best[i] = score
+            if len(query_token) >= 3:
+                for i in self.substring_matches(query_token):
+                    if SCORE_SUBSTRING > best.get(i, 0):
+                        best[i] = SCORE_SUBSTRING
+            per_token.append(best)
+
+        candidates = set().union(*per_token) if per_token else set()
+        results = []
+        n_tokens = len(query_tokens)
+        for i in candidates:
+            entry = self.entries[i]
+            if entry.code in exclude_codes:
+                continue
+            scores = [best.get(i, 0) for best in per_token]
+            coverage = sum(1 for score in scores if score > 0) / n_tokens
+            score = sum(scores) / n_tokens * coverage
+
+            entry_key = self.keys[i]
+            if entry_key == key:
+                score += BONUS_EXACT_KEY
+            elif entry_key.startswith(key):
+                score += BONUS_KEY_PREFIX
+            first_tokens = self.entry_tokens[i]
+            if first_tokens and per_token[0].get(i, 0) >= SCORE_PREFIX:
+                if first_tokens[0].startswith(query_tokens[0]):
+                    score += BONUS_FIRST_TOKEN
+            if usage:
+                count = usage.get(entry.code, 0)
+                if count:
+                    score += min(MAX_USAGE_BONUS, USAGE_WEIGHT * math.log1p(count))
+            score -= LENGTH_PENALTY * len(entry_key)
+            results.append((score, i))
+        return results
+
+
+def rank_foods(query, indexes, usage=None, limit=10):
+    """
+    Top-k de alimentos para uma consulta sobre um ou mais índices.
+
+    ``indexes`` vem em ordem de prioridade: um código presente num índice
+    anterior (ex.: alimentos do usuário) esconde o mesmo código nos seguintes.
+    """
+    key = normalize_search_text(query)
+    query_tokens = tokenize(key)
+    if not query_tokens:
+        return []
+
+    scored = []
+    seen_codes = set()
+    for order, index in enumerate(indexes):
+        for score, i in index.score_entries(key, query_tokens, usage, seen_codes):
+            # A ordem do índice desempata a favor dos alimentos do usuário
+            scored.append((score, -order, -i, index.entries[i]))
+        seen_codes |= {entry.code for entry in index.entries}
+
+    top = heapq.nlargest(limit, scored, key=lambda item: item[:3])
+    return [entry for _, _, _, entry in top]
+
+
+_get_user_index_cache = config_cache(
+    "USER_FOOD_INDEX_CACHE_SIZE", "USER_FOOD_INDEX_TTL", maxsize=256, ttl=300
+)
+
+
+def get_user_food_index(user_id):
+    """
+    Índice dos alimentos personalizados do usuário (overlay sobre o global).
+
+    Montado na primeira busca do usuário e mantido num LRU com TTL; as rotas
+    que criam, alteram ou removem UserFood chamam ``invalidate_user_food_index``.
+    O TTL cobre alterações feitas em outro worker.
+    """
+    from app.models import UserFood
+
+    def load():
+        foods = (
+            UserFood.query.with_entities(UserFood.id, UserFood.code, UserFood.quantity)
+            .filter(UserFood.user_id == user_id)
+            .order_by(UserFood.id)
+            .all()
+        )
+        return FoodSearchIndex(foods)
+
+    return _get_user_index_cache().get_or_create(user_id, load)
+
+
+def invalidate_user_food_index(user_id):
+    """Descarta o índice do usuário depois de uma alteração em UserFood."""
+    _get_user_index_cache().pop(user_id)
+
+
+def user_food_index_stats():
+    return _get_user_index_cache().stats()
+
+
+_get_usage_cache = config_cache(
+    "FOOD_USAGE_CACHE_SIZE", "FOOD_USAGE_CACHE_TTL", maxsize=512, ttl=600
+)
+
+
+def get_user_food_usage(user_id, diaries=60):
+    """Quantas vezes cada código aparece nos diários recentes do usuário (cache com TTL)"""
+
+    def load():
+        from app.models import Diet
+
+        usage = Counter()
+        rows = (
+            Diet.query.with_entities(Diet.meals_data)
+            .filter(Diet.user_id == user_id, Diet.date.isnot(None))
+            .order_by(Diet.date.desc())
+            .limit(diaries)
+            .all()
+        )
+        for (meals_data,) in rows:
+            for foods in (meals_data or {}).values():
+                for food in foods or []:
+                    code = food.get("food_code") if isinstance(food, dict) else None
+                    if code:
+                        usage[code] += 1
+        return usage
+
+    return _get_usage_cache().get_or_create(user_id, load)
+
+
+def _escape_like(text):
+    return text.replace("/", "//").replace("%", "/%").replace("_", "/_")
+
+
+def prefix_filter(column, prefix):
+    """
+    Filtro "começa com" sobre uma coluna de chave normalizada que usa índice.
+
+    No PostgreSQL o LIKE 'prefixo%' usa o índice varchar_pattern_ops (o padrão
+    vai pronto como parâmetro: ``'prefixo' || '%'`` montado no SQL não usaria
+    o índice em planos genéricos); no SQLite o LIKE não usa índice, então a
+    busca vira uma comparação de faixa.
+    """
+    if db.engine.dialect.name == "postgresql":
+        return column.like(_escape_like(prefix) + "%", escape="/")
+    return and_(column >= prefix, column < prefix + "\U0010ffff")
+
+
+def search_foods_db(model, query, limit=10, user_id=None, field="code"):
+    """
+    Busca alimentos direto no banco pela chave normalizada de código ou nome.
+
+    No PostgreSQL uma única consulta junta prefixos (LIKE 'chave%', índice
+    varchar_pattern_ops), substrings e nomes parecidos (operador %, índices
+    GIN de trigramas), ordenada por similaridade. Nos demais bancos (SQLite)
+    mantém a busca original como fallback: primeiro prefixos, depois ILIKE
+    '%chave%'.
+
+    Usada por /api/search_food com FOOD_SEARCH_BACKEND = "db".
+    """
+    key = normalize_search_text(query)
+    if not key:
+        return []
+
+    column = model.search_name if field == "name" else model.search_code
+    base = model.query
+    if user_id is not None:
+        base = base.filter(model.user_id == user_id)
+
+    if db.engine.dialect.name == "postgresql":
+        return (
+            base.filter(
+                or_(
+                    prefix_filter(column, key),
+                    column.like(f"%{_escape_like(key)}%", escape="/"),
+                    column.op("%")(key),
+                )
+            )
+            .order_by(
+                func.similarity(column, key).desc(),
+                case((prefix_filter(column, key), 0), else_=1),
+                func.length(column),
+            )
+            .limit(limit)
+            .all()
+        )
+
+    foods = base.filter(prefix_filter(column, key)).limit(limit).all()
+    if len(foods) < limit:
+        query_obj = base.filter(column.icontains(key, autoescape=True))
+        start_ids = [food.id for food in foods]
+        if start_ids:
+            query_obj = query_obj.filter(~model.id.in_(start_ids))
+        foods += query_obj.limit(limit - len(foods)).all()
+    return foods
+
+
+def _build_index():
+    from app.models import FoodData
+
+    foods = (
+        FoodData.query.with_entities(FoodData.id, FoodData.code, FoodData.quantity)
+        .order_by(FoodData.id)
+        .all()
+    )
+    return FoodSearchIndex(foods)
+
+
+_index = CatalogCache(_build_index)
+
+
+def build_food_search_index():
+    """Lê food_data e troca o índice em uso pelo novo."""
+    return _index.rebuild()
+
+
+def get_food_search_index():
+    """Retorna o índice global, reconstruindo se o catálogo mudou."""
+    return _index.get()
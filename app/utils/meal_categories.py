@@ -0,0 +1,87 @@
+"""
+Categorias de refeição de um alimento, a partir de palavras-chave no nome.
+
+As categorias são calculadas uma vez por alimento (listener dos modelos, na
+inserção/alteração) e guardadas em ``meal_categories``. O casamento usa uma
+única expressão regular com todas as palavras-chave, em vez de testar cada
+lista de palavras para cada tipo de refeição.
+"""
+import re
+
+from app.constants import MEAL_TYPES
+
+# Palavras-chave por tipo de refeição (lógica brasileira)
+CAFE_KEYWORDS = [
+    "pão", "torrada", "bolacha", "biscoito", "cereal", "aveia", "granola",
+    "leite", "iogurte", "queijo", "requeijão", "manteiga", "margarina", "ovo",
+    "ovos", "omelete", "fruta", "banana", "maçã", "laranja", "suco", "café",
+    "chá", "mel", "geleia", "marmelada", "creme", "tapioca", "crepioca",
+    "panqueca", "waffle",
+]
+ALMOCO_KEYWORDS = [
+    "arroz", "feijão", "batata", "batata doce", "mandioca", "aipim", "macarrão",
+    "massa", "lasanha", "frango", "frango grelhado", "carne", "bife", "peixe",
+    "salmão", "tilápia", "sardinha", "salada", "alface", "tomate", "cenoura",
+    "brócolis", "couve", "ovo frito", "ovo cozido", "hambúrguer", "pizza",
+    "strogonoff", "parmegiana", "moqueca", "feijoada", "churrasco",
+    "churrasquinho",
+]
+LANCHE_KEYWORDS = [
+    "fruta", "banana", "maçã", "laranja", "pera", "uva", "mamão", "iogurte",
+    "queijo", "bolacha", "biscoito", "cereal", "barra", "castanha", "amendoim",
+    "nozes", "suco", "vitamina", "smoothie",
+]
+CEIA_KEYWORDS = [
+    "chá", "leite", "iogurte", "fruta", "banana", "bolacha", "biscoito",
+    "queijo", "castanha", "amendoim",
+]
+
+MEAL_KEYWORDS = {
+    "cafe_da_manha": CAFE_KEYWORDS,
+    "almoco": ALMOCO_KEYWORDS,
+    "janta": ALMOCO_KEYWORDS,
+    "lanche_manha": LANCHE_KEYWORDS,
+    "lanche_tarde": LANCHE_KEYWORDS,
+    "ceia": CEIA_KEYWORDS,
+}
+
+
+def _build_matcher():
+    keyword_meals = {}
+    for meal_type, keywords in MEAL_KEYWORDS.items():
+        for keyword in keywords:
+            keyword_meals.setdefault(keyword, set()).add(meal_type)
+
+    # Uma palavra que contém outra (ex.: "ovo frito" contém "ovo") herda as
+    # categorias dela, como no teste ``keyword in name`` original
+    for keyword, meals in keyword_meals.items():
+        for other, other_meals in keyword_meals.items():
+            if other != keyword and other in keyword:
+                meals |= other_meals
+
+    # Lookahead: encontra o casamento mais longo em cada posição, inclusive
+    # sobrepostos; palavras maiores primeiro na alternância
+    alternation = "|".join(
+        re.escape(keyword) for keyword in sorted(keyword_meals, key=len, reverse=True)
+    )
+    return re.compile(f"(?=({alternation}))"), keyword_meals
+
+
+_PATTERN, _KEYWORD_MEALS = _build_matcher()
+
+
+def meal_types_for(name):
+    """Tipos de refeição (ordem de MEAL_TYPES) adequados para o alimento"""
+    found = set()
+    for keyword in _PATTERN.findall((name or "").lower()):
+        found |= _KEYWORD_MEALS[keyword]
+    return [meal_type for meal_type in MEAL_TYPES if meal_type in found]
+
+
+def encode_meal_types(meal_types):
+    """Valor guardado na coluna ``meal_categories`` (tipos separados por vírgula)"""
+    return ",".join(meal_types)
+
+
+def decode_meal_types(value):
+    return [meal_type for meal_type in (value or "").split(",") if meal_type]
@@ -0,0 +1,49 @@
+"""
+Cliente OpenAI compartilhado pela aplicação.
+
+O cliente é criado uma vez em ``create_app`` (um por worker do gunicorn) e
+usado por todas as threads: o httpx.Client por baixo é thread-safe e mantém
+as conexões abertas (keep-alive/TLS) entre as mensagens do chatbot.
+
+Proxy, timeouts e tentativas vêm do config (OPENAI_*). As variáveis de
+ambiente HTTP_PROXY/HTTPS_PROXY são ignoradas (``trust_env=False``) em vez de
+serem removidas de ``os.environ`` a cada chamada.
+"""
+from flask import current_app
+
+
+def init_openai_client(app):
+    """Cria o cliente e guarda em ``app.extensions``; sem API key fica None"""
+    api_key = app.config.get("OPENAI_API_KEY")
+    if not api_key:
+        app.extensions["openai_client"] = None
+        return None
+
+    import httpx
+    from openai import OpenAI
+
+    http_client = httpx.Client(
+        trust_env=False,
+        proxy=app.config.get("OPENAI_PROXY") or None,
+        timeout=httpx.Timeout(
+            app.config.get("OPENAI_TIMEOUT", 60),
+            connect=app.config.get("OPENAI_CONNECT_TIMEOUT", 5),
+        ),
+        limits=httpx.Limits(
+            max_connections=app.config.get("OPENAI_MAX_CONNECTIONS", 10),
+            max_keepalive_connections=app.config.get("OPENAI_MAX_CONNECTIONS", 10),
+        ),
+    )
+    client = OpenAI(
+        api_key=api_key,
+        base_url=app.config.get("OPENAI_BASE_URL") or None,
+        http_client=http_client,
+        max_retries=app.config.get("OPENAI_MAX_RETRIES", 2),
+    )
+    app.extensions["openai_client"] = client
+    return client
+
+
+def get_openai_client():
+    """Cliente da aplicação atual (None se OPENAI_API_KEY não estiver configurada)"""
+    return current_app.extensions.get("openai_client")
@@ -0,0 +1,218 @@
+"""
+Execução dos cálculos de porções fora das threads do gunicorn.
+
+Cada worker do gunicorn mantém um pool de processos pequeno (criado no primeiro
+uso) para as chamadas ao SciPy, com:
+
+- limite de cálculos em andamento (PORTION_POOL_MAX_PENDING): acima dele a
+  requisição é recusada na hora, em vez de ficar na fila;
+- tempo máximo por cálculo (PORTION_SOLVE_TIMEOUT), contado a partir do início
+  do cálculo no processo filho (um alarme interrompe o SciPy ali, sem afetar os
+  outros cálculos). Se o processo não responder nem assim (código C travado),
+  o pool é encerrado e os cálculos que estavam nele são reenviados a um pool
+  novo, uma vez, em vez de falharem junto.
+
+Os processos nascem por ``forkserver`` (ou ``spawn``): ``fork`` a partir de um
+worker do gunicorn com várias threads pode herdar locks presos.
+
+Com PORTION_POOL_WORKERS = 0 o cálculo roda na própria thread (útil em testes),
+mantendo apenas o limite de cálculos em andamento.
+"""
+import multiprocessing
+import signal
+import threading
+import time
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app
+
+from app.utils.portion_solver import solve_portions
+
+
+class PoolSaturatedError(Exception):
+    """Muitos cálculos em andamento neste processo"""
+
+
+class SolveTimeoutError(Exception):
+    """O cálculo passou do tempo máximo"""
+
+
+# Folga do processo pai sobre o alarme do filho antes de encerrar o pool. O
+# executor marca como "running" até um cálculo além dos que estão nos
+# processos, então o relógio do pai pode começar um PORTION_SOLVE_TIMEOUT
+# antes do cálculo de fato.
+KILL_GRACE = 2.0
+POLL_INTERVAL = 0.05
+MAX_RESUBMITS = 1
+
+_lock = threading.Lock()
+_state = {"pool": None, "workers": None, "semaphore": None, "max_pending": None}
+_counters = {
+    "submitted": 0,
+    "completed": 0,
+    "rejected": 0,
+    "timeouts": 0,
+    "failures": 0,
+    "recycled": 0,
+    "resubmitted": 0,
+    "in_flight": 0,
+}
+
+
+def _count(name, delta=1):
+    with _lock:
+        _counters[name] += delta
+
+
+def _get_semaphore():
+    with _lock:
+        if _state["semaphore"] is None:
+            max_pending = current_app.config.get("PORTION_POOL_MAX_PENDING", 8)
+            _state["semaphore"] = threading.BoundedSemaphore(max_pending)
+            _state["max_pending"] = max_pending
+        return _state["semaphore"]
+
+
+def _get_pool():
+    with _lock:
+        if _state["pool"] is None:
+            _state["workers"] = current_app.config.get("PORTION_POOL_WORKERS", 1)
+            _state["pool"] = ProcessPoolExecutor(
+                max_workers=_state["workers"], mp_context=_mp_context()
+            )
+        return _state["pool"]
+
+
+def _mp_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context(
+        "forkserver" if "forkserver" in methods else "spawn"
+    )
+
+
+def _recycle_pool(pool):
+    """Encerra os processos de um pool travado; o próximo uso cria outro"""
+    with _lock:
+        if _state["pool"] is not pool:
+            # Já reciclado por outro cálculo que estava no mesmo pool
+            return
+        _state["pool"] = None
+        _counters["recycled"] += 1
+    # ProcessPoolExecutor não cancela tarefas em execução: é preciso matar os processos
+    for process in list((getattr(pool, "_processes", None) or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _on_alarm(signum, frame):
+    raise SolveTimeoutError()
+
+
+def _timed_solve(problem, x0, method, timeout):
+    """Roda no processo filho: o prazo começa quando o cálculo começa"""
+    if not hasattr(signal, "setitimer"):
+        return solve_portions(problem, x0, method)
+    previous = signal.signal(signal.SIGALRM, _on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return solve_portions(problem, x0, method)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _wait(future, timeout):
+    """Resultado do future, com o prazo contado a partir de quando ele começa"""
+    started = None
+    while True:
+        if started is None:
+            wait = POLL_INTERVAL
+        else:
+            wait = max(0.0, started + timeout - time.monotonic())
+        try:
+            return future.result(timeout=wait)
+        except FutureTimeoutError:
+            if started is None:
+                if future.running():
+                    started = time.monotonic()
+            elif time.monotonic() >= started + timeout:
+                raise
+
+
+def _solve_in_process(problem, x0, method, timeout):
+    attempts = 0
+    while True:
+        pool = _get_pool()
+        try:
+            future = pool.submit(_timed_solve, problem, x0, method, timeout)
+        except RuntimeError:
+            # Pool encerrado por outra thread entre _get_pool e submit
+            if _state["pool"] is pool:
+                raise
+            continue
+        try:
+            return _wait(future, 2 * timeout + KILL_GRACE)
+        except SolveTimeoutError:
+            # Alarme no processo filho: o pool continua saudável
+            _count("timeouts")
+            raise
+        except FutureTimeoutError:
+            # O alarme não interrompeu o filho: só encerrando os processos
+            _count("timeouts")
+            _recycle_pool(pool)
+            raise SolveTimeoutError()
+        except (BrokenProcessPool, CancelledError):
+            # Pool encerrado pelo timeout de outro cálculo (ou processo morto):
+            # este cálculo não tem culpa, vai para o pool novo
+            _recycle_pool(pool)
+            if attempts >= MAX_RESUBMITS:
+                _count("failures")
+                raise
+            attempts += 1
+            _count("resubmitted")
+
+
+def solve_in_pool(problem, x0=None, method="lsq"):
+    """
+    Mesmo contrato de ``solve_portions``, executado no pool com limite de tempo.
+
+    Levanta ``PoolSaturatedError`` se já houver PORTION_POOL_MAX_PENDING cálculos
+    em andamento, ``SolveTimeoutError`` se passar de PORTION_SOLVE_TIMEOUT e
+    ``BrokenProcessPool``/``CancelledError`` se o pool quebrar de novo depois
+    do reenvio.
+    """
+    semaphore = _get_semaphore()
+    if not semaphore.acquire(blocking=False):
+        _count("rejected")
+        raise PoolSaturatedError()
+
+    _count("submitted")
+    _count("in_flight")
+    try:
+        if not current_app.config.get("PORTION_POOL_WORKERS", 1):
+            solution = solve_portions(problem, x0, method)
+        else:
+            solution = _solve_in_process(
+                problem,
+                x0,
+                method,
+                current_app.config.get("PORTION_SOLVE_TIMEOUT", 10),
+            )
+        _count("completed")
+        return solution
+    finally:
+        _count("in_flight", -1)
+        semaphore.release()
+
+
+def portion_pool_stats():
+    with _lock:
+        return {
+            **_counters,
+            "workers": current_app.config.get("PORTION_POOL_WORKERS", 1),
+            "max_pending": _state["max_pending"]
+            or current_app.config.get("PORTION_POOL_MAX_PENDING", 8),
+            "pool_running": _state["pool"] is not None,
+        }
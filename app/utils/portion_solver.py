@@ -0,0 +1,524 @@
+"""
+Otimização de porções a partir de uma matriz de nutrientes.
+
+O problema é montado uma vez como matriz ``alimentos x macros`` (valores por
+grama). O objetivo (soma dos erros relativos ao quadrado), seu gradiente e as
+faixas de tolerância de cada macro viram operações de matriz, de modo que o
+SLSQP não precisa de diferenças finitas nem de laços em Python por iteração.
+
+Restrições lineares extras (ex.: fatia de calorias de uma refeição) podem ser
+adicionadas como linhas ``lo <= coeffs @ x <= hi``.
+
+Métodos disponíveis em ``solve_portions``:
+
+- ``lsq``: verificação de viabilidade por programação linear (HiGHS), depois
+  mínimos quadrados com limites (``lsq_linear``); se a solução sair das faixas
+  de tolerância, o SLSQP refina a partir dela;
+- ``slsqp``: apenas o SLSQP, mantido para comparação.
+
+``round_portions`` transforma a solução contínua em porções múltiplas do passo
+de cada alimento (ex.: 50g por ovo, 5g de azeite) sem sair das faixas.
+
+``cached_solve`` guarda as soluções por problema (mesma matriz, alvos,
+tolerância e limites) e usa a última solução com os mesmos alimentos como
+ponto de partida quando só os alvos ou limites mudam.
+"""
+import hashlib
+import itertools
+import time
+from collections import namedtuple
+
+import numpy as np
+from scipy.optimize import linprog, lsq_linear, minimize
+
+from app.utils.cache import config_cache
+from app.utils.food_resolver import MACROS
+
+DEFAULT_PORTION = 100.0  # Chute inicial, em gramas
+FEASIBILITY_EPS = 1e-6  # Folga relativa tolerada no LP de viabilidade
+
+METHODS = ("lsq", "slsqp")
+MAX_ENUMERATED_FOODS = 12  # Até 2^12 combinações de piso/teto testadas de uma vez
+
+LinearRow = namedtuple("LinearRow", ["coeffs", "lo", "hi", "label"], defaults=(None,))
+
+PortionSolution = namedtuple(
+    "PortionSolution",
+    ["x", "success", "message", "iterations", "method", "violations"],
+    defaults=((),),
+)
+
+
+class PortionProblem:
+    """
+    Problema de porções para ``n`` alimentos.
+
+    ``per_100g`` é uma sequência de vetores (calorias, proteínas, carboidratos,
+    gorduras) por 100g; ``targets`` é um dicionário com os alvos de cada macro
+    (alvos <= 0 são ignorados); ``bounds`` é uma lista de pares (min, max) em
+    gramas, com None para "sem limite".
+    """
+
+    def __init__(self, per_100g, targets, tolerance=0.1, bounds=None, rows=()):
+        self.matrix = np.asarray(per_100g, dtype=float).reshape(-1, len(MACROS)) / 100
+        n_foods = self.matrix.shape[0]
+
+        self.targets = np.array(
+            [float(targets.get(macro) or 0) for macro in MACROS], dtype=float
+        )
+        self.tolerance = float(tolerance)
+        self.active = self.targets > 0
+
+        bounds = bounds or [(None, None)] * n_foods
+        self.lower = np.array(
+            [lo if lo is not None else 0.0 for lo, _ in bounds], dtype=float
+        )
+        self.upper = np.array(
+            [hi if hi is not None else np.inf for _, hi in bounds], dtype=float
+        )
+
+        # Erro relativo: residual = W.T @ x - 1, com W = N / alvo
+        self.weights = self.matrix[:, self.active] / self.targets[self.active]
+
+        # Faixas de tolerância dos macros + linhas extras, empilhadas
+        coeffs = [self.matrix[:, self.active].T]
+        lo = [self.targets[self.active] * (1 - self.tolerance)]
+        hi = [self.targets[self.active] * (1 + self.tolerance)]
+        self.constraint_labels = [
+            macro.title() for macro, active in zip(MACROS, self.active) if active
+        ]
+        for row in rows:
+            coeffs.append(np.asarray(row.coeffs, dtype=float).reshape(1, n_foods))
+            lo.append([-np.inf if row.lo is None else row.lo])
+            hi.append([np.inf if row.hi is None else row.hi])
+            self.constraint_labels.append(
+                row.label or f"Restrição {len(self.constraint_labels) + 1}"
+            )
+        self.constraint_matrix = np.vstack(coeffs)
+        self.constraint_lo = np.concatenate(lo).astype(float)
+        self.constraint_hi = np.concatenate(hi).astype(float)
+
+    def _digest(self, *arrays):
+        digest = hashlib.sha1()
+        for array in arrays:
+            array = np.asarray(array, dtype=float)
+            digest.update(str(array.shape).encode())
+            digest.update(np.round(array, 6).tobytes())
+        return digest.hexdigest()
+
+    def cache_key(self, method):
+        """Hash canônico do problema completo (matriz, alvos, tolerância, limites e linhas)"""
+        return (
+            method,
+            self._digest(
+                self.matrix,
+                self.targets,
+                [self.tolerance],
+                self.lower,
+                self.upper,
+                self.constraint_matrix,
+                self.constraint_lo,
+                self.constraint_hi,
+            ),
+        )
+
+    def structure_key(self):
+        """Hash só dos alimentos e das linhas extras, para reaproveitar soluções vizinhas"""
+        return self._digest(self.matrix, self.constraint_matrix[self.active.sum():])
+
+    @property
+    def n_foods(self):
+        return self.matrix.shape[0]
+
+    def objective(self, x):
+        residual = self.weights.T @ x - 1
+        return float(residual @ residual)
+
+    def gradient(self, x):
+        residual = self.weights.T @ x - 1
+        return 2 * (self.weights @ residual)
+
+    def initial_guess(self):
+        return np.clip(np.full(self.n_foods, DEFAULT_PORTION), self.lower, self.upper)
+
+    def scipy_constraints(self):
+        """Restrições lineares no formato do SLSQP (g(x) >= 0), com jacobiano constante"""
+        has_lo = np.isfinite(self.constraint_lo)
+        has_hi = np.isfinite(self.constraint_hi)
+        matrix = np.vstack(
+            [self.constraint_matrix[has_lo], -self.constraint_matrix[has_hi]]
+        )
+        offset = np.concatenate(
+            [self.constraint_lo[has_lo], -self.constraint_hi[has_hi]]
+        )
+        if not len(offset):
+            return []
+        return [
+            {
+                "type": "ineq",
+                "fun": lambda x: matrix @ x - offset,
+                "jac": lambda x: matrix,
+            }
+        ]
+
+    def scipy_bounds(self):
+        return [
+            (lo, hi if np.isfinite(hi) else None)
+            for lo, hi in zip(self.lower, self.upper)
+        ]
+
+    def within_bands(self, x, rtol=1e-6):
+        """Se as porções x respeitam todas as faixas (macros e linhas extras)"""
+        values = self.constraint_matrix @ x
+        slack = rtol * np.maximum(1.0, np.abs(values))
+        return bool(
+            np.all(values >= self.constraint_lo - slack)
+            and np.all(values <= self.constraint_hi + slack)
+        )
+
+    def band_violation(self, xs):
+        """Violação relativa total das faixas para cada linha de ``xs`` (porções candidatas)"""
+        values = np.atleast_2d(xs) @ self.constraint_matrix.T
+        lo, hi = self.constraint_lo, self.constraint_hi
+        with np.errstate(invalid="ignore"):
+            below = np.where(
+                np.isfinite(lo), (lo - values) / np.maximum(np.abs(lo), 1.0), 0.0
+            )
+            above = np.where(
+                np.isfinite(hi), (values - hi) / np.maximum(np.abs(hi), 1.0), 0.0
+            )
+        return np.maximum(below, 0).sum(axis=1) + np.maximum(above, 0).sum(axis=1)
+
+    def objectives(self, xs):
+        """Objetivo para cada linha de ``xs``"""
+        residual = np.atleast_2d(xs) @ self.weights - 1
+        return (residual**2).sum(axis=1)
+
+    def nutrients(self, x):
+        """Macros (calorias, proteínas, carboidratos, gorduras) de cada alimento para as porções x"""
+        return self.matrix * np.asarray(x, dtype=float)[:, None]
+
+    def impossible_targets(self):
+        """Macros cuja faixa de tolerância não é alcançável dentro dos limites de cada alimento"""
+        min_values = self.lower @ self.matrix
+        with np.errstate(invalid="ignore"):
+            # inf * 0 vira nan; alimento sem o macro não contribui
+            max_values = np.nansum(self.upper[:, None] * self.matrix, axis=0)
+
+        messages = []
+        for index, macro in enumerate(MACROS):
+            if not self.active[index]:
+                continue
+            target = self.targets[index]
+            target_min = target * (1 - self.tolerance)
+            target_max = target * (1 + self.tolerance)
+            min_value, max_value = min_values[index], max_values[index]
+
+            if target_min < min_value:
+                messages.append(
+                    f"{macro.title()}: o mínimo possível ({min_value:.1f}) é maior que o alvo mínimo ({target_min:.1f})"
+                )
+            elif max_value < np.inf and target_max > max_value:
+                messages.append(
+                    f"{macro.title()}: o máximo possível ({max_value:.1f}) é menor que o alvo máximo ({target_max:.1f})"
+                )
+        return messages
+
+
+def share_rows(
+    per_100g, members, min_share=None, max_share=None, macro="calories", label=None
+):
+    """
+    Linhas que limitam a fatia de um macro vinda dos alimentos em ``members``.
+
+    ``min_share <= soma(membros) / soma(todos) <= max_share`` é linear depois de
+    multiplicar pelo total: ``soma(membros) - share * soma(todos) >= 0``.
+    """
+    column = np.asarray(per_100g, dtype=float).reshape(-1, len(MACROS))[
+        :, MACROS.index(macro)
+    ] / 100
+    members = np.asarray(members, dtype=float)
+    rows = []
+    if min_share is not None:
+        rows.append(
+            LinearRow(
+                column * (members - min_share), 0.0, None,
+                f"{label or 'Grupo'}: mínimo de {min_share * 100:.0f}% de {macro}",
+            )
+        )
+    if max_share is not None:
+        rows.append(
+            LinearRow(
+                column * (members - max_share), None, 0.0,
+                f"{label or 'Grupo'}: máximo de {max_share * 100:.0f}% de {macro}",
+            )
+        )
+    return rows
+
+
+def portion_entries(codes, problem, x):
+    """Porções no formato retornado pela API (quantidade e macros de cada alimento)"""
+    entries = []
+    for code, quantity, values in zip(codes, x, problem.nutrients(x)):
+        entry = {"food_code": code, "quantity": float(quantity)}
+        entry.update({macro: float(value) for macro, value in zip(MACROS, values)})
+        entries.append(entry)
+    return entries
+
+
+def round_portions(problem, x, steps, time_budget=0.1):
+    """
+    Arredonda as porções para múltiplos de ``steps`` (gramas; None/0 = sem arredondar).
+
+    Com poucos alimentos testa todas as combinações de piso/teto de uma vez;
+    depois (ou direto, com muitos alimentos) faz busca local movendo um alimento
+    um passo para cima ou para baixo, até não melhorar ou estourar
+    ``time_budget`` segundos. Candidatos são comparados primeiro pela violação
+    das faixas e depois pelo objetivo.
+
+    Retorna ``(porções, dentro_das_faixas)``.
+    """
+    deadline = time.monotonic() + time_budget
+    x = np.asarray(x, dtype=float)
+    steps = np.array([step or 0 for step in steps], dtype=float)
+
+    # Só arredonda alimentos com passo e pelo menos um múltiplo dentro dos limites
+    with np.errstate(divide="ignore", invalid="ignore"):
+        lo_step = np.ceil(problem.lower / steps - 1e-9) * steps
+        hi_step = np.floor(problem.upper / steps + 1e-9) * steps
+    rounded = (steps > 0) & (lo_step <= hi_step)
+    if not rounded.any():
+        return x, problem.within_bands(x)
+    index = np.flatnonzero(rounded)
+    step, lo_step, hi_step = steps[index], lo_step[index], hi_step[index]
+
+    def score(candidates):
+        violation = np.round(problem.band_violation(candidates), 9)
+        return violation, problem.objectives(candidates)
+
+    floor = np.clip(np.floor(x[index] / step) * step, lo_step, hi_step)
+    ceil = np.clip(np.ceil(x[index] / step) * step, lo_step, hi_step)
+    current = x.copy()
+    current[index] = np.clip(np.round(x[index] / step) * step, lo_step, hi_step)
+
+    if len(index) <= MAX_ENUMERATED_FOODS:
+        choices = itertools.product((False, True), repeat=len(index))
+        candidates = np.tile(x, (2 ** len(index), 1))
+        candidates[:, index] = np.where(np.array(list(choices)), ceil, floor)
+        violation, objective = score(candidates)
+        current = candidates[np.lexsort((objective, violation))[0]]
+
+    # Busca local: vizinhos a um passo de distância
+    moves = np.vstack([np.diag(step), -np.diag(step)])
+    best = tuple(value[0] for value in score(current))
+    while time.monotonic() < deadline:
+        neighbours = np.tile(current, (len(moves), 1))
+        neighbours[:, index] += moves
+        inside = (neighbours[:, index] >= lo_step - 1e-9) & (
+            neighbours[:, index] <= hi_step + 1e-9
+        )
+        neighbours = neighbours[inside.all(axis=1)]
+        if not len(neighbours):
+            break
+        violation, objective = score(neighbours)
+        pick = np.lexsort((objective, violation))[0]
+        if (violation[pick], objective[pick]) >= best:
+            break
+        current, best = neighbours[pick], (violation[pick], objective[pick])
+
+    return current, problem.within_bands(current)
+
+
+def check_feasibility(problem):
+    """
+    LP elástico: minimiza a violação relativa das faixas dentro dos limites dos alimentos.
+
+    Cada faixa ``lo <= c @ x <= hi`` ganha folgas ``s_lo, s_hi >= 0`` medidas em
+    fração do limite. Com custo zero o problema é viável e o ponto retornado já
+    respeita todas as faixas; caso contrário, as folgas positivas apontam as
+    restrições envolvidas no conflito. Cada uma delas é testada sozinha (LP só
+    com os limites dos alimentos, de solução direta): as inalcançáveis saem com
+    o valor mais próximo possível; as alcançáveis sozinhas, como conflito entre
+    si.
+
+    Retorna ``(viável, ponto, mensagens de violação, iterações)``.
+    """
+    n_foods = problem.n_foods
+    matrix = problem.constraint_matrix
+    lo, hi = problem.constraint_lo, problem.constraint_hi
+    n_rows = matrix.shape[0]
+    if not n_rows:
+        return True, problem.initial_guess(), [], 0
+
+    has_lo, has_hi = np.isfinite(lo), np.isfinite(hi)
+    scale_lo = np.where(has_lo, np.maximum(np.abs(lo), 1.0), 1.0)
+    scale_hi = np.where(has_hi, np.maximum(np.abs(hi), 1.0), 1.0)
+
+    # Variáveis: [x (n), s_lo (m), s_hi (m)]
+    eye = np.eye(n_rows)
+    a_ub = np.vstack(
+        [
+            np.hstack([-matrix, -eye * scale_lo, np.zeros((n_rows, n_rows))])[has_lo],
+            np.hstack([matrix, np.zeros((n_rows, n_rows)), -eye * scale_hi])[has_hi],
+        ]
+    )
+    b_ub = np.concatenate([-lo[has_lo], hi[has_hi]])
+    cost = np.concatenate([np.zeros(n_foods), np.ones(2 * n_rows)])
+    bounds = problem.scipy_bounds() + [(0, None)] * (2 * n_rows)
+
+    result = linprog(cost, A_ub=a_ub, b_ub=b_ub, bounds=bounds, method="highs")
+    iterations = int(getattr(result, "nit", 0) or 0)
+    if result.status != 0:
+        # Só acontece se os próprios limites dos alimentos forem inconsistentes
+        return False, problem.initial_guess(), [result.message], iterations
+
+    x = result.x[:n_foods]
+    if result.fun <= FEASIBILITY_EPS:
+        return True, x, [], iterations
+
+    s_lo = result.x[n_foods:n_foods + n_rows]
+    s_hi = result.x[n_foods + n_rows:]
+    row_min, row_max = _row_ranges(matrix, problem.lower, problem.upper)
+    messages = []
+    conflicting = []
+    for index, label in enumerate(problem.constraint_labels):
+        if s_lo[index] <= FEASIBILITY_EPS and s_hi[index] <= FEASIBILITY_EPS:
+            continue
+        if row_max[index] < lo[index] - FEASIBILITY_EPS * scale_lo[index]:
+            messages.append(
+                f"{label}: o mais próximo possível ({row_max[index]:.1f}) fica abaixo do alvo mínimo ({lo[index]:.1f})"
+            )
+        elif row_min[index] > hi[index] + FEASIBILITY_EPS * scale_hi[index]:
+            messages.append(
+                f"{label}: o mais próximo possível ({row_min[index]:.1f}) fica acima do alvo máximo ({hi[index]:.1f})"
+            )
+        else:
+            conflicting.append(label)
+    if conflicting:
+        messages.append(
+            f"{', '.join(conflicting)}: cada faixa é alcançável sozinha, mas não ao mesmo tempo que as demais"
+        )
+    return False, x, messages, iterations
+
+
+def _row_ranges(matrix, lower, upper):
+    """Mínimo e máximo de cada linha ``c @ x`` com x só entre os limites dos alimentos"""
+    # Coeficiente zero não contribui (evita 0 * inf)
+    with np.errstate(invalid="ignore"):
+        low_end = np.where(matrix > 0, matrix * lower, 0) + np.where(
+            matrix < 0, matrix * upper, 0
+        )
+        high_end = np.where(matrix > 0, matrix * upper, 0) + np.where(
+            matrix < 0, matrix * lower, 0
+        )
+    return low_end.sum(axis=1), high_end.sum(axis=1)
+
+
+def solve_lsq(problem, x0=None):
+    """
+    Viabilidade por LP, depois mínimos quadrados limitados.
+
+    O mínimo de mínimos quadrados é o ótimo global do problema sem faixas; se ele
+    já cai dentro das faixas, é também o ótimo com faixas. Senão o SLSQP parte
+    dele para encontrar o ótimo respeitando as faixas.
+    """
+    feasible, x_feasible, violations, iterations = check_feasibility(problem)
+    if not feasible:
+        return PortionSolution(
+            x_feasible, False, "Restrições inviáveis", iterations, "lsq", violations
+        )
+
+    if not problem.weights.shape[1]:
+        # Nenhum alvo ativo: qualquer ponto viável serve
+        return PortionSolution(x_feasible, True, "Sem alvos", iterations, "lsq")
+
+    result = lsq_linear(
+        problem.weights.T,
+        np.ones(problem.weights.shape[1]),
+        bounds=(problem.lower, problem.upper),
+        method="bvls",  # Problema pequeno e denso; "trf" sofre com limites infinitos
+    )
+    iterations += int(result.nit)
+    if result.success and problem.within_bands(result.x):
+        return PortionSolution(result.x, True, result.message, iterations, "lsq")
+
+    refined = solve_slsqp(problem, result.x if x0 is None else x0)
+    if refined.success:
+        return refined._replace(iterations=iterations + refined.iterations, method="lsq")
+
+    # O ponto do LP é viável; melhor devolvê-lo do que falhar
+    return PortionSolution(
+        x_feasible, True, refined.message, iterations + refined.iterations, "lsq"
+    )
+
+
+def solve_slsqp(problem, x0=None):
+    """Resolve com SLSQP usando gradiente analítico e restrições lineares vetorizadas"""
+    if x0 is None:
+        x0 = problem.initial_guess()
+    result = minimize(
+        problem.objective,
+        x0,
+        jac=problem.gradient,
+        method="SLSQP",
+        constraints=problem.scipy_constraints(),
+        bounds=problem.scipy_bounds(),
+    )
+    return PortionSolution(
+        result.x, bool(result.success), result.message, int(result.nit), "slsqp"
+    )
+
+
+def solve_portions(problem, x0=None, method="lsq"):
+    if method == "slsqp":
+        return solve_slsqp(problem, x0)
+    return solve_lsq(problem, x0)
+
+
+_get_solution_cache = config_cache(
+    "PORTION_CACHE_SIZE", "PORTION_CACHE_TTL", maxsize=512, ttl=600
+)
+_get_warm_start_cache = config_cache(
+    "PORTION_CACHE_SIZE", "PORTION_CACHE_TTL", maxsize=512, ttl=600
+)
+_counters = {"warm_started": 0}
+
+
+def _get_caches():
+    return _get_solution_cache(), _get_warm_start_cache()
+
+
+def cached_solve(problem, method="lsq", solve=None):
+    """
+    ``solve_portions`` com memoização.
+
+    Problema idêntico devolve a solução guardada; problema com os mesmos
+    alimentos (alvos, tolerância ou limites diferentes) parte da última
+    solução encontrada em vez do chute fixo de 100g. ``solve`` permite trocar
+    o executor (ex.: ``portion_pool.solve_in_pool``).
+    """
+    solutions, warm_starts = _get_caches()
+    key = problem.cache_key(method)
+    solution = solutions.get(key)
+    if solution is not None:
+        return solution
+
+    structure = problem.structure_key()
+    x0 = warm_starts.get(structure)
+    if x0 is not None:
+        x0 = np.clip(x0, problem.lower, problem.upper)
+        _counters["warm_started"] += 1
+
+    solution = (solve or solve_portions)(problem, x0, method)
+    solutions.set(key, solution)
+    if solution.success:
+        warm_starts.set(structure, solution.x)
+    return solution
+
+
+def portion_cache_stats():
+    solutions, warm_starts = _get_caches()
+    return {
+        "solutions": solutions.stats(),
+        "warm_starts": {**warm_starts.stats(), "used": _counters["warm_started"]},
+    }
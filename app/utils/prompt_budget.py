@@ -0,0 +1,251 @@
+"""
+Orçamento de tokens para o prompt do chatbot.
+
+O prompt é montado em seções (regras, perfil, diário, alimentos, histórico,
+mensagem) com prioridades. Cada seção tem itens que podem ser descartados um
+a um: linhas de alimentos do fim para o começo, mensagens do histórico das
+mais antigas para as mais novas. Quando o total passa do orçamento, as seções
+de menor prioridade perdem itens primeiro; as de prioridade REQUIRED nunca são
+cortadas.
+
+Os tokens são contados localmente, sem chamada de rede:
+
+- "estimate" (padrão): estimativa por palavras/números/pontuação, corrigida
+  continuamente pelo ``prompt_tokens`` que a API devolve (``calibrate``);
+- "tiktoken": contagem exata, se o pacote estiver instalado e o arquivo do
+  encoding já estiver em cache (o tiktoken baixa o arquivo no primeiro uso).
+"""
+import math
+import re
+import threading
+
+from flask import current_app
+
+REQUIRED = 0  # Seções que nunca são cortadas
+
+MESSAGE_OVERHEAD = 4  # Tokens de formatação de cada mensagem do chat
+REPLY_PRIMING = 3  # Tokens que abrem a resposta do assistente
+TIKTOKEN_ENCODING = "o200k_base"  # Encoding do gpt-4o / gpt-4o-mini
+
+# Estimativa: cada palavra custa 1 token mais 1 a cada WORD_CHARS_PER_TOKEN
+# letras além das primeiras; números vão em grupos de até 3 dígitos e cada
+# sinal de pontuação/emoji custa 1
+WORD_CHARS_PER_TOKEN = 5
+_PIECE_RE = re.compile(r"[^\W\d_]+|\d{1,3}|\n|[^\w\s]")
+
+# Correção da estimativa pelo uso informado pela API: média das primeiras
+# amostras, depois média móvel exponencial
+CALIBRATION_ALPHA = 0.1
+CALIBRATION_LIMITS = (0.5, 2.0)
+
+_calibration_lock = threading.Lock()
+_calibration = {"factor": 1.0, "samples": 0}
+_encoding = {"encoding": None, "loaded": False}
+
+
+def estimate_tokens(text):
+    """Estimativa de tokens sem a correção da calibração"""
+    tokens = 0
+    for piece in _PIECE_RE.findall(text or ""):
+        if piece[0].isalpha():
+            tokens += 1 + (len(piece) - 1) // WORD_CHARS_PER_TOKEN
+        else:
+            tokens += 1
+    return tokens
+
+
+def _get_encoding():
+    if not _encoding["loaded"]:
+        _encoding["loaded"] = True
+        try:
+            import tiktoken
+
+            _encoding["encoding"] = tiktoken.get_encoding(TIKTOKEN_ENCODING)
+        except Exception as e:  # Pacote ausente ou encoding fora do cache
+            current_app.logger.warning(
+                f"tiktoken indisponível, usando estimativa de tokens: {e}"
+            )
+    return _encoding["encoding"]
+
+
+def _use_tiktoken():
+    return current_app.config.get("CHATBOT_TOKENIZER") == "tiktoken" and (
+        _get_encoding() is not None
+    )
+
+
+def count_tokens(text):
+    """Tokens de um texto (contagem do tiktoken ou estimativa calibrada)"""
+    if not text:
+        return 0
+    if _use_tiktoken():
+        return len(_encoding["encoding"].encode(text))
+    return math.ceil(estimate_tokens(text) * _calibration["factor"])
+
+
+def message_tokens(message):
+    return count_tokens(message.get("content") or "") + MESSAGE_OVERHEAD
+
+
+def messages_tokens(messages):
+    return sum(message_tokens(message) for message in messages) + REPLY_PRIMING
+
+
+def calibrate(messages, prompt_tokens):
+    """Ajusta a estimativa com o ``prompt_tokens`` real de uma chamada"""
+    if not prompt_tokens or _use_tiktoken():
+        return
+    estimated = sum(
+        estimate_tokens(message.get("content") or "") for message in messages
+    )
+    overhead = MESSAGE_OVERHEAD * len(messages) + REPLY_PRIMING
+    if estimated <= 0 or prompt_tokens <= overhead:
+        return
+    low, high = CALIBRATION_LIMITS
+    ratio = min(max((prompt_tokens - overhead) / estimated, low), high)
+    with _calibration_lock:
+        _calibration["samples"] += 1
+        alpha = max(CALIBRATION_ALPHA, 1 / _calibration["samples"])
+        _calibration["factor"] += alpha * (ratio - _calibration["factor"])
+
+
+class PromptSection:
+    """
+    Parte do prompt com itens descartáveis.
+
+    ``header`` e ``footer`` acompanham os itens e só somem junto com o
+    último deles. ``keep`` itens nunca são descartados; ``trim_from`` diz de
+    que lado os itens saem ("end" ou "start").
+    """
+
+    def __init__(
+        self,
+        name,
+        items,
+        priority,
+        header="",
+        footer="",
+        keep=0,
+        trim_from="end",
+        max_tokens=None,
+    ):
+        self.name = name
+        self.items = list(items)
+        self.priority = priority
+        self.header = header
+        self.footer = footer
+        self.keep = keep
+        self.trim_from = trim_from
+        self.max_tokens = max_tokens
+        self.trimmed = 0
+        self._costs = [self._item_tokens(item) for item in self.items]
+        self._frame = count_tokens(header) + count_tokens(footer)
+
+    @staticmethod
+    def _item_tokens(item):
+        if isinstance(item, dict):
+            return message_tokens(item)
+        return count_tokens(item)
+
+    @property
+    def tokens(self):
+        if not self.items:
+            return 0
+        return self._frame + sum(self._costs)
+
+    def trim_to(self, limit):
+        """Descarta itens até caber em ``limit`` (ou sobrar só ``keep``)"""
+        index = -1 if self.trim_from == "end" else 0
+        while self.tokens > limit and len(self.items) > self.keep:
+            self.items.pop(index)
+            self._costs.pop(index)
+            self.trimmed += 1
+
+    def text(self):
+        if not self.items:
+            return ""
+        return self.header + "".join(self.items) + self.footer
+
+
+class PromptBudget:
+    """Seções do prompt dentro de ``max_tokens``"""
+
+    def __init__(self, max_tokens):
+        self.max_tokens = max_tokens
+        self.sections = {}
+
+    def add(self, name, items, priority, **options):
+        section = PromptSection(name, items, priority, **options)
+        self.sections[name] = section
+        return section
+
+    def __getitem__(self, name):
+        return self.sections[name]
+
+    @property
+    def tokens(self):
+        return sum(section.tokens for section in self.sections.values())
+
+    def fit(self):
+        """Aplica os limites de cada seção e depois corta pela prioridade"""
+        for section in self.sections.values():
+            if section.max_tokens is not None and section.priority != REQUIRED:
+                section.trim_to(section.max_tokens)
+
+        excess = self.tokens - self.max_tokens
+        by_priority = sorted(
+            self.sections.values(), key=lambda section: section.priority, reverse=True
+        )
+        for section in by_priority:
+            if excess <= 0 or section.priority == REQUIRED:
+                break
+            before = section.tokens
+            section.trim_to(before - excess)
+            excess -= before - section.tokens
+        return self
+
+    def log(self):
+        """Uma linha de log com os tokens de cada seção"""
+        sections = ", ".join(
+            f"{name}={section.tokens}"
+            + (f" (-{section.trimmed})" if section.trimmed else "")
+            for name, section in self.sections.items()
+        )
+        level = "warning" if self.tokens > self.max_tokens else "info"
+        getattr(current_app.logger, level)(
+            f"Prompt do chatbot: {self.tokens}/{self.max_tokens} tokens [{sections}]"
+        )
+        record_prompt_usage(self)
+
+
+_stats_lock = threading.Lock()
+_stats = {"prompts": 0, "over_budget": 0, "tokens": {}, "trimmed": {}}
+
+
+def record_prompt_usage(budget):
+    with _stats_lock:
+        _stats["prompts"] += 1
+        _stats["over_budget"] += int(budget.tokens > budget.max_tokens)
+        for name, section in budget.sections.items():
+            _stats["tokens"][name] = _stats["tokens"].get(name, 0) + section.tokens
+            _stats["trimmed"][name] = _stats["trimmed"].get(name, 0) + section.trimmed
+
+
+def prompt_stats():
+    """Médias por seção para /api/metrics"""
+    with _stats_lock:
+        prompts = _stats["prompts"]
+        return {
+            "prompts": prompts,
+            "over_budget": _stats["over_budget"],
+            "mean_tokens": {
+                name: round(total / prompts, 1)
+                for name, total in _stats["tokens"].items()
+            },
+            "mean_items_trimmed": {
+                name: round(total / prompts, 2)
+                for name, total in _stats["trimmed"].items()
+            },
+            "estimate_factor": round(_calibration["factor"], 3),
+            "calibration_samples": _calibration["samples"],
+        }
@@ -0,0 +1,233 @@
+"""
+Extração do JSON de recomendação das respostas do chatbot.
+
+O texto é lido caractere a caractere por uma pequena máquina de estados
+que entende strings e escapes do JSON, e pode ser alimentado em partes
+(streaming). Cada objeto de nível mais alto encontrado vira um
+candidato; o primeiro que tiver a chave "recommendation" e passar na
+validação é o resultado.
+
+Reparos feitos durante a leitura, sem novas varreduras:
+
+- vírgulas sobrando antes de ``}``/``]`` e vírgulas duplicadas são removidas;
+- vírgula faltando entre objetos/listas (``}{``) é inserida;
+- resposta cortada (ex.: max_tokens) ou bloco ```json sem o fechamento é
+  fechada no último valor completo, descartando o que ficou pela metade.
+
+Um candidato que não fecha (ex.: ``Veja {"isso ...`` no texto antes do JSON
+real) é abandonado e a leitura recomeça no próximo ``{`` depois do início
+dele. Só são relidas as chaves que o candidato leu dentro de uma string ou
+que abriram um objeto interno já fechado; as demais seriam lidas igual de
+novo, e pular essas mantém o tempo linear com muitas chaves soltas.
+
+Uso:
+    extractor = RecommendationExtractor()
+    for chunk in chunks:
+        extractor.feed(chunk)
+    recommendation = extractor.finish()
+"""
+import json
+from collections import deque
+
+from app.constants import MACRO_TYPES, MEAL_TYPES
+
+RECOMMENDATION_KEY = '"recommendation"'
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+class RecommendationExtractor:
+    def __init__(self):
+        self.result = None
+        self._pending = deque()  # Caracteres ainda por ler (inclui releituras)
+        self._reset_candidate()
+
+    def _reset_candidate(self):
+        self._chars = []  # Candidato já reparado (sem espaços fora de strings)
+        self._raw = []  # Texto original desde o início do candidato
+        self._stack = []  # Chaves/colchetes abertos
+        self._opened_at = []  # Posição em _raw de cada item de _stack
+        self._retry = None  # Posição em _raw onde recomeçar se não fechar
+        self._in_string = False
+        self._escape = False
+        self._pending_comma = False
+        self._after_close = False  # Último caractere significativo foi } ou ]
+        self._cut = None  # (tamanho, pilha) após o último valor completo
+
+    def feed(self, text):
+        """Processa mais um trecho; devolve o resultado se já foi encontrado"""
+        if self.result is not None:
+            return self.result
+        self._pending.extend(text)
+        self._drain()
+        return self.result
+
+    def finish(self):
+        """Fim do texto: tenta reparar um candidato que ficou aberto"""
+        while self.result is None:
+            self._close_truncated()
+            if not self._pending:
+                break
+            self._drain()
+        return self.result
+
+    def _drain(self):
+        while self._pending and self.result is None:
+            self._feed_char(self._pending.popleft())
+
+    def _close_truncated(self):
+        retry = None
+        if self.result is None and self._stack:
+            if self._cut is not None:
+                size, stack = self._cut
+                repaired = "".join(self._chars[:size]) + "".join(
+                    _CLOSERS[opener] for opener in reversed(stack)
+                )
+                self._accept(repaired)
+            if self.result is None and self._retry is not None:
+                retry = self._raw[self._retry :]
+        self._reset_candidate()
+        if retry:
+            # Relê a partir do próximo "{" antes do que ainda não foi lido
+            self._pending.extendleft(reversed(retry))
+
+    def _feed_char(self, char):
+        if not self._stack:
+            # Fora de JSON: só interessa o início de um objeto
+            if char == "{":
+                self._stack.append(char)
+                self._opened_at.append(0)
+                self._chars.append(char)
+                self._raw.append(char)
+            return
+
+        self._raw.append(char)
+        if self._in_string:
+            self._chars.append(char)
+            if self._escape:
+                self._escape = False
+            elif char == "\\":
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+            elif char == "{" and self._retry is None:
+                self._retry = len(self._raw) - 1
+            return
+
+        if char.isspace():
+            return
+        if char == "`":
+            # Crase fora de string: o texto saiu do JSON (cerca ``` de um
+            # bloco com chaves faltando); o candidato é fechado como cortado
+            self._close_truncated()
+            return
+        if char == ",":
+            # O valor anterior está completo; a vírgula só é emitida quando
+            # vier o próximo valor
+            if not self._pending_comma:
+                self._cut = (len(self._chars), list(self._stack))
+            self._pending_comma = True
+            return
+
+        if char in "}]":
+            self._pending_comma = False  # Vírgula sobrando antes do fechamento
+            self._chars.append(char)
+            self._stack.pop()
+            opened_at = self._opened_at.pop()
+            if self._stack and char == "}" and (
+                self._retry is None or opened_at < self._retry
+            ):
+                self._retry = opened_at
+            self._after_close = True
+            if not self._stack:
+                candidate = "".join(self._chars)
+                self._reset_candidate()
+                self._accept(candidate)
+            else:
+                self._cut = (len(self._chars), list(self._stack))
+            return
+
+        if self._pending_comma or (self._after_close and char in '{["'):
+            self._chars.append(",")
+        self._pending_comma = False
+        self._after_close = False
+        self._chars.append(char)
+        if char in "{[":
+            self._stack.append(char)
+            self._opened_at.append(len(self._raw) - 1)
+        elif char == '"':
+            self._in_string = True
+
+    def _accept(self, candidate):
+        if RECOMMENDATION_KEY not in candidate:
+            return
+        try:
+            data = json.loads(candidate)
+        except json.JSONDecodeError:
+            return
+        self.result = validate_recommendation(data)
+
+
+def _number(value):
+    """float de números ou textos como "150" / "150g"; None se não der"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        text = value.strip().lower().rstrip("g").strip().replace(",", ".")
+        try:
+            return float(text)
+        except ValueError:
+            return None
+    return None
+
+
+def validate_recommendation(data):
+    """
+    Confere a estrutura {"recommendation": true, "meals": [...]}.
+
+    Refeições com tipo desconhecido e alimentos sem código ou quantidade
+    válida são descartados; números em texto são convertidos. Devolve None
+    se não sobrar nenhuma refeição com alimentos.
+    """
+    if not isinstance(data, dict) or not data.get("recommendation"):
+        return None
+    meals = data.get("meals")
+    if not isinstance(meals, list):
+        return None
+
+    valid_meals = []
+    for meal in meals:
+        if not isinstance(meal, dict) or str(meal.get("meal_type")) not in MEAL_TYPES:
+            continue
+        foods = []
+        for food in meal.get("foods") or []:
+            if not isinstance(food, dict):
+                continue
+            code = food.get("code")
+            code = code.strip() if isinstance(code, str) else ""
+            quantity = _number(food.get("quantity"))
+            if not code or not quantity or quantity <= 0:
+                continue
+            name = food.get("name")
+            entry = {
+                "code": code,
+                "name": name if isinstance(name, str) and name else code,
+                "quantity": quantity,
+            }
+            for macro in MACRO_TYPES:
+                entry[macro] = _number(food.get(macro)) or 0.0
+            foods.append(entry)
+        if foods:
+            valid_meals.append({"meal_type": meal["meal_type"], "foods": foods})
+
+    if not valid_meals:
+        return None
+    return {"recommendation": True, "meals": valid_meals}
+
+
+def extract_recommendation(text):
+    """Recomendação validada contida em uma resposta completa (ou None)"""
+    extractor = RecommendationExtractor()
+    extractor.feed(text or "")
+    return extractor.finish()
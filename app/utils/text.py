@@ -0,0 +1,20 @@
+"""
+Normalização de texto para busca de alimentos.
+
+Usuários digitam "acai", "acucar" ou "pao frances" enquanto a base guarda
+"açaí", "açúcar" e "pão francês"; as chaves de busca são sempre comparadas
+na forma normalizada (sem acentos, minúsculas, espaços colapsados).
+"""
+import re
+import unicodedata
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_search_text(text):
+    """Remove acentos, converte para minúsculas e colapsa espaços."""
+    if not text:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", str(text))
+    without_accents = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return _WHITESPACE_RE.sub(" ", without_accents.casefold()).strip()
@@ -41,6 +41,34 @@ class Config:
     ITEMS_PER_PAGE = 10
     MAX_SEARCH_RESULTS = 5
 
+    # Food search index (in-memory autocomplete)
+    FOOD_SEARCH_LIMIT = 10  # Default number of ranked results returned
+    FOOD_SEARCH_PRELOAD = True  # Build the index when the app starts
+    # "memory": ranked in-memory index; "db": indexed queries on the normalized
+    # search_code column (prefix indexes, plus pg_trgm on PostgreSQL)
+    FOOD_SEARCH_BACKEND = os.environ.get("FOOD_SEARCH_BACKEND") or "memory"
+    USER_FOOD_INDEX_CACHE_SIZE = 256  # Users whose custom-food index stays in memory
+    USER_FOOD_INDEX_TTL = 300  # Seconds before a user's index is rebuilt
+    FOOD_USAGE_CACHE_SIZE = 512  # Users whose diary food counts rank their searches
+    FOOD_USAGE_CACHE_TTL = 600
+    FOOD_RESOLVER_CACHE_SIZE = 4096  # Global FoodData rows kept by the food resolver
+    FOOD_RESOLVER_CACHE_TTL = 3600
+    FOOD_CATALOG_CHECK_INTERVAL = int(
+        os.environ.get("FOOD_CATALOG_CHECK_INTERVAL") or 30
+    )  # Seconds between checks for changes in food_data made by other processes
+
+    # Portion calculator
+    PORTION_SOLVER = os.environ.get("PORTION_SOLVER") or "lsq"  # "lsq" or "slsqp"
+    PORTION_DEFAULT_STEP = 5  # Grams, used when rounding is requested without a step
+    PORTION_ROUNDING_BUDGET = 0.1  # Seconds spent searching rounded portions
+    PORTION_CACHE_SIZE = 512  # Solved problems (and warm starts) kept per process
+    PORTION_CACHE_TTL = 600
+    PORTION_POOL_WORKERS = int(
+        os.environ.get("PORTION_POOL_WORKERS") or 1
+    )  # Solver processes per gunicorn worker; 0 solves inline in the request thread
+    PORTION_POOL_MAX_PENDING = 4  # Solves in flight per process before answering 429
+    PORTION_SOLVE_TIMEOUT = 10  # Seconds before a solve is abandoned with a 504
+
     # Email Configuration
     MAIL_SERVER = os.environ.get("MAIL_SERVER") or "smtp.gmail.com"
     MAIL_PORT = int(os.environ.get("MAIL_PORT") or 587)
@@ -62,3 +90,38 @@ class Config:
     # OpenAI API Configuration
     # OPENAI_API_KEY deve estar no .env ou variável de ambiente
     OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+    # Alternative API endpoint (e.g. scripts/openai_stub.py for local testing)
+    OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL")
+    # "structured": reply text and meals as separate JSON schema fields
+    # "text": legacy ```json block embedded in the reply
+    CHATBOT_OUTPUT_MODE = os.environ.get("CHATBOT_OUTPUT_MODE") or "structured"
+    # Chatbot prompt token budget (app/utils/prompt_budget.py): history is
+    # trimmed first, then foods, diary details; rules and the message never are
+    CHATBOT_PROMPT_TOKENS = 6000  # System prompt + history + current message
+    CHATBOT_FOOD_CONTEXT_TOKENS = 1500  # Cap for the food section
+    CHATBOT_HISTORY_TOKENS = 2000  # Cap for previous messages (newest kept)
+    # "estimate": local estimate calibrated with the usage the API reports
+    # "tiktoken": exact count (needs the package and its cached encoding file)
+    CHATBOT_TOKENIZER = os.environ.get("CHATBOT_TOKENIZER") or "estimate"
+    CHATBOT_RETRIEVED_FOODS = 25  # Foods picked by BM25 for the message and the diary
+    CHATBOT_FREQUENT_FOODS = 10  # User's most logged foods
+    # Server-side conversations (app/utils/chat_conversations.py): past
+    # CHATBOT_CONVERSATION_MAX_MESSAGES, older messages are folded into a summary
+    CHATBOT_CONVERSATION_MAX_MESSAGES = 12
+    CHATBOT_CONVERSATION_KEEP_MESSAGES = 6  # Recent messages left after summarizing
+    CHATBOT_SUMMARY_TOKENS = 300  # Max length of the running summary
+    CHATBOT_CONVERSATION_RETENTION_DAYS = 30  # Idle conversations are deleted
+    # Response cache for the first message of a conversation (app/utils/chatbot_cache.py),
+    # keyed by message, diary updated_at, goals and food catalog; off by default
+    CHATBOT_RESPONSE_CACHE = os.environ.get("CHATBOT_RESPONSE_CACHE", "false").lower() in ["true", "on", "1"]
+    CHATBOT_RESPONSE_CACHE_DB = os.environ.get("CHATBOT_RESPONSE_CACHE_DB", "false").lower() in ["true", "on", "1"]  # Share across workers
+    CHATBOT_RESPONSE_CACHE_SIZE = 1024  # Responses kept per process
+    CHATBOT_RESPONSE_CACHE_TTL = 3600
+
+    # OpenAI HTTP client (created once per process in create_app)
+    # Proxy settings are explicit: HTTP_PROXY/HTTPS_PROXY env vars are ignored
+    OPENAI_PROXY = os.environ.get("OPENAI_PROXY")
+    OPENAI_CONNECT_TIMEOUT = 5  # Seconds to open a connection
+    OPENAI_TIMEOUT = 60  # Seconds to wait on each read/write (also between stream chunks)
+    OPENAI_MAX_RETRIES = 2  # Retries on connection errors, 429 and 5xx
+    OPENAI_MAX_CONNECTIONS = 10  # Kept-alive connections shared by all threads
@@ -0,0 +1,37 @@
+"""add chatbot_response_cache table
+
+Revision ID: 24ed9f12da14
+Revises: d716209551a9
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '24ed9f12da14'
+down_revision = 'd716209551a9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'chatbot_response_cache',
+        sa.Column('key', sa.String(length=64), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('payload', sa.JSON(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('key')
+    )
+    op.create_index('ix_chatbot_response_cache_user_id', 'chatbot_response_cache', ['user_id'])
+    op.create_index('ix_chatbot_response_cache_expires_at', 'chatbot_response_cache', ['expires_at'])
+
+
+def downgrade():
+    op.drop_index('ix_chatbot_response_cache_expires_at', table_name='chatbot_response_cache')
+    op.drop_index('ix_chatbot_response_cache_user_id', table_name='chatbot_response_cache')
+    op.drop_table('chatbot_response_cache')
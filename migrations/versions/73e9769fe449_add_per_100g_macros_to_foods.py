@@ -0,0 +1,43 @@
+"""add per-100g macro columns to food_data and user_foods
+
+Revision ID: 73e9769fe449
+Revises: ae02e510f009
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '73e9769fe449'
+down_revision = 'ae02e510f009'
+branch_labels = None
+depends_on = None
+
+
+MACROS = ('calories', 'proteins', 'carbs', 'fats')
+
+
+def upgrade():
+    for table_name in ('food_data', 'user_foods'):
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            for macro in MACROS:
+                batch_op.add_column(
+                    sa.Column(f'{macro}_100g', sa.Float(), nullable=False, server_default='0')
+                )
+
+        # Alimentos com quantidade 0 ficam zerados (antes davam divisão por zero)
+        assignments = ', '.join(
+            f'{macro}_100g = CASE WHEN quantity > 0 '
+            f'THEN 100.0 * {macro} / quantity ELSE 0 END'
+            for macro in MACROS
+        )
+        op.execute(f'UPDATE {table_name} SET {assignments}')
+
+
+def downgrade():
+    for table_name in ('food_data', 'user_foods'):
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            for macro in reversed(MACROS):
+                batch_op.drop_column(f'{macro}_100g')
@@ -0,0 +1,90 @@
+"""add normalized search keys to food_data and user_foods
+
+Revision ID: a3007666b02c
+Revises: 1a8f4454b6d0
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+import re
+import unicodedata
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3007666b02c'
+down_revision = '1a8f4454b6d0'
+branch_labels = None
+depends_on = None
+
+
+def _normalize(text):
+    # Cópia de app.utils.text.normalize_search_text no momento desta migração
+    if not text:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", str(text))
+    without_accents = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return re.sub(r"\s+", " ", without_accents.casefold()).strip()
+
+
+def _backfill(table_name):
+    bind = op.get_bind()
+    table = sa.table(
+        table_name,
+        sa.column('id', sa.Integer),
+        sa.column('code', sa.String),
+        sa.column('name', sa.String),
+        sa.column('search_code', sa.String),
+        sa.column('search_name', sa.String),
+    )
+    rows = bind.execute(sa.select(table.c.id, table.c.code, table.c.name)).fetchall()
+    if not rows:
+        return
+    bind.execute(
+        table.update()
+        .where(table.c.id == sa.bindparam('_id'))
+        .values(search_code=sa.bindparam('_code'), search_name=sa.bindparam('_name')),
+        [
+            {'_id': row.id, '_code': _normalize(row.code), '_name': _normalize(row.name)}
+            for row in rows
+        ],
+    )
+
+
+def upgrade():
+    for table_name in ('food_data', 'user_foods'):
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('search_code', sa.String(length=255), nullable=True))
+            batch_op.add_column(sa.Column('search_name', sa.String(length=255), nullable=True))
+        _backfill(table_name)
+
+    # varchar_pattern_ops permite ao PostgreSQL usar o índice em LIKE 'prefixo%'
+    # (no SQLite a opção é ignorada e a busca por prefixo usa comparação de faixa)
+    op.create_index(
+        'ix_food_data_search_code', 'food_data', ['search_code'],
+        postgresql_ops={'search_code': 'varchar_pattern_ops'},
+    )
+    op.create_index(
+        'ix_food_data_search_name', 'food_data', ['search_name'],
+        postgresql_ops={'search_name': 'varchar_pattern_ops'},
+    )
+    op.create_index(
+        'ix_user_foods_user_search_code', 'user_foods', ['user_id', 'search_code'],
+        postgresql_ops={'search_code': 'varchar_pattern_ops'},
+    )
+    op.create_index(
+        'ix_user_foods_user_search_name', 'user_foods', ['user_id', 'search_name'],
+        postgresql_ops={'search_name': 'varchar_pattern_ops'},
+    )
+
+
+def downgrade():
+    op.drop_index('ix_user_foods_user_search_name', table_name='user_foods')
+    op.drop_index('ix_user_foods_user_search_code', table_name='user_foods')
+    op.drop_index('ix_food_data_search_name', table_name='food_data')
+    op.drop_index('ix_food_data_search_code', table_name='food_data')
+    for table_name in ('food_data', 'user_foods'):
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.drop_column('search_name')
+            batch_op.drop_column('search_code')
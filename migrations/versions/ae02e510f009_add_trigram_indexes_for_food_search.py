@@ -0,0 +1,47 @@
+"""add pg_trgm GIN indexes for food search
+
+Revision ID: ae02e510f009
+Revises: a3007666b02c
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ae02e510f009'
+down_revision = 'a3007666b02c'
+branch_labels = None
+depends_on = None
+
+
+TRIGRAM_INDEXES = [
+    ('ix_food_data_search_code_trgm', 'food_data', 'search_code'),
+    ('ix_food_data_search_name_trgm', 'food_data', 'search_name'),
+    ('ix_user_foods_search_code_trgm', 'user_foods', 'search_code'),
+    ('ix_user_foods_search_name_trgm', 'user_foods', 'search_name'),
+]
+
+
+def upgrade():
+    # Índices de trigramas só existem no PostgreSQL; no SQLite a busca
+    # continua usando prefixo + LIKE
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for index_name, table_name, column in TRIGRAM_INDEXES:
+        op.create_index(
+            index_name, table_name, [column],
+            postgresql_using='gin',
+            postgresql_ops={column: 'gin_trgm_ops'},
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    for index_name, table_name, _ in TRIGRAM_INDEXES:
+        op.drop_index(index_name, table_name=table_name)
@@ -0,0 +1,40 @@
+"""add chat_conversations table
+
+Revision ID: d716209551a9
+Revises: d937aff168af
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd716209551a9'
+down_revision = 'd937aff168af'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'chat_conversations',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('session_id', sa.String(length=32), nullable=False),
+        sa.Column('summary', sa.Text(), nullable=True),
+        sa.Column('summarized_messages', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('messages', sa.JSON(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'session_id', name='unique_user_chat_session')
+    )
+    # Limpeza de conversas antigas filtra por updated_at
+    op.create_index('ix_chat_conversations_updated_at', 'chat_conversations', ['updated_at'])
+
+
+def downgrade():
+    op.drop_index('ix_chat_conversations_updated_at', table_name='chat_conversations')
+    op.drop_table('chat_conversations')
@@ -0,0 +1,103 @@
+"""add precomputed meal categories to food_data and user_foods
+
+Revision ID: d937aff168af
+Revises: 73e9769fe449
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd937aff168af'
+down_revision = '73e9769fe449'
+branch_labels = None
+depends_on = None
+
+
+# Cópia das palavras-chave de app.utils.meal_categories no momento desta migração
+_CAFE = [
+    "pão", "torrada", "bolacha", "biscoito", "cereal", "aveia", "granola",
+    "leite", "iogurte", "queijo", "requeijão", "manteiga", "margarina", "ovo",
+    "ovos", "omelete", "fruta", "banana", "maçã", "laranja", "suco", "café",
+    "chá", "mel", "geleia", "marmelada", "creme", "tapioca", "crepioca",
+    "panqueca", "waffle",
+]
+_ALMOCO = [
+    "arroz", "feijão", "batata", "batata doce", "mandioca", "aipim", "macarrão",
+    "massa", "lasanha", "frango", "frango grelhado", "carne", "bife", "peixe",
+    "salmão", "tilápia", "sardinha", "salada", "alface", "tomate", "cenoura",
+    "brócolis", "couve", "ovo frito", "ovo cozido", "hambúrguer", "pizza",
+    "strogonoff", "parmegiana", "moqueca", "feijoada", "churrasco",
+    "churrasquinho",
+]
+_LANCHE = [
+    "fruta", "banana", "maçã", "laranja", "pera", "uva", "mamão", "iogurte",
+    "queijo", "bolacha", "biscoito", "cereal", "barra", "castanha", "amendoim",
+    "nozes", "suco", "vitamina", "smoothie",
+]
+_CEIA = [
+    "chá", "leite", "iogurte", "fruta", "banana", "bolacha", "biscoito",
+    "queijo", "castanha", "amendoim",
+]
+_MEAL_KEYWORDS = [
+    ('cafe_da_manha', _CAFE),
+    ('almoco', _ALMOCO),
+    ('janta', _ALMOCO),
+    ('lanche_manha', _LANCHE),
+    ('lanche_tarde', _LANCHE),
+    ('ceia', _CEIA),
+]
+
+
+def _meal_categories(name):
+    name = (name or "").lower()
+    return ",".join(
+        meal_type
+        for meal_type, keywords in _MEAL_KEYWORDS
+        if any(keyword in name for keyword in keywords)
+    )
+
+
+def _backfill(table_name):
+    bind = op.get_bind()
+    table = sa.table(
+        table_name,
+        sa.column('id', sa.Integer),
+        sa.column('name', sa.String),
+        sa.column('meal_categories', sa.String),
+    )
+    rows = bind.execute(sa.select(table.c.id, table.c.name)).fetchall()
+    if not rows:
+        return
+    bind.execute(
+        table.update()
+        .where(table.c.id == sa.bindparam('_id'))
+        .values(meal_categories=sa.bindparam('_categories')),
+        [{'_id': row.id, '_categories': _meal_categories(row.name)} for row in rows],
+    )
+
+
+def upgrade():
+    for table_name in ('food_data', 'user_foods'):
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('meal_categories', sa.String(length=120), nullable=True))
+        _backfill(table_name)
+
+    # O prompt do chatbot filtra food_data com LIKE '%tipo%'; no PostgreSQL um
+    # índice de trigramas atende essa consulta (pg_trgm criado em ae02e510f009)
+    if op.get_bind().dialect.name == 'postgresql':
+        op.create_index(
+            'ix_food_data_meal_categories_trgm', 'food_data', ['meal_categories'],
+            postgresql_using='gin',
+            postgresql_ops={'meal_categories': 'gin_trgm_ops'},
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_food_data_meal_categories_trgm', table_name='food_data')
+    for table_name in ('food_data', 'user_foods'):
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.drop_column('meal_categories')
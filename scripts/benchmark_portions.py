@@ -0,0 +1,334 @@
+"""
+Benchmark do cálculo de porções (app/utils/portion_solver.py).
+
+Gera conjuntos de problemas reproduzíveis a partir de data/food.xlsx (número de
+alimentos, tolerância apertada/folgada, casos viáveis e inviáveis) e executa
+cada um:
+
+- direto no solver (``solve_portions``), para cada método;
+- pela rota /api/calculate_portions com o test client do Flask (SQLite em
+  memória, cálculo inline, sem cache de soluções).
+
+O resultado é um JSON com p50/p95 de latência, iterações, taxa de sucesso e
+erro em relação aos alvos por grupo. Com ``--baseline`` os números são
+comparados com um JSON salvo anteriormente.
+
+Uso:
+    python scripts/benchmark_portions.py --output bench.json
+    python scripts/benchmark_portions.py --baseline bench.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+
+from app import create_app, db
+from app.models import FoodData, User
+from app.utils.food_resolver import MACROS
+from app.utils.portion_solver import METHODS, PortionProblem, solve_portions
+from config import Config
+
+EXCEL_COLUMNS = ("Calorias", "Proteínas", "Carboidratos", "Gorduras")
+SIZES = (3, 5, 10, 20)
+TOLERANCES = {"tight": 0.05, "loose": 0.2}
+KINDS = ("feasible", "infeasible")
+MAX_PORTION = 400  # Limite superior de cada alimento nos problemas gerados
+
+
+class BenchmarkConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    SESSION_PROTECTION = None
+    FOOD_SEARCH_PRELOAD = False
+    PORTION_POOL_WORKERS = 0
+    PORTION_CACHE_TTL = 0  # Cada repetição precisa resolver de novo
+
+
+def load_foods(path):
+    """Códigos e vetores por 100g dos alimentos com quantidade válida"""
+    df = pd.read_excel(path)
+    df = df.dropna(subset=["identificador", "Quantidade"])
+    df = df[df["Quantidade"] > 0].drop_duplicates("identificador")
+    per_100g = df[list(EXCEL_COLUMNS)].fillna(0).to_numpy(dtype=float)
+    per_100g = per_100g / df["Quantidade"].to_numpy(dtype=float)[:, None] * 100
+    rows = [
+        {
+            "code": str(code),
+            "name": str(name)[:100],
+            "quantity": float(quantity),
+            "values": [float(v) for v in values],
+        }
+        for code, name, quantity, values in zip(
+            df["identificador"],
+            df["alimento"],
+            df["Quantidade"],
+            df[list(EXCEL_COLUMNS)].fillna(0).to_numpy(dtype=float),
+        )
+    ]
+    return rows, per_100g
+
+
+def generate_problems(n_foods_total, per_100g, seed, per_group):
+    """
+    Problemas determinísticos para cada (tamanho, tolerância, tipo).
+
+    Viáveis: alvos = macros de porções aleatórias dentro dos limites.
+    Inviáveis: o mesmo, mas com um macro pedindo o triplo do máximo alcançável.
+    """
+    rng = np.random.default_rng(seed)
+    problems = []
+    for size in SIZES:
+        for tolerance_name, tolerance in TOLERANCES.items():
+            for kind in KINDS:
+                for _ in range(per_group):
+                    index = rng.choice(n_foods_total, size=size, replace=False)
+                    portions = rng.uniform(20, 250, size)
+                    totals = portions @ per_100g[index] / 100
+                    if kind == "infeasible":
+                        macro = int(rng.integers(len(MACROS)))
+                        totals[macro] = (
+                            3 * MAX_PORTION * per_100g[index, macro].sum() / 100 + 1
+                        )
+                    problems.append(
+                        {
+                            "group": f"n{size}-{tolerance_name}-{kind}",
+                            "kind": kind,
+                            "index": index.tolist(),
+                            "targets": dict(zip(MACROS, totals.round(2).tolist())),
+                            "tolerance": tolerance,
+                        }
+                    )
+    return problems
+
+
+def target_error(values, targets):
+    """Maior erro relativo entre os totais e os alvos ativos"""
+    errors = [
+        abs(values[i] - targets[macro]) / targets[macro]
+        for i, macro in enumerate(MACROS)
+        if targets[macro] > 0
+    ]
+    return max(errors) if errors else 0.0
+
+
+def run_direct(problems, per_100g, method, repeat):
+    samples = []
+    for spec in problems:
+        problem = PortionProblem(
+            per_100g[spec["index"]],
+            spec["targets"],
+            spec["tolerance"],
+            bounds=[(0, MAX_PORTION)] * len(spec["index"]),
+        )
+        for _ in range(repeat):
+            start = time.perf_counter()
+            solution = solve_portions(problem, method=method)
+            elapsed = time.perf_counter() - start
+        totals = problem.nutrients(solution.x).sum(axis=0)
+        samples.append(
+            {
+                "group": spec["group"],
+                "kind": spec["kind"],
+                "latency_ms": elapsed * 1000,
+                "iterations": solution.iterations,
+                "success": bool(solution.success),
+                "error": (
+                    target_error(totals, spec["targets"]) if solution.success else None
+                ),
+            }
+        )
+    return samples
+
+
+def run_client(problems, foods, method, repeat):
+    app = create_app(BenchmarkConfig)
+    samples = []
+    with app.app_context():
+        db.create_all()
+        used = sorted({i for spec in problems for i in spec["index"]})
+        for i in used:
+            food = foods[i]
+            calories, proteins, carbs, fats = food["values"]
+            db.session.add(
+                FoodData(
+                    code=food["code"],
+                    name=food["name"],
+                    quantity=food["quantity"],
+                    calories=calories,
+                    proteins=proteins,
+                    carbs=carbs,
+                    fats=fats,
+                )
+            )
+        user = User(
+            username="benchmark",
+            email="benchmark@example.com",
+            nome="Benchmark",
+            idade=30,
+            altura=1.75,
+            peso=75,
+            sexo="M",
+            fator_atividade="moderado",
+            objetivo="manter_peso",
+        )
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = str(user_id)
+        session["_fresh"] = True
+
+    for spec in problems:
+        body = {
+            "targets": spec["targets"],
+            "tolerance": spec["tolerance"],
+            "solver": method,
+            "foods": [
+                {"code": foods[i]["code"], "min": 0, "max": MAX_PORTION}
+                for i in spec["index"]
+            ],
+        }
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = client.post("/api/calculate_portions", json=body)
+            elapsed = time.perf_counter() - start
+        data = response.get_json() or {}
+        success = response.status_code == 200 and data.get("success", False)
+        error = None
+        if success:
+            totals = [sum(p[macro] for p in data["portions"]) for macro in MACROS]
+            error = target_error(totals, spec["targets"])
+        samples.append(
+            {
+                "group": spec["group"],
+                "kind": spec["kind"],
+                "latency_ms": elapsed * 1000,
+                "iterations": None,
+                "success": bool(success),
+                "error": error,
+            }
+        )
+    return samples
+
+
+def summarize(samples):
+    """Estatísticas por grupo a partir das amostras individuais"""
+    groups = {}
+    for sample in samples:
+        groups.setdefault(sample["group"], []).append(sample)
+
+    summary = {}
+    for group, items in sorted(groups.items()):
+        latencies = np.array([item["latency_ms"] for item in items])
+        iterations = [
+            item["iterations"] for item in items if item["iterations"] is not None
+        ]
+        errors = [item["error"] for item in items if item["error"] is not None]
+        expected = [item["success"] == (item["kind"] == "feasible") for item in items]
+        summary[group] = {
+            "count": len(items),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+            "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+            "mean_iterations": (
+                round(float(np.mean(iterations)), 2) if iterations else None
+            ),
+            "success_rate": round(
+                float(np.mean([item["success"] for item in items])), 3
+            ),
+            "expected_outcome_rate": round(float(np.mean(expected)), 3),
+            "mean_target_error": round(float(np.mean(errors)), 5) if errors else None,
+        }
+    return summary
+
+
+def compare(results, baseline):
+    """Razão atual/baseline de p50 e p95 e diferença de sucesso por grupo"""
+    comparison = {}
+    for run, groups in results["runs"].items():
+        for group, stats in groups.items():
+            base = baseline.get("runs", {}).get(run, {}).get(group)
+            if not base:
+                continue
+            comparison.setdefault(run, {})[group] = {
+                "p50_ratio": (
+                    round(stats["p50_ms"] / base["p50_ms"], 3)
+                    if base["p50_ms"]
+                    else None
+                ),
+                "p95_ratio": (
+                    round(stats["p95_ms"] / base["p95_ms"], 3)
+                    if base["p95_ms"]
+                    else None
+                ),
+                "success_rate_delta": round(
+                    stats["success_rate"] - base["success_rate"], 3
+                ),
+            }
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do cálculo de porções")
+    parser.add_argument(
+        "--foods", default=os.path.join(Config.BASE_DIR, "data", "food.xlsx")
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--per-group", type=int, default=10, help="Problemas por grupo")
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="Execuções por problema (vale a última)"
+    )
+    parser.add_argument("--methods", nargs="+", default=list(METHODS), choices=METHODS)
+    parser.add_argument(
+        "--skip-client", action="store_true", help="Só o solver, sem a rota Flask"
+    )
+    parser.add_argument("--output", help="Arquivo JSON de saída (padrão: stdout)")
+    parser.add_argument(
+        "--baseline", help="JSON de uma execução anterior para comparar"
+    )
+    args = parser.parse_args()
+
+    foods, per_100g = load_foods(args.foods)
+    problems = generate_problems(len(foods), per_100g, args.seed, args.per_group)
+
+    results = {
+        "seed": args.seed,
+        "per_group": args.per_group,
+        "foods_file": os.path.basename(args.foods),
+        "runs": {},
+    }
+    for method in args.methods:
+        print(f"Solver direto ({method})...", file=sys.stderr)
+        results["runs"][f"direct-{method}"] = summarize(
+            run_direct(problems, per_100g, method, args.repeat)
+        )
+        if not args.skip_client:
+            print(f"Rota Flask ({method})...", file=sys.stderr)
+            results["runs"][f"client-{method}"] = summarize(
+                run_client(problems, foods, method, args.repeat)
+            )
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            results["comparison"] = compare(results, json.load(f))
+
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+        print(f"Resultados salvos em {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+Corpus de respostas do chatbot para o extrator de recomendações
+(app/utils/recommendation_extractor.py).
+
+Cada caso é uma resposta real ou típica do modelo, incluindo as quebradas
+que já apareceram (vírgulas sobrando, chaves faltando, resposta cortada por
+max_tokens, JSON sem bloco de código). Todos os casos são conferidos com o
+texto inteiro e também entregue em partes de vários tamanhos, como no
+streaming. No final, um texto grande com muitas chaves soltas verifica que o
+tempo continua linear.
+
+Uso:
+    python scripts/check_recommendation_extractor.py
+"""
+
+import os
+import sys
+import time
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.recommendation_extractor import (
+    RecommendationExtractor,
+    extract_recommendation,
+)
+
+CHUNK_SIZES = (1, 2, 3, 7, 64)
+
+FOOD_ARROZ = '{"code": "ARR001", "name": "Arroz", "quantity": 100, "calories": 130, "proteins": 2.5, "carbs": 28, "fats": 0.3}'
+FOOD_FRANGO = '{"code": "FRA010", "name": "Frango", "quantity": 120, "calories": 198, "proteins": 37, "carbs": 0, "fats": 4.3}'
+FOOD_PAO = '{"code": "PAO002", "name": "Pão {integral}", "quantity": 50, "calories": 125, "proteins": 5, "carbs": 22, "fats": 2}'
+
+# (nome, resposta, esperado) - esperado: [(meal_type, [códigos])] ou None
+CASES = [
+    (
+        "bloco json correto",
+        "Sugestão de almoço:\n```json\n"
+        f'{{"recommendation": true, "meals": [{{"meal_type": "almoco", "foods": [{FOOD_ARROZ}, {FOOD_FRANGO}]}}]}}'
+        "\n```\nGostaria que eu adicione esta recomendação ao seu diário de hoje?",
+        [("almoco", ["ARR001", "FRA010"])],
+    ),
+    (
+        "vírgulas sobrando",
+        "```json\n"
+        f'{{"recommendation": true, "meals": [{{"meal_type": "almoco", "foods": [{FOOD_ARROZ},],}},],}}'
+        "\n```",
+        [("almoco", ["ARR001"])],
+    ),
+    (
+        "vírgulas duplicadas",
+        f'```json\n{{"recommendation": true,, "meals": [{{"meal_type": "almoco", "foods": [{FOOD_ARROZ},, {FOOD_FRANGO}]}}]}}\n```',
+        [("almoco", ["ARR001", "FRA010"])],
+    ),
+    (
+        "vírgula faltando entre alimentos",
+        f'```json\n{{"recommendation": true, "meals": [{{"meal_type": "almoco", "foods": [{FOOD_ARROZ}\n{FOOD_FRANGO}]}}]}}\n```',
+        [("almoco", ["ARR001", "FRA010"])],
+    ),
+    (
+        "vírgula faltando entre refeições",
+        '```json\n{"recommendation": true, "meals": ['
+        f'{{"meal_type": "cafe_da_manha", "foods": [{FOOD_PAO}]}}'
+        f'{{"meal_type": "almoco", "foods": [{FOOD_ARROZ}]}}'
+        "]}\n```",
+        [("cafe_da_manha", ["PAO002"]), ("almoco", ["ARR001"])],
+    ),
+    (
+        "cortada no meio de um alimento (max_tokens)",
+        "Aqui está:\n```json\n"
+        f'{{"recommendation": true, "meals": [{{"meal_type": "almoco", "foods": [{FOOD_ARROZ}, {FOOD_FRANGO}, {{"code": "FEI003", "name": "Feij',
+        [("almoco", ["ARR001", "FRA010"])],
+    ),
+    (
+        "cortada depois da quantidade",
+        '```json\n{"recommendation": true, "meals": [{"meal_type": "janta", "foods": [{"code": "ARR001", "quantity": 80, "calories": 10',
+        [("janta", ["ARR001"])],
+    ),
+    (
+        "chaves de fechamento faltando antes da cerca",
+        f'```json\n{{"recommendation": true, "meals": [{{"meal_type": "almoco", "foods": [{FOOD_ARROZ}]\n```\nGostaria?',
+        [("almoco", ["ARR001"])],
+    ),
+    (
+        "json sem bloco de código",
+        "Recomendo o seguinte: "
+        f'{{"recommendation": true, "meals": [{{"meal_type": "lanche_tarde", "foods": [{FOOD_PAO}]}}]}}'
+        " Gostaria que eu adicione?",
+        [("lanche_tarde", ["PAO002"])],
+    ),
+    (
+        "cerca sem linguagem",
+        f'```\n{{"recommendation": true, "meals": [{{"meal_type": "ceia", "foods": [{FOOD_PAO}]}}]}}\n```',
+        [("ceia", ["PAO002"])],
+    ),
+    (
+        "chaves no texto antes do json",
+        "Sua meta {diária} é 2000 kcal e o lanche {opcional pode ficar de fora.\n```json\n"
+        f'{{"recommendation": true, "meals": [{{"meal_type": "almoco", "foods": [{FOOD_ARROZ}]}}]}}'
+        "\n```",
+        [("almoco", ["ARR001"])],
+    ),
+    (
+        "chaves e aspas escapadas dentro de strings",
+        '```json\n{"recommendation": true, "meals": [{"meal_type": "almoco", "foods": ['
+        '{"code": "SAL001", "name": "Salada \\"verde\\" {sem molho}, ok", "quantity": 80, "calories": 20, "proteins": 1, "carbs": 3, "fats": 0}'
+        "]}]}\n```",
+        [("almoco", ["SAL001"])],
+    ),
+    (
+        "chave sem fechamento no texto antes de um bloco json",
+        'Veja {"isso pode mudar. Sugestão:\n```json\n'
+        f'{{"recommendation": true, "meals": [{{"meal_type": "almoco", "foods": [{FOOD_ARROZ}]}}]}}'
+        "\n```",
+        [("almoco", ["ARR001"])],
+    ),
+    (
+        "chave sem fechamento no texto antes de json sem bloco",
+        'Veja {"isso pode mudar. Sugestão: '
+        f'{{"recommendation": true, "meals": [{{"meal_type": "janta", "foods": [{FOOD_FRANGO}]}}]}}'
+        " Gostaria?",
+        [("janta", ["FRA010"])],
+    ),
+    (
+        "json dentro de uma chave que nunca fecha",
+        "Veja {nota: "
+        f'{{"recommendation": true, "meals": [{{"meal_type": "ceia", "foods": [{FOOD_PAO}]}}]}}'
+        " e só.",
+        [("ceia", ["PAO002"])],
+    ),
+    (
+        "exemplo sem recommendation antes do json real",
+        'Formato: {"meal_type": "almoco"}. Agora a sugestão:\n```json\n'
+        f'{{"recommendation": true, "meals": [{{"meal_type": "almoco", "foods": [{FOOD_FRANGO}]}}]}}'
+        "\n```",
+        [("almoco", ["FRA010"])],
+    ),
+    (
+        "quantidades em texto",
+        '```json\n{"recommendation": true, "meals": [{"meal_type": "almoco", "foods": ['
+        '{"code": "ARR001", "name": "Arroz", "quantity": "150g", "calories": "195", "proteins": "3,8", "carbs": 42, "fats": 0.4}'
+        "]}]}\n```",
+        [("almoco", ["ARR001"])],
+    ),
+    (
+        "tipo de refeição inválido descartado",
+        '```json\n{"recommendation": true, "meals": ['
+        f'{{"meal_type": "jantar", "foods": [{FOOD_FRANGO}]}}, '
+        f'{{"meal_type": "almoco", "foods": [{FOOD_ARROZ}]}}'
+        "]}\n```",
+        [("almoco", ["ARR001"])],
+    ),
+    (
+        "alimentos sem código ou quantidade descartados",
+        '```json\n{"recommendation": true, "meals": [{"meal_type": "almoco", "foods": ['
+        '{"name": "Sem código", "quantity": 100}, {"code": "ZER000", "quantity": 0}, '
+        f"{FOOD_ARROZ}"
+        "]}]}\n```",
+        [("almoco", ["ARR001"])],
+    ),
+    (
+        "recommendation false",
+        f'```json\n{{"recommendation": false, "meals": [{{"meal_type": "almoco", "foods": [{FOOD_ARROZ}]}}]}}\n```',
+        None,
+    ),
+    (
+        "refeições vazias",
+        '```json\n{"recommendation": true, "meals": []}\n```',
+        None,
+    ),
+    (
+        "aspas simples (não é JSON)",
+        "```json\n{'recommendation': True, 'meals': []}\n```",
+        None,
+    ),
+    (
+        "sem json",
+        "A proteína ajuda na saciedade. Quer que eu monte um cardápio?",
+        None,
+    ),
+]
+
+
+def summarize(recommendation):
+    if recommendation is None:
+        return None
+    return [
+        (meal["meal_type"], [food["code"] for food in meal["foods"]])
+        for meal in recommendation["meals"]
+    ]
+
+
+def extract_in_chunks(text, size):
+    extractor = RecommendationExtractor()
+    for start in range(0, len(text), size):
+        extractor.feed(text[start : start + size])
+    return extractor.finish()
+
+
+def check_linear_time():
+    """Texto com muitas chaves soltas: o tempo deve crescer de forma linear"""
+    block = (
+        "```json\n"
+        f'{{"recommendation": true, "meals": [{{"meal_type": "almoco", "foods": [{FOOD_ARROZ}]}}]}}'
+        "\n```"
+    )
+    timings = []
+    for size in (2_000, 20_000):
+        text = "{ " * size + block
+        start = time.perf_counter()
+        result = extract_recommendation(text)
+        timings.append(time.perf_counter() - start)
+        if summarize(result) != [("almoco", ["ARR001"])]:
+            return False, f"resultado errado com {size} chaves soltas"
+    ratio = timings[1] / timings[0] if timings[0] else 0
+    # 10x mais texto; uma varredura quadrática daria ~100x
+    return ratio < 30, f"{timings[0] * 1000:.1f} ms -> {timings[1] * 1000:.1f} ms"
+
+
+def main():
+    failures = 0
+    for name, text, expected in CASES:
+        results = {"inteiro": summarize(extract_recommendation(text))}
+        for size in CHUNK_SIZES:
+            results[f"partes de {size}"] = summarize(extract_in_chunks(text, size))
+        wrong = {mode: got for mode, got in results.items() if got != expected}
+        if wrong:
+            failures += 1
+            print(f"FALHOU  {name}")
+            for mode, got in wrong.items():
+                print(f"        {mode}: {got!r} (esperado {expected!r})")
+        else:
+            print(f"ok      {name}")
+
+    linear, detail = check_linear_time()
+    print(f"{'ok' if linear else 'FALHOU':<8}tempo linear ({detail})")
+    if not linear:
+        failures += 1
+
+    print(f"\n{len(CASES) + 1 - failures}/{len(CASES) + 1} casos ok")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,8 +5,11 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import pandas as pd
+from sqlalchemy import or_
 from app import create_app, db
 from app.models import FoodData
+from app.utils.food_catalog import notify_catalog_changed
+from app.models.food_fields import update_derived_food_fields
 from config import Config
 
 
@@ -191,6 +194,18 @@ def import_food_data(clear_existing=False, show_progress=True, filename="food.xl
                 db.session.rollback()
                 raise e
 
+            # New rows get their search keys, per-100g macros and meal categories
+            # from the model listener; fill in any older rows that predate them
+            stale_foods = FoodData.query.filter(
+                or_(FoodData.search_code.is_(None), FoodData.meal_categories.is_(None))
+            ).all()
+            if stale_foods:
+                if show_progress:
+                    print(f"Updating derived fields for {len(stale_foods)} existing records...")
+                for food in stale_foods:
+                    update_derived_food_fields(food)
+                db.session.commit()
+
             # Print summary
             print("\n" + "=" * 60)
             print("IMPORT SUMMARY")
@@ -207,6 +222,10 @@ def import_food_data(clear_existing=False, show_progress=True, filename="food.xl
             total_in_db = FoodData.query.count()
             print(f"Total food records in database: {total_in_db}")
 
+            # Rebuild in-memory search structures (other processes pick the
+            # change up on their next catalog check)
+            notify_catalog_changed()
+
         except FileNotFoundError as e:
             print(f"ERROR: {str(e)}")
             print(
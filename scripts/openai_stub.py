@@ -0,0 +1,200 @@
+"""
+Servidor local que imita POST /v1/chat/completions da OpenAI, para testar o
+chatbot sem chave nem rede.
+
+Responde nos dois formatos do chatbot (ver app/utils/chatbot_prompt.py):
+com ``response_format`` devolve {"reply", "meals"}; sem, devolve texto com o
+bloco ```json. Os alimentos recomendados são os primeiros códigos que
+aparecem no prompt do sistema. Suporta ``stream=True`` (com
+``stream_options.include_usage``) e informa uma contagem aproximada de tokens.
+
+Uso:
+    python scripts/openai_stub.py --port 8765 --delay 0.02
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=stub flask run
+"""
+
+import argparse
+import json
+import re
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CODE_RE = re.compile(r"Código: ([^,)]+)")
+RECOMMENDATION_WORDS = ("recomend", "sugest", "sugira", "dieta", "cardápio", "refeição")
+CHUNK_SIZE = 4  # Caracteres por chunk no streaming
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def build_reply(messages, structured, malformed):
+    system_prompt = messages[0]["content"] if messages else ""
+    user_message = messages[-1]["content"].lower() if messages else ""
+    codes = list(dict.fromkeys(CODE_RE.findall(system_prompt)))[:2]
+
+    if not codes or not any(word in user_message for word in RECOMMENDATION_WORDS):
+        text = "Olá! Posso sugerir refeições com base nas suas metas. 😊"
+        if structured:
+            return json.dumps({"reply": text, "meals": []}, ensure_ascii=False)
+        return text
+
+    foods = [
+        {
+            "code": code,
+            "name": code,
+            "quantity": 100,
+            "calories": 150,
+            "proteins": 10,
+            "carbs": 15,
+            "fats": 5,
+        }
+        for code in codes
+    ]
+    meals = [{"meal_type": "almoco", "foods": foods}]
+    names = " e ".join(f"{code} (código: {code})" for code in codes)
+    text = f"Para o almoço, sugiro 100g de {names}. 🍽️"
+    question = "Gostaria que eu adicione esta recomendação ao seu diário de hoje?"
+
+    if structured:
+        return json.dumps(
+            {"reply": f"{text}\n\n{question}", "meals": meals}, ensure_ascii=False
+        )
+
+    block = json.dumps(
+        {"recommendation": True, "meals": meals}, indent=2, ensure_ascii=False
+    )
+    if malformed:
+        # Vírgula sobrando e chave final faltando, como às vezes vem do modelo
+        block = block.replace("\n      ]", ",\n      ]")[:-1]
+    return f"{text}\n\n```json\n{block}\n```\n\n{question}"
+
+
+class CompletionsHandler(BaseHTTPRequestHandler):
+    delay = 0.0
+    first_token_delay = 0.0
+    malformed = False
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        messages = body.get("messages", [])
+        structured = bool(body.get("response_format"))
+        content = build_reply(messages, structured, self.malformed)
+        usage = {
+            "prompt_tokens": estimate_tokens(
+                "".join(m.get("content") or "" for m in messages)
+            ),
+            "completion_tokens": estimate_tokens(content),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        base = {
+            "id": completion_id,
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+        }
+
+        time.sleep(self.first_token_delay)
+        if body.get("stream"):
+            self._stream(base, content, usage, body.get("stream_options") or {})
+            return
+
+        response = {
+            **base,
+            "object": "chat.completion",
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": usage,
+        }
+        payload = json.dumps(response, ensure_ascii=False).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _stream(self, base, content, usage, stream_options):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        def send(data):
+            self.wfile.write(f"data: {data}\n\n".encode())
+            self.wfile.flush()
+
+        def chunk(delta, finish_reason=None):
+            return json.dumps(
+                {
+                    **base,
+                    "object": "chat.completion.chunk",
+                    "choices": [
+                        {"index": 0, "delta": delta, "finish_reason": finish_reason}
+                    ],
+                },
+                ensure_ascii=False,
+            )
+
+        send(chunk({"role": "assistant", "content": ""}))
+        for start in range(0, len(content), CHUNK_SIZE):
+            time.sleep(self.delay)
+            send(chunk({"content": content[start : start + CHUNK_SIZE]}))
+        send(chunk({}, "stop"))
+        if stream_options.get("include_usage"):
+            send(
+                json.dumps(
+                    {
+                        **base,
+                        "object": "chat.completion.chunk",
+                        "choices": [],
+                        "usage": usage,
+                    }
+                )
+            )
+        send("[DONE]")
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub local da API de chat da OpenAI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--delay", type=float, default=0.0, help="Segundos entre chunks no streaming"
+    )
+    parser.add_argument(
+        "--first-token-delay",
+        type=float,
+        default=0.0,
+        help="Segundos antes do primeiro byte da resposta",
+    )
+    parser.add_argument(
+        "--malformed",
+        action="store_true",
+        help="No formato texto, envia o bloco JSON com vírgula sobrando e sem a chave final",
+    )
+    args = parser.parse_args()
+
+    CompletionsHandler.delay = args.delay
+    CompletionsHandler.first_token_delay = args.first_token_delay
+    CompletionsHandler.malformed = args.malformed
+    server = ThreadingHTTPServer((args.host, args.port), CompletionsHandler)
+    print(f"Stub da OpenAI em http://{args.host}:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()